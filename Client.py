@@ -2,7 +2,10 @@
 
 #==============================================================================
  #       Author:  Andy Garcia
- #     Language:  Python3 (random, argparse, socket, os, signal)
+ #     Language:  Python3 (random, argparse, socket, os, signal, Protocol,
+ #                         time, json, array, shlex, subprocess, sys,
+ #                         concurrent.futures, asyncio, resource, select,
+ #                         multiprocessing, LazyImport)
  #   To Compile:  n/a
  #
  #-----------------------------------------------------------------------------
@@ -11,10 +14,17 @@
  #
  #        Input:  Command line switches and arguments.
  #
- #       Output:  Outputs path for file containing datastream results
+ #       Output:  Outputs path for file containing datastream results, or a
+ #                throughput and latency report when benchmarking
  #
  #    Algorithm:  Connects to server using child processes to retrieve ticket 
- #                numbers based on the lottery game chosen.
+ #                numbers based on the lottery game chosen. Benchmarks run
+ #                child processes in closed or open loop for a duration and
+ #                send their latencies to the parent through pipes. The
+ #                asyncio engine multiplexes every connection of a process
+ #                on one event loop instead of forking per connection.
+ #                Results from every connection go through a pipe to one
+ #                writer process that appends them to the file in batches.
  #
  #   Required Features Not Included:  n/a
  #
@@ -24,7 +34,16 @@
  #
 #==============================================================================
 
-import random, argparse, socket, os, signal
+import random, argparse, socket, os, signal, Protocol, time, json, array
+import shlex, sys, resource, select, multiprocessing, LazyImport
+
+#Engines and benchmarks that need these load them the first time they run
+asyncio = LazyImport.lazyImport("asyncio")
+concurrent = LazyImport.lazyImport("concurrent.futures")
+subprocess = LazyImport.lazyImport("subprocess")
+
+#Connection attempts made while the server keeps answering busy
+BUSY_RETRIES = 5
 
 #Displays help menu and switches that are supported with the program
 def programSwitches():
@@ -49,6 +68,11 @@ def programSwitches():
     parser.add_argument("-p", help="Rmote socket port", type=int,
                         dest="socketPort", default=1234, required=False)
 
+    #Adds switch for reaching a server on the same host through a unix socket
+    parser.add_argument("-U", help="Unix socket path, replaces -r and -p",
+                        type=str, dest="unixPath", default=None,
+                        required=False)
+
     #Adds switch for requesting unique identifier 
     parser.add_argument("-u", help="Unique Identifier", type=str, 
                         dest="uniqueID", default="0000", required=False)
@@ -56,6 +80,99 @@ def programSwitches():
     parser.add_argument("-c", help="Number of connections", type=int,
                         dest="numConnections", default=1, required=False)
 
+    #Adds switch for requesting tickets with the binary protocol
+    parser.add_argument("-b", help="Use binary protocol", action="store_true",
+                        dest="binaryProtocol", default=False, required=False)
+
+    #Adds switch for pipelining several binary requests on one connection
+    parser.add_argument("-k", help="Requests per connection", type=int,
+                        dest="numRequests", default=1, required=False)
+
+    #Adds switch for sending the orders of many users in one bulk request
+    parser.add_argument("--bulk", help="Orders per bulk request, 0 sends one "
+                        "order per connection", type=int, dest="bulkSize",
+                        default=0, required=False)
+
+    #Adds switches for where and how results are written
+    parser.add_argument("-o", help="Results file", type=str,
+                        dest="outputPath", default="/home/lab/results.txt",
+                        required=False)
+
+    parser.add_argument("--format", help="Results file format", type=str,
+                        dest="outputFormat", choices=["text", "jsonl",
+                                                      "binary"],
+                        default="text", required=False)
+
+    #Adds switches for when the results writer flushes its batch
+    parser.add_argument("--flush-bytes", help="Flush results after this many "
+                        "bytes", type=int, dest="flushBytes", default=65536,
+                        required=False)
+
+    parser.add_argument("--flush-ms", help="Flush results after this many "
+                        "milliseconds", type=float, dest="flushMs", default=200,
+                        required=False)
+
+    #Adds switch for choosing how connections are driven
+    parser.add_argument("-e", "--engine", help="Client engine", type=str,
+                        dest="engine", choices=["fork", "asyncio"],
+                        default="fork", required=False)
+
+    #Adds switch for spreading asyncio connections over processes, 0 for one
+    #process per core
+    parser.add_argument("--procs", help="Processes for the asyncio engine",
+                        type=int, dest="numProcs", default=1, required=False)
+
+    #Adds switch for running a benchmark for a number of seconds
+    parser.add_argument("-d", help="Benchmark duration in seconds", type=float,
+                        dest="duration", default=0, required=False)
+
+    #Adds switch for choosing how benchmark requests are issued
+    parser.add_argument("--mode", help="Closed or open loop benchmark",
+                        type=str, dest="benchMode", choices=["closed", "open"],
+                        default="closed", required=False)
+
+    #Adds switch for the target request rate of open loop benchmarks
+    parser.add_argument("--rate", help="Target requests per second", type=float,
+                        dest="requestRate", default=100, required=False)
+
+    #Adds switch for the mix of lottery games, weighted like "649:5,max:1"
+    parser.add_argument("--mix", help="Weighted lottery game mix", type=str,
+                        dest="gameMix", default="649,max,lot", required=False)
+
+    #Adds switch for the range of tickets per benchmark request
+    parser.add_argument("--tickets", help="Tickets per request, as N or N-M",
+                        type=str, dest="ticketRange", default="1-5",
+                        required=False)
+
+    #Adds switch for the threads issuing open loop requests in each child
+    parser.add_argument("--threads", help="Open loop threads per child",
+                        type=int, dest="numThreads", default=32,
+                        required=False)
+
+    #Adds switch for the benchmark request timeout
+    parser.add_argument("--timeout", help="Benchmark request timeout", 
+                        type=float, dest="requestTimeout", default=10,
+                        required=False)
+
+    #Adds switch for writing the benchmark report as JSON
+    parser.add_argument("--json", help="Write benchmark report as JSON",
+                        type=str, dest="jsonPath", default=None,
+                        required=False)
+
+    #Adds switches for starting local servers to benchmark each engine
+    parser.add_argument("--spawn-server", help="Start a local Server.py for "
+                        "each engine, like fork,asyncio,prefork", type=str,
+                        dest="spawnEngines", default=None, required=False)
+
+    parser.add_argument("--server-args", help="Extra Server.py switches",
+                        type=str, dest="serverArgs", default="",
+                        required=False)
+
+    #Adds switch for timing cold starts of the spawned servers
+    parser.add_argument("--startup-runs", help="Time this many starts of "
+                        "each --spawn-server engine", type=int,
+                        dest="startupRuns", default=0, required=False)
+
     #Parses arguments
     args = parser.parse_args()
     
@@ -66,34 +183,292 @@ def programSwitches():
 #Creates a socket to connect to remote addresses
 def socketConnection(userArgs):
 
-    #Filepath to store file with results of each ticket
-    outputFilepath = r"/home/lab/results.txt"
-
     #Creates socket number from parsed arguments
-    socketNumber = (userArgs["socketAddress"], userArgs["socketPort"])
+    socketNumber = serverAddress(userArgs)
 
     signal.signal(signal.SIGCHLD, signalHandler)     
 
-    #Loops based on the number of connections requested
-    for userCounter in range(userArgs["numConnections"]):
-        
-        processID = os.fork()
+    #Starts the process writing results of every child to the file
+    resultsWriter = ResultsWriter(userArgs)
 
-        #Child process will execute
-        if processID == 0:
-            
-            #Creates child process to request for ticket
-            handleChild(outputFilepath, userCounter, socketNumber)
-            exit()
+    #Sends the orders of many users together, one child per bulk request
+    if userArgs["bulkSize"] > 0:
+
+        for bulkStart in range(0, userArgs["numConnections"],
+                               userArgs["bulkSize"]):
+
+            processID = os.fork()
+
+            if processID == 0:
+
+                handleBulk(resultsWriter, range(bulkStart, min(
+                           bulkStart + userArgs["bulkSize"],
+                           userArgs["numConnections"])), socketNumber)
+                exit()
+
+    else:
+
+        #Loops based on the number of connections requested
+        for userCounter in range(userArgs["numConnections"]):
+
+            processID = os.fork()
+
+            #Child process will execute
+            if processID == 0:
+
+                #Creates child process to request for ticket
+                handleChild(resultsWriter, userCounter, socketNumber)
+                exit()
+
+    #Writer finishes once every child has closed its end of the pipe
+    resultsWriter.close()
             
-    print(f"Note: Data will be written to \"/home/lab/results.txt\"")
+    print(f"Note: Data will be written to \"{userArgs['outputPath']}\"")
+
+
+#Unique ID of a simulated user, the separator keeps pid 12 user 34 apart
+#from pid 123 user 4
+def userUniqueID(userCounter):
+
+    return f"{os.getpid()}-{userCounter}"
+
 
 #Simulates multiple requests by creating child processes to request tickets
-def handleChild(outputFilepath, userCounter, socketNumber):
+def handleChild(resultsWriter, userCounter, socketNumber):
     
     #List of lottery games for random choice
     lotteryChoices = ["649", "max", "lot"]
 
+    #Binary requests run as a keep-alive session
+    if userArgs["binaryProtocol"]:
+
+        handleSession(resultsWriter, userCounter, socketNumber)
+        return
+
+    #Connects to server and receives welcome message
+    socketObject = connectSocket(socketNumber)
+
+    #Arbitrary arguments for each child of the parent process
+    userArgs["uniqueID"] = userUniqueID(userCounter)
+    userArgs["numTickets"] = random.randint(1,5)
+    userArgs["lotteryType"] = random.choice(lotteryChoices)
+
+    #Keep connection alive until message is received.
+    while True:
+
+        #Sends arguments to server for ticket results
+        try:
+
+            socketObject.send(bytes(str(userArgs), "utf-8"))
+        
+        except socket.error as e:
+
+            print(f"Failed to send, error code: {e}.")
+            exit()
+
+        #Receives data stream until the server closes the connection
+        try:
+
+            responseChunks = []
+
+            while True:
+
+                dataReceived = socketObject.recv(65536)
+
+                if not dataReceived:
+
+                    break
+
+                responseChunks.append(dataReceived)
+
+            #Sends the whole response to the results writer at once
+            resultsWriter.send(encodeTextResponse(userArgs["lotteryType"],
+                                                  b"".join(responseChunks)))
+
+            #Closes socket connection and closes program
+            socketObject.close()
+            break
+            
+        #Error handling if not successful
+        except Exception as e:
+
+            print(f"Could not write results to {userArgs['outputPath']}")
+            socketObject.close()
+            break
+
+
+#Requests the tickets of many users in one bulk request on one connection
+def handleBulk(resultsWriter, userCounters, socketNumber):
+
+    #List of lottery games for random choice
+    lotteryChoices = ["649", "max", "lot"]
+
+    #Arbitrary order for each user, as handleChild would send it
+    bulkOrders = [{"uniqueID": userUniqueID(userCounter),
+                   "lotteryType": random.choice(lotteryChoices),
+                   "numTickets": random.randint(1,5)}
+                  for userCounter in userCounters]
+
+    lotteryTypes = {bulkOrder["uniqueID"]: bulkOrder["lotteryType"]
+                    for bulkOrder in bulkOrders}
+
+    socketObject = connectSocket(socketNumber)
+    responseMessages = []
+
+    try:
+
+        #Binary orders are answered with one frame each, tagged by unique ID
+        if userArgs["binaryProtocol"]:
+
+            socketObject.sendall(Protocol.packBulkRequest(bulkOrders))
+            frameReader = Protocol.FrameReader(socketObject)
+
+            for bulkOrder in bulkOrders:
+
+                frame = frameReader.readFrame()
+
+                if frame is None:
+
+                    raise ConnectionError("Server closed the session")
+
+                try:
+
+                    responseMessages.append(encodeFrame(*frame))
+
+                except ValueError as e:
+
+                    print(f"Order {frame[0]['uniqueID']} failed, error code: "
+                          f"{e}.")
+
+        else:
+
+            socketObject.sendall(bytes(str({"orders": bulkOrders}), "utf-8"))
+
+            responseChunks = []
+
+            while True:
+
+                dataReceived = socketObject.recv(65536)
+
+                if not dataReceived:
+
+                    break
+
+                responseChunks.append(dataReceived)
+
+            #Every order of the response opens with its unique ID
+            for orderText in b"".join(responseChunks).decode("utf-8") \
+                                                   .split("Unique ID: ")[1:]:
+
+                uniqueID, orderText = orderText.split("\n", 1)
+
+                if orderText.startswith("Error: "):
+
+                    print(f"Order {uniqueID} failed, error code: "
+                          f"{orderText[len('Error: '):].strip()}.")
+                    continue
+
+                responseMessages.append(encodeTextResponse(
+                                        lotteryTypes.get(uniqueID),
+                                        bytes(f"Unique ID: {uniqueID}\n" +
+                                              orderText, "utf-8")))
+
+    except (ValueError, ConnectionError, socket.error) as e:
+
+        print(f"Failed to receive, error code: {e}.")
+
+    socketObject.close()
+
+    #Sends every response of the bulk request to the results writer at once
+    try:
+
+        resultsWriter.send(b"".join(responseMessages))
+
+    #Error handling if not successful
+    except Exception as e:
+
+        print(f"Could not write results to {userArgs['outputPath']}")
+
+
+#Connects to the server, waiting out busy replies, and receives its welcome
+def connectSocket(socketNumber):
+
+    for attemptNum in range(BUSY_RETRIES):
+
+        socketObject = openSocket(socketNumber)
+
+        #Receives server welcome message, or a busy line when shed
+        retryAfter = Protocol.parseBusy(socketObject.recv(1024))
+
+        if retryAfter is None:
+
+            return socketObject
+
+        #Jitter keeps shed clients from all coming back at the same moment
+        socketObject.close()
+        time.sleep(retryAfter * random.uniform(1, 2))
+
+    print(f"Server still busy after {BUSY_RETRIES} attempts.")
+    exit()
+
+
+#Returns the unix socket path or the address and port of the server
+def serverAddress(userArgs):
+
+    if userArgs["unixPath"]:
+
+        return userArgs["unixPath"]
+
+    return (userArgs["socketAddress"], userArgs["socketPort"])
+
+
+#Connects a socket to a unix socket path or a TCP address and port
+def createConnection(socketNumber, timeout=None):
+
+    if isinstance(socketNumber, str):
+
+        socketObject = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        socketObject.settimeout(timeout)
+
+        try:
+
+            socketObject.connect(socketNumber)
+
+        except socket.error:
+
+            socketObject.close()
+            raise
+
+        return socketObject
+
+    return socket.create_connection(socketNumber, timeout)
+
+
+#Opens an asyncio stream to a unix socket path or a TCP address and port
+async def openStream(socketNumber):
+
+    if isinstance(socketNumber, str):
+
+        return await asyncio.open_unix_connection(socketNumber)
+
+    return await asyncio.open_connection(*socketNumber)
+
+
+#Opens a TCP connection to the server
+def openSocket(socketNumber):
+
+    #Connections on the same host skip the TCP stack
+    if isinstance(socketNumber, str):
+
+        try:
+
+            return createConnection(socketNumber)
+
+        except socket.error as e:
+
+            print(f"Failed to connect to socket, error code: {e}")
+            exit()
+
     #Creates socket and handles errors on failure
     try:
 
@@ -130,77 +505,1291 @@ def handleChild(outputFilepath, userCounter, socketNumber):
             print(f"Failed to connect to socket, error code: {e}")
             exit()
 
-    #Receives server welcome message
-    dataReceived = socketObject.recv(1024)
-    dataDecoded = dataReceived.decode("utf-8")
+    return socketObject
 
-    #Arbitrary arguments for each child of the parent process
-    userArgs["uniqueID"] = str(os.getpid()) + str(userCounter)
-    userArgs["numTickets"] = random.randint(1,5)
-    userArgs["lotteryType"] = random.choice(lotteryChoices)
 
-    #Keep connection alive until message is received.
-    while True:
+#Pipelines every binary request of a child on keep-alive connections
+def handleSession(resultsWriter, userCounter, socketNumber):
 
-        #Sends arguments to server for ticket results
-        try:
+    #List of lottery games for random choice
+    lotteryChoices = ["649", "max", "lot"]
 
-            socketObject.send(bytes(str(userArgs), "utf-8"))
-        
-        except socket.error as e:
+    numRequests = max(1, userArgs["numRequests"])
 
-            print(f"Failed to send, error code: {e}.")
-            exit()
+    #Builds every request frame of the session up front
+    pendingFrames = []
+
+    for requestNum in range(numRequests):
+
+        uniqueID = userUniqueID(userCounter)
+
+        if numRequests > 1:
+
+            uniqueID += f".{requestNum}"
+
+        pendingFrames.append(Protocol.packRequest(
+                                            random.choice(lotteryChoices),
+                                            random.randint(1,5),
+                                            uniqueID))
+
+    responseMessages = []
+
+    #Reconnects when the server ends a session before every request is answered
+    while pendingFrames:
+
+        socketObject = connectSocket(socketNumber)
+        frameReader = Protocol.FrameReader(socketObject)
+        numAnswered = 0
 
-        #Receives message from server then closes connection
-        dataReceived = socketObject.recv(4096, socket.MSG_WAITALL)
-        dataDecoded = dataReceived.decode("utf-8")
-        
-        #Outputs decoded data into file
         try:
 
-            #Opens file with append option
-            with open(outputFilepath, 'a') as outputFile:
+            #Sends every pending request without waiting for responses
+            socketObject.sendall(b"".join(pendingFrames))
 
-                #Writes data stream to file
-                outputFile.write(dataDecoded)
+            #Responses arrive in the order the requests were sent
+            while pendingFrames:
 
-                #Closes socket connection and closes program
-                socketObject.close()
-                break
-            
-        #Error handling if not successful
-        except Exception as e:
+                frame = frameReader.readFrame()
+
+                if frame is None:
+
+                    raise ConnectionError("Server closed the session")
+
+                pendingFrames.pop(0)
+                numAnswered += 1
+
+                try:
+
+                    responseMessages.append(encodeFrame(*frame))
+
+                except ValueError as e:
+
+                    print(f"Request failed, error code: {e}.")
+
+                #Server answers nothing after the last frame of a session
+                if frame[0]["lastFrame"]:
+
+                    break
+
+        except (ValueError, ConnectionError, socket.error) as e:
+
+            print(f"Failed to receive, error code: {e}.")
+            pendingFrames.clear()
+
+        socketObject.close()
+
+        #Gives up instead of looping when a session answered nothing
+        if numAnswered == 0:
 
-            print(f"Could not write to file in {outputFilepath}")
-            socketObject.close()
             break
 
+    #Sends every response of the session to the results writer at once
+    try:
 
-#Handles fork'd children and prevents zombie children        
-def signalHandler(sigNum, sigFrame):
+        resultsWriter.send(b"".join(responseMessages))
 
-    #Waits for children process and does not block     
-    while True:
+    #Error handling if not successful
+    except Exception as e:
 
-        try:
-            
-            processID, exitStatus = os.waitpid(-1, os.WNOHANG)
-        
-        except OSError:
-            
-            return
-            
+        print(f"Could not write results to {userArgs['outputPath']}")
 
-        if processID == 0:
 
-            return
+#Encodes a binary response frame in the results file format
+def encodeFrame(frameHeader, payload):
 
+    if frameHeader["frameType"] == Protocol.FRAME_ERROR:
 
-if __name__ == "__main__":
+        raise ValueError(payload.decode("utf-8"))
 
-    #Stores arguments into a dictionary 
-    userArgs = vars(programSwitches())
-    
-    #Creates socket connection
-    socketConnection(userArgs)
\ No newline at end of file
+    tickets = Protocol.unpackNumbers(frameHeader, payload)
+
+    return encodeResult(frameHeader["uniqueID"], frameHeader["lotteryType"],
+                        tickets)
+
+
+#Encodes a text protocol response in the results file format
+def encodeTextResponse(lotteryType, responseBytes):
+
+    #Text results keep the response exactly as the server sent it
+    if userArgs["outputFormat"] == "text":
+
+        return responseBytes
+
+    uniqueID = None
+    tickets = []
+
+    #Rebuilds tickets from the "Unique ID", "Ticket" and set lines
+    for responseLine in responseBytes.decode("utf-8").splitlines():
+
+        if responseLine.startswith("Unique ID: "):
+
+            uniqueID = responseLine[len("Unique ID: "):]
+
+        elif responseLine.startswith("Ticket: "):
+
+            tickets.append([])
+
+        elif responseLine.startswith("[") and tickets:
+
+            tickets[-1].append([int(number) for number in
+                                responseLine.strip("[]").split(",")])
+
+    return encodeResult(uniqueID, lotteryType, tickets)
+
+
+#Encodes one response as text, a JSON line or a binary response frame
+def encodeResult(uniqueID, lotteryType, tickets):
+
+    if userArgs["outputFormat"] == "jsonl":
+
+        return bytes(json.dumps({"uniqueID": uniqueID,
+                                 "lotteryType": lotteryType,
+                                 "tickets": tickets},
+                                separators=(",", ":")) + "\n", "utf-8")
+
+    #Binary results are the frames of the wire protocol, read them back with
+    #Protocol.unpackHeader and Protocol.unpackNumbers
+    if userArgs["outputFormat"] == "binary":
+
+        return Protocol.packResponse(lotteryType, uniqueID, tickets)
+
+    return bytes(Protocol.formatTickets(uniqueID, tickets), "utf-8")
+
+
+#Writer process appending results from every client process to one file
+class ResultsWriter:
+
+    def __init__(self, userArgs):
+
+        readFd, self.writeFd = os.pipe()
+
+        #Keeps each result contiguous when several processes share the pipe
+        self.lock = multiprocessing.Lock()
+
+        self.processID = os.fork()
+
+        if self.processID == 0:
+
+            os.close(self.writeFd)
+
+            try:
+
+                writeBatches(readFd, userArgs["outputPath"],
+                             userArgs["flushBytes"], userArgs["flushMs"] / 1000)
+
+            finally:
+
+                os._exit(0)
+
+        os.close(readFd)
+
+    #Sends one encoded result through the pipe
+    def send(self, data):
+
+        dataView = memoryview(data)
+
+        with self.lock:
+
+            while dataView:
+
+                dataView = dataView[os.write(self.writeFd, dataView):]
+
+    #Closes this process's end of the pipe
+    def close(self):
+
+        os.close(self.writeFd)
+
+    #Waits until the writer has flushed everything to the file
+    def wait(self):
+
+        os.waitpid(self.processID, 0)
+
+
+#Copies results from the pipe to the file, flushing by size or by time
+def writeBatches(readFd, outputFilepath, flushBytes, flushSeconds):
+
+    buffer = bytearray()
+    batchStart = None
+
+    #Opens file with append option once for every result
+    with open(outputFilepath, 'ab') as outputFile:
+
+        while True:
+
+            #Waits for more results, or until the batch is due to be flushed
+            waitTime = None if batchStart is None else \
+                       max(0, batchStart + flushSeconds - time.monotonic())
+
+            readyFds, _, _ = select.select([readFd], [], [], waitTime)
+
+            if readyFds:
+
+                dataReceived = os.read(readFd, 65536)
+
+                #Every client process closed the pipe
+                if not dataReceived:
+
+                    break
+
+                if batchStart is None:
+
+                    batchStart = time.monotonic()
+
+                buffer += dataReceived
+
+            if buffer and (len(buffer) >= flushBytes or
+                           time.monotonic() - batchStart >= flushSeconds):
+
+                outputFile.write(buffer)
+                outputFile.flush()
+                buffer.clear()
+                batchStart = None
+
+        outputFile.write(buffer)
+
+
+#Drives every connection from asyncio event loops instead of forked children
+def asyncConnections(userArgs):
+
+    #Creates socket number from parsed arguments
+    socketNumber = serverAddress(userArgs)
+
+    #Starts the process writing results of every connection to the file
+    resultsWriter = ResultsWriter(userArgs)
+
+    raiseFileLimit()
+
+    numProcs = userArgs["numProcs"] or os.cpu_count() or 1
+    numProcs = max(1, min(numProcs, userArgs["numConnections"]))
+
+    #A single process runs its event loop directly
+    if numProcs == 1:
+
+        asyncio.run(runAsyncChildren(resultsWriter,
+                                     range(userArgs["numConnections"]),
+                                     socketNumber))
+
+    else:
+
+        processIDs = []
+
+        #Each process takes every numProcs'th connection
+        for procNum in range(numProcs):
+
+            processID = os.fork()
+
+            if processID == 0:
+
+                try:
+
+                    asyncio.run(runAsyncChildren(
+                                    resultsWriter,
+                                    range(procNum, userArgs["numConnections"],
+                                          numProcs),
+                                    socketNumber))
+
+                finally:
+
+                    os._exit(0)
+
+            processIDs.append(processID)
+
+        for processID in processIDs:
+
+            os.waitpid(processID, 0)
+
+    resultsWriter.close()
+    resultsWriter.wait()
+
+    print(f"Note: Data will be written to \"{userArgs['outputPath']}\"")
+
+
+#Raises the open file limit so one process can hold many connections
+def raiseFileLimit():
+
+    softLimit, hardLimit = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+    if softLimit != hardLimit:
+
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hardLimit, hardLimit))
+
+
+#Runs one coroutine per simulated user and sends each response to the writer
+async def runAsyncChildren(resultsWriter, userCounters, socketNumber):
+
+    #Responses are queued for a single task that sends them off the event
+    #loop, so a full pipe or a contended lock never stalls the connections
+    resultQueue = asyncio.Queue()
+    writerTask = asyncio.create_task(sendResults(resultsWriter, resultQueue))
+
+    try:
+
+        await asyncio.gather(*(asyncChild(resultQueue, userCounter,
+                                          socketNumber)
+                               for userCounter in userCounters))
+
+    finally:
+
+        #Marks the end of the responses once every user finished
+        resultQueue.put_nowait(None)
+        await writerTask
+
+
+#Hands queued responses to the writer from a thread, responses queued while
+#one is sent go through the pipe together
+async def sendResults(resultsWriter, resultQueue):
+
+    eventLoop = asyncio.get_running_loop()
+
+    while True:
+
+        queuedResults = [await resultQueue.get()]
+
+        while not resultQueue.empty():
+
+            queuedResults.append(resultQueue.get_nowait())
+
+        isFinished = queuedResults[-1] is None
+
+        if isFinished:
+
+            queuedResults.pop()
+
+        if queuedResults:
+
+            await eventLoop.run_in_executor(None, resultsWriter.send,
+                                            b"".join(queuedResults))
+
+        if isFinished:
+
+            return
+
+
+#Requests tickets for one simulated user like a forked child does
+async def asyncChild(resultQueue, userCounter, socketNumber):
+
+    #List of lottery games for random choice
+    lotteryChoices = ["649", "max", "lot"]
+
+    try:
+
+        #Binary requests run as a keep-alive session
+        if userArgs["binaryProtocol"]:
+
+            responseMessages = await asyncSession(userCounter, socketNumber)
+            resultQueue.put_nowait(b"".join(responseMessages))
+            return
+
+        #Arbitrary arguments for each simulated user
+        childArgs = dict(userArgs,
+                         uniqueID=userUniqueID(userCounter),
+                         numTickets=random.randint(1,5),
+                         lotteryType=random.choice(lotteryChoices))
+
+        reader, writer = await openAsyncConnection(socketNumber)
+
+        writer.write(bytes(str(childArgs), "utf-8"))
+
+        #Text responses end when the server closes the connection
+        resultQueue.put_nowait(encodeTextResponse(childArgs["lotteryType"],
+                                                  await reader.read()))
+        writer.close()
+
+    except (ValueError, ConnectionError, socket.error,
+            asyncio.IncompleteReadError) as e:
+
+        print(f"Failed to receive, error code: {e}.")
+
+
+#Connects on the event loop, waiting out busy replies, and reads the welcome
+async def openAsyncConnection(socketNumber):
+
+    for attemptNum in range(BUSY_RETRIES):
+
+        reader, writer = await openStream(socketNumber)
+
+        #Receives server welcome message, or a busy line when shed
+        retryAfter = Protocol.parseBusy(await reader.readline())
+
+        if retryAfter is None:
+
+            return reader, writer
+
+        #Jitter keeps shed clients from all coming back at the same moment
+        writer.close()
+        await asyncio.sleep(retryAfter * random.uniform(1, 2))
+
+    raise ConnectionError(f"Server still busy after {BUSY_RETRIES} attempts")
+
+
+#Pipelines the binary requests of one simulated user on keep-alive sessions
+async def asyncSession(userCounter, socketNumber):
+
+    #List of lottery games for random choice
+    lotteryChoices = ["649", "max", "lot"]
+
+    numRequests = max(1, userArgs["numRequests"])
+
+    #Builds every request frame of the session up front
+    pendingFrames = []
+
+    for requestNum in range(numRequests):
+
+        uniqueID = userUniqueID(userCounter)
+
+        if numRequests > 1:
+
+            uniqueID += f".{requestNum}"
+
+        pendingFrames.append(Protocol.packRequest(
+                                            random.choice(lotteryChoices),
+                                            random.randint(1,5),
+                                            uniqueID))
+
+    responseMessages = []
+
+    #Reconnects when the server ends a session before every request is answered
+    while pendingFrames:
+
+        reader, writer = await openAsyncConnection(socketNumber)
+
+        buffer = bytearray()
+        numAnswered = 0
+
+        #Sends every pending request without waiting for responses
+        writer.write(b"".join(pendingFrames))
+
+        #Responses arrive in the order the requests were sent
+        while pendingFrames:
+
+            frame = await Protocol.readFrameAsync(reader, buffer)
+
+            if frame is None:
+
+                raise ConnectionError("Server closed the session")
+
+            pendingFrames.pop(0)
+            numAnswered += 1
+
+            try:
+
+                responseMessages.append(encodeFrame(*frame))
+
+            except ValueError as e:
+
+                print(f"Request failed, error code: {e}.")
+
+            #Server answers nothing after the last frame of a session
+            if frame[0]["lastFrame"]:
+
+                break
+
+        writer.close()
+
+        #Gives up instead of looping when a session answered nothing
+        if numAnswered == 0:
+
+            break
+
+    return responseMessages
+
+
+#Runs the benchmark against a remote server or freshly started local servers
+def runBenchmark(userArgs):
+
+    socketNumber = serverAddress(userArgs)
+    benchReports = []
+
+    if userArgs["spawnEngines"]:
+
+        for engineName in userArgs["spawnEngines"].split(","):
+
+            serverProcess = startServer(userArgs, engineName)
+
+            try:
+
+                benchReport = benchmarkServer(userArgs, socketNumber)
+
+            finally:
+
+                serverCpu = stopServer(serverProcess)
+
+            #CPU the server spent per answered request, forks included
+            benchReport["engine"] = engineName
+            benchReport["serverCpuSeconds"] = round(serverCpu, 3)
+            benchReport["serverCpuPerRequestUs"] = round(
+                serverCpu / max(1, benchReport["requests"] -
+                                benchReport["errors"]) * 1e6, 1)
+            benchReports.append(benchReport)
+
+    else:
+
+        benchReports.append(benchmarkServer(userArgs, socketNumber))
+
+    printReport(benchReports)
+
+    #Writes the report for CI and later comparison
+    if userArgs["jsonPath"]:
+
+        with open(userArgs["jsonPath"], "w") as jsonFile:
+
+            json.dump(benchReports, jsonFile, indent=2)
+
+        print(f"Note: Report written to \"{userArgs['jsonPath']}\"")
+
+
+#Starts Server.py in the foreground
+def launchServer(userArgs, engineName):
+
+    serverPath = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              "Server.py")
+    logPath = f"/tmp/lottery-bench-{engineName}-{os.getpid()}.log"
+
+    serverCommand = [sys.executable, serverPath, "run",
+                     "-l", userArgs["socketAddress"],
+                     "-p", str(userArgs["socketPort"]),
+                     "-e", engineName, "--logfile", logPath]
+    serverCommand += shlex.split(userArgs["serverArgs"])
+
+    return subprocess.Popen(serverCommand, stdout=subprocess.DEVNULL)
+
+
+#Starts Server.py in the foreground and waits until it accepts connections
+def startServer(userArgs, engineName):
+
+    serverProcess = launchServer(userArgs, engineName)
+
+    #Polls the port until the server answers or gives up after ten seconds
+    deadline = time.monotonic() + 10
+
+    while time.monotonic() < deadline:
+
+        if serverProcess.poll() is not None:
+
+            raise RuntimeError(f"Server.py exited with status "
+                               f"{serverProcess.returncode}")
+
+        try:
+
+            createConnection(serverAddress(userArgs), 1).close()
+            return serverProcess
+
+        except socket.error:
+
+            time.sleep(0.05)
+
+    stopServer(serverProcess)
+    raise RuntimeError("Server.py did not start listening")
+
+
+#Starts every --spawn-server engine several times and reports how long each
+#start took to accept its first connection and answer its first request
+def runStartupBenchmark(userArgs):
+
+    startupReports = []
+
+    for engineName in (userArgs["spawnEngines"] or "fork").split(","):
+
+        startupTimes = [timeStartup(userArgs, engineName)
+                        for runNum in range(userArgs["startupRuns"])]
+
+        startupReports.append({
+            "engine": engineName,
+            "runs": len(startupTimes),
+            "firstAcceptMs": summarizeStartup([acceptTime for acceptTime, _
+                                               in startupTimes]),
+            "firstResponseMs": summarizeStartup([responseTime for _,
+                                                 responseTime in
+                                                 startupTimes])})
+
+    printStartupReport(startupReports)
+
+    if userArgs["jsonPath"]:
+
+        with open(userArgs["jsonPath"], "w") as jsonFile:
+
+            json.dump(startupReports, jsonFile, indent=2)
+
+        print(f"Note: Report written to \"{userArgs['jsonPath']}\"")
+
+
+#Times one start of a local server, from launch to its welcome message on the
+#first connection and to the end of its first answered request
+def timeStartup(userArgs, engineName):
+
+    socketNumber = serverAddress(userArgs)
+    launchTime = time.perf_counter()
+    serverProcess = launchServer(userArgs, engineName)
+
+    try:
+
+        deadline = time.monotonic() + 10
+
+        #The welcome message is only sent once a connection was accepted
+        while True:
+
+            if serverProcess.poll() is not None:
+
+                raise RuntimeError(f"Server.py exited with status "
+                                   f"{serverProcess.returncode}")
+
+            try:
+
+                with createConnection(socketNumber, 1) as socketObject:
+
+                    if socketObject.recv(1024):
+
+                        break
+
+            except socket.error:
+
+                if time.monotonic() > deadline:
+
+                    raise RuntimeError("Server.py did not start accepting")
+
+                time.sleep(0.002)
+
+        acceptTime = time.perf_counter() - launchTime
+
+        if not timeRequest(userArgs, socketNumber, userArgs["lotteryType"],
+                           userArgs["numTickets"], "startup"):
+
+            raise RuntimeError("First request after start failed")
+
+        responseTime = time.perf_counter() - launchTime
+
+    finally:
+
+        stopServer(serverProcess)
+
+    return acceptTime, responseTime
+
+
+#Minimum, median and maximum of startup times in milliseconds
+def summarizeStartup(startupTimes):
+
+    startupTimes = sorted(startupTimes)
+
+    return {"min": round(startupTimes[0] * 1000, 1),
+            "p50": round(startupTimes[len(startupTimes) // 2] * 1000, 1),
+            "max": round(startupTimes[-1] * 1000, 1)}
+
+
+#Prints startup reports as a table
+def printStartupReport(startupReports):
+
+    columns = ["engine", "runs", "accept min", "accept p50", "accept max",
+               "resp min", "resp p50", "resp max"]
+
+    print("".join(f"{column:>11}" for column in columns))
+
+    for startupReport in startupReports:
+
+        acceptMs = startupReport["firstAcceptMs"]
+        responseMs = startupReport["firstResponseMs"]
+
+        rowValues = [startupReport["engine"], startupReport["runs"],
+                     acceptMs["min"], acceptMs["p50"], acceptMs["max"],
+                     responseMs["min"], responseMs["p50"], responseMs["max"]]
+
+        print("".join(f"{str(rowValue):>11}" for rowValue in rowValues))
+
+
+#Stops a local server started for a benchmark and returns its CPU seconds
+def stopServer(serverProcess):
+
+    #Reaped children count the server and every process it reaped itself
+    usageBefore = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    serverProcess.terminate()
+
+    try:
+
+        serverProcess.wait(timeout=10)
+
+    except subprocess.TimeoutExpired:
+
+        serverProcess.kill()
+        serverProcess.wait()
+
+    usageAfter = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    return usageAfter.ru_utime + usageAfter.ru_stime - \
+           usageBefore.ru_utime - usageBefore.ru_stime
+
+
+#Forks benchmark children and aggregates the latencies they report
+def benchmarkServer(userArgs, socketNumber):
+
+    numChildren = max(1, userArgs["numConnections"])
+
+    #Asyncio children each multiplex their share of the connections
+    if userArgs["engine"] == "asyncio":
+
+        raiseFileLimit()
+
+        numChildren = userArgs["numProcs"] or os.cpu_count() or 1
+        numChildren = max(1, min(numChildren, userArgs["numConnections"]))
+    childPipes = []
+
+    #Children run from a common start time
+    startTime = time.time() + 0.2
+
+    for childNum in range(numChildren):
+
+        readFd, writeFd = os.pipe()
+        processID = os.fork()
+
+        #Child process runs its share of the load and reports through a pipe
+        if processID == 0:
+
+            os.close(readFd)
+
+            try:
+
+                if userArgs["engine"] == "asyncio":
+
+                    latencies = asyncio.run(asyncBenchWorker(
+                                                userArgs, socketNumber,
+                                                childNum, numChildren,
+                                                startTime))
+
+                else:
+
+                    latencies = benchWorker(userArgs, socketNumber, childNum,
+                                            numChildren, startTime)
+
+                with os.fdopen(writeFd, "wb") as pipeOutput:
+
+                    pipeOutput.write(latencies.tobytes())
+
+            finally:
+
+                os._exit(0)
+
+        os.close(writeFd)
+        childPipes.append((processID, readFd))
+
+    #Negative latencies mark failed requests
+    latencies = array.array("d")
+
+    for processID, readFd in childPipes:
+
+        with os.fdopen(readFd, "rb") as pipeInput:
+
+            latencies.frombytes(pipeInput.read())
+
+        os.waitpid(processID, 0)
+
+    elapsed = time.time() - startTime
+
+    return summarizeLatencies(userArgs, latencies, elapsed)
+
+
+#Issues requests until the duration ends and returns their latencies
+def benchWorker(userArgs, socketNumber, childNum, numChildren, startTime):
+
+    gameChoices, gameWeights = parseMix(userArgs["gameMix"])
+    lowTickets, highTickets = parseRange(userArgs["ticketRange"])
+
+    latencies = array.array("d")
+    endTime = startTime + userArgs["duration"]
+    requestNum = 0
+
+    #Each child draws a different request sequence
+    random.seed(os.getpid())
+
+    time.sleep(max(0, startTime - time.time()))
+
+    #Closed loop sends the next request when the previous one is answered
+    if userArgs["benchMode"] == "closed":
+
+        benchSession = {"socketObject": None, "frameReader": None}
+
+        while time.time() < endTime:
+
+            requestStart = time.perf_counter()
+
+            requestOK = timeRequest(userArgs, socketNumber,
+                                    random.choices(gameChoices,
+                                                   gameWeights)[0],
+                                    random.randint(lowTickets, highTickets),
+                                    f"{os.getpid()}.{requestNum}",
+                                    benchSession)
+
+            requestTime = time.perf_counter() - requestStart
+            latencies.append(requestTime if requestOK else -requestTime)
+            requestNum += 1
+
+        closeSession(benchSession)
+
+        return latencies
+
+    #Open loop sends requests on a fixed schedule whether or not answers came
+    childRate = userArgs["requestRate"] / numChildren
+    schedulePerf = time.perf_counter() + \
+                   (startTime + childNum / userArgs["requestRate"] -
+                    time.time())
+
+    #Latency runs from the scheduled time so queueing delay is not hidden
+    def scheduledRequest(scheduledTime, lotteryType, numTickets, uniqueID):
+
+        requestOK = timeRequest(userArgs, socketNumber, lotteryType,
+                                numTickets, uniqueID)
+
+        requestTime = time.perf_counter() - scheduledTime
+
+        return requestTime if requestOK else -requestTime
+
+    futures = []
+
+    with concurrent.futures.ThreadPoolExecutor(
+                                    max_workers=userArgs["numThreads"]) \
+            as requestPool:
+
+        while True:
+
+            scheduledTime = schedulePerf + requestNum / childRate
+
+            if time.time() + (scheduledTime - time.perf_counter()) >= endTime:
+
+                break
+
+            time.sleep(max(0, scheduledTime - time.perf_counter()))
+
+            futures.append(requestPool.submit(
+                                scheduledRequest, scheduledTime,
+                                random.choices(gameChoices, gameWeights)[0],
+                                random.randint(lowTickets, highTickets),
+                                f"{os.getpid()}.{requestNum}"))
+            requestNum += 1
+
+    latencies.extend(future.result() for future in futures)
+
+    return latencies
+
+
+#Sends one request and reads its whole response, returns False on failure
+def timeRequest(userArgs, socketNumber, lotteryType, numTickets, uniqueID,
+                benchSession=None):
+
+    try:
+
+        #Binary closed loop requests reuse a keep-alive session
+        if userArgs["binaryProtocol"] and benchSession is not None:
+
+            if benchSession["socketObject"] is None:
+
+                socketObject = createConnection(
+                                        socketNumber,
+                                        userArgs["requestTimeout"])
+
+                #Busy replies count as failed requests
+                if Protocol.parseBusy(socketObject.recv(1024)) is not None:
+
+                    socketObject.close()
+                    return False
+
+                benchSession["socketObject"] = socketObject
+                benchSession["frameReader"] = Protocol.FrameReader(
+                                                                socketObject)
+
+            benchSession["socketObject"].sendall(Protocol.packRequest(
+                                                    lotteryType, numTickets,
+                                                    uniqueID[:Protocol.ID_LENGTH]))
+
+            frame = benchSession["frameReader"].readFrame()
+
+            if frame is None:
+
+                raise ConnectionError("Server closed the session")
+
+            frameHeader, payload = frame
+
+            #Server answers nothing after the last frame of a session
+            if frameHeader["lastFrame"]:
+
+                closeSession(benchSession)
+
+            return frameHeader["frameType"] == Protocol.FRAME_RESPONSE
+
+        with createConnection(socketNumber,
+                                      userArgs["requestTimeout"]) \
+                as socketObject:
+
+            if Protocol.parseBusy(socketObject.recv(1024)) is not None:
+
+                return False
+
+            if userArgs["binaryProtocol"]:
+
+                socketObject.sendall(Protocol.packRequest(
+                                                lotteryType, numTickets,
+                                                uniqueID[:Protocol.ID_LENGTH]))
+
+                frameHeader, payload = Protocol.readFrame(socketObject)
+
+                return frameHeader["frameType"] == Protocol.FRAME_RESPONSE
+
+            socketObject.sendall(bytes(str({"lotteryType": lotteryType,
+                                            "numTickets": numTickets,
+                                            "uniqueID": uniqueID}), "utf-8"))
+
+            #Text responses end when the server closes the connection
+            responseLength = 0
+
+            while True:
+
+                dataReceived = socketObject.recv(65536)
+
+                if not dataReceived:
+
+                    break
+
+                responseLength += len(dataReceived)
+
+            return responseLength > 0
+
+    except (ValueError, ConnectionError, socket.error):
+
+        if benchSession is not None:
+
+            closeSession(benchSession)
+
+        return False
+
+
+#Issues requests from many coroutines until the duration ends
+async def asyncBenchWorker(userArgs, socketNumber, childNum, numChildren,
+                           startTime):
+
+    gameChoices, gameWeights = parseMix(userArgs["gameMix"])
+    lowTickets, highTickets = parseRange(userArgs["ticketRange"])
+
+    latencies = array.array("d")
+    endTime = startTime + userArgs["duration"]
+
+    #Connections of this child, spread evenly over the children
+    numConnections = len(range(childNum, max(1, userArgs["numConnections"]),
+                               numChildren))
+
+    #Each child draws a different request sequence
+    random.seed(os.getpid())
+    requestCounter = iter(range(sys.maxsize))
+
+    await asyncio.sleep(max(0, startTime - time.time()))
+
+    #Closed loop connection sends its next request when one is answered
+    async def closedLoop():
+
+        benchSession = {"reader": None, "writer": None, "buffer": None}
+
+        while time.time() < endTime:
+
+            requestStart = time.perf_counter()
+
+            requestOK = await timeRequestAsync(
+                                userArgs, socketNumber,
+                                random.choices(gameChoices, gameWeights)[0],
+                                random.randint(lowTickets, highTickets),
+                                f"{os.getpid()}.{next(requestCounter)}",
+                                benchSession)
+
+            requestTime = time.perf_counter() - requestStart
+            latencies.append(requestTime if requestOK else -requestTime)
+
+        closeSessionAsync(benchSession)
+
+    if userArgs["benchMode"] == "closed":
+
+        await asyncio.gather(*(closedLoop() for i in range(numConnections)))
+
+        return latencies
+
+    #Open loop sends requests on a fixed schedule, at most one per connection
+    connectionSlots = asyncio.Semaphore(numConnections)
+    childRate = userArgs["requestRate"] / numChildren
+    schedulePerf = time.perf_counter() + \
+                   (startTime + childNum / userArgs["requestRate"] -
+                    time.time())
+
+    #Latency runs from the scheduled time so queueing delay is not hidden
+    async def scheduledRequest(scheduledTime, lotteryType, numTickets,
+                               uniqueID):
+
+        async with connectionSlots:
+
+            requestOK = await timeRequestAsync(userArgs, socketNumber,
+                                               lotteryType, numTickets,
+                                               uniqueID)
+
+        requestTime = time.perf_counter() - scheduledTime
+        latencies.append(requestTime if requestOK else -requestTime)
+
+    requestTasks = []
+    requestNum = 0
+
+    while True:
+
+        scheduledTime = schedulePerf + requestNum / childRate
+
+        if time.time() + (scheduledTime - time.perf_counter()) >= endTime:
+
+            break
+
+        await asyncio.sleep(max(0, scheduledTime - time.perf_counter()))
+
+        requestTasks.append(asyncio.create_task(scheduledRequest(
+                                scheduledTime,
+                                random.choices(gameChoices, gameWeights)[0],
+                                random.randint(lowTickets, highTickets),
+                                f"{os.getpid()}.{next(requestCounter)}")))
+        requestNum += 1
+
+    await asyncio.gather(*requestTasks)
+
+    return latencies
+
+
+#Sends one request from a coroutine, returns False on failure
+async def timeRequestAsync(userArgs, socketNumber, lotteryType, numTickets,
+                           uniqueID, benchSession=None):
+
+    try:
+
+        return await asyncio.wait_for(
+                            sendRequestAsync(userArgs, socketNumber,
+                                             lotteryType, numTickets,
+                                             uniqueID, benchSession),
+                            userArgs["requestTimeout"])
+
+    except (ValueError, ConnectionError, socket.error, asyncio.TimeoutError,
+            asyncio.IncompleteReadError):
+
+        if benchSession is not None:
+
+            closeSessionAsync(benchSession)
+
+        return False
+
+
+#Sends one request and reads its whole response on the event loop
+async def sendRequestAsync(userArgs, socketNumber, lotteryType, numTickets,
+                           uniqueID, benchSession):
+
+    #Binary closed loop requests reuse a keep-alive session
+    if userArgs["binaryProtocol"] and benchSession is not None:
+
+        if benchSession["writer"] is None:
+
+            reader, writer = await openStream(socketNumber)
+
+            #Busy replies count as failed requests
+            if Protocol.parseBusy(await reader.readline()) is not None:
+
+                writer.close()
+                return False
+
+            benchSession.update(reader=reader, writer=writer,
+                                buffer=bytearray())
+
+        benchSession["writer"].write(Protocol.packRequest(
+                                            lotteryType, numTickets,
+                                            uniqueID[:Protocol.ID_LENGTH]))
+
+        frame = await Protocol.readFrameAsync(benchSession["reader"],
+                                              benchSession["buffer"])
+
+        if frame is None:
+
+            raise ConnectionError("Server closed the session")
+
+        frameHeader, payload = frame
+
+        #Server answers nothing after the last frame of a session
+        if frameHeader["lastFrame"]:
+
+            closeSessionAsync(benchSession)
+
+        return frameHeader["frameType"] == Protocol.FRAME_RESPONSE
+
+    reader, writer = await openStream(socketNumber)
+
+    try:
+
+        if Protocol.parseBusy(await reader.readline()) is not None:
+
+            return False
+
+        if userArgs["binaryProtocol"]:
+
+            writer.write(Protocol.packRequest(lotteryType, numTickets,
+                                              uniqueID[:Protocol.ID_LENGTH]))
+
+            frameHeader, payload = await Protocol.readFrameAsync(reader,
+                                                                 bytearray())
+
+            return frameHeader["frameType"] == Protocol.FRAME_RESPONSE
+
+        writer.write(bytes(str({"lotteryType": lotteryType,
+                                "numTickets": numTickets,
+                                "uniqueID": uniqueID}), "utf-8"))
+
+        #Text responses end when the server closes the connection
+        return len(await reader.read()) > 0
+
+    finally:
+
+        writer.close()
+
+
+#Closes the keep-alive connection of a benchmark coroutine
+def closeSessionAsync(benchSession):
+
+    if benchSession["writer"] is not None:
+
+        benchSession["writer"].close()
+
+    benchSession.update(reader=None, writer=None, buffer=None)
+
+
+#Closes the keep-alive connection of a benchmark child
+def closeSession(benchSession):
+
+    if benchSession["socketObject"] is not None:
+
+        benchSession["socketObject"].close()
+
+    benchSession["socketObject"] = None
+    benchSession["frameReader"] = None
+
+
+#Parses a game mix like "649:5,max:3,lot" into choices and weights
+def parseMix(gameMix):
+
+    gameChoices = []
+    gameWeights = []
+
+    for gameEntry in gameMix.split(","):
+
+        lotteryType, _, gameWeight = gameEntry.partition(":")
+
+        if lotteryType not in ("649", "max", "lot"):
+
+            raise ValueError(f"Unknown lottery type {lotteryType} in mix")
+
+        gameChoices.append(lotteryType)
+        gameWeights.append(float(gameWeight or 1))
+
+    return gameChoices, gameWeights
+
+
+#Parses a ticket range like "1-5" or "3"
+def parseRange(ticketRange):
+
+    lowTickets, _, highTickets = ticketRange.partition("-")
+
+    return int(lowTickets), int(highTickets or lowTickets)
+
+
+#Computes throughput and latency percentiles from every child's latencies
+def summarizeLatencies(userArgs, latencies, elapsed):
+
+    succeeded = sorted(latency for latency in latencies if latency >= 0)
+
+    #Nearest rank percentile in milliseconds
+    def percentile(fraction):
+
+        if not succeeded:
+
+            return None
+
+        rank = max(0, min(len(succeeded) - 1,
+                          int(fraction * len(succeeded) + 0.5) - 1))
+
+        return round(succeeded[rank] * 1000, 3)
+
+    return {"mode": userArgs["benchMode"],
+            "protocol": "binary" if userArgs["binaryProtocol"] else "text",
+            "children": userArgs["numConnections"],
+            "targetRate": userArgs["requestRate"]
+                          if userArgs["benchMode"] == "open" else None,
+            "duration": round(elapsed, 3),
+            "requests": len(latencies),
+            "errors": len(latencies) - len(succeeded),
+            "throughput": round(len(succeeded) / elapsed, 1),
+            "latencyMs": {"mean": round(sum(succeeded) / len(succeeded) *
+                                        1000, 3) if succeeded else None,
+                          "p50": percentile(0.50),
+                          "p95": percentile(0.95),
+                          "p99": percentile(0.99),
+                          "p999": percentile(0.999),
+                          "max": percentile(1.0)}}
+
+
+#Prints benchmark reports as a table
+def printReport(benchReports):
+
+    columns = ["engine", "mode", "requests", "errors", "req/s", "p50 ms",
+               "p95 ms", "p99 ms", "p999 ms", "max ms", "cpu us/req"]
+
+    print("".join(f"{column:>11}" for column in columns))
+
+    for benchReport in benchReports:
+
+        latencyMs = benchReport["latencyMs"]
+
+        rowValues = [benchReport.get("engine", "remote"), benchReport["mode"],
+                     benchReport["requests"], benchReport["errors"],
+                     benchReport["throughput"], latencyMs["p50"],
+                     latencyMs["p95"], latencyMs["p99"], latencyMs["p999"],
+                     latencyMs["max"], benchReport.get("serverCpuPerRequestUs",
+                                                       "-")]
+
+        print("".join(f"{str(rowValue):>11}" for rowValue in rowValues))
+
+
+#Handles fork'd children and prevents zombie children        
+def signalHandler(sigNum, sigFrame):
+
+    #Waits for children process and does not block     
+    while True:
+
+        try:
+            
+            processID, exitStatus = os.waitpid(-1, os.WNOHANG)
+        
+        except OSError:
+            
+            return
+            
+
+        if processID == 0:
+
+            return
+
+
+if __name__ == "__main__":
+
+    #Stores arguments into a dictionary 
+    userArgs = vars(programSwitches())
+    
+    #Times cold starts of local servers when startup runs are given
+    if userArgs["startupRuns"] > 0:
+
+        runStartupBenchmark(userArgs)
+
+    #Benchmarks the server when a duration is given
+    elif userArgs["duration"] > 0:
+
+        runBenchmark(userArgs)
+
+    #Drives connections from asyncio event loops
+    elif userArgs["engine"] == "asyncio":
+
+        asyncConnections(userArgs)
+
+    #Creates socket connection
+    else:
+
+        socketConnection(userArgs)
\ No newline at end of file
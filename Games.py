@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (yaml, Protocol, LazyImport, numpy optional)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Game registry of the lottery ticket server, loaded once
+ #                from games.yaml
+ #
+ #        Input:  Game definitions (pool size, numbers per set, sets per
+ #                ticket, draw scope, rules text)
+ #
+ #       Output:  One compiled generator per game
+ #
+ #    Algorithm:  Each game is checked and compiled when the registry loads:
+ #                its pool of numbers is built once and copied for every
+ #                draw, the rules text and ticket template are encoded once,
+ #                and numbers are picked with a partial Fisher-Yates shuffle
+ #                of the copy. Large orders draw many tickets at once by
+ #                sorting a matrix of uniform random keys per pool.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  n/a
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import yaml, Protocol, LazyImport
+
+#NumPy is optional and only needed by batch draws, which load it
+numpy = LazyImport.lazyImport("numpy", optional=True)
+
+#Draw scopes a game may use
+DRAW_SCOPES = ("ticket", "set")
+
+#Tickets drawn per vectorized pass, bounds the memory of the key matrix
+BATCH_SIZE = 4096
+
+#Binary responses carry every number in one unsigned byte
+MAX_POOL_SIZE = 255
+
+
+#One game compiled from its definition in the registry
+class Game:
+
+    def __init__(self, lotteryType, gameConfig):
+
+        self.lotteryType = lotteryType
+
+        try:
+
+            self.code = int(gameConfig["code"])
+            self.title = str(gameConfig["title"])
+            self.poolSize = int(gameConfig["poolSize"])
+            self.numberPerSet = int(gameConfig["numberPerSet"])
+            self.setPerTicket = int(gameConfig["setPerTicket"])
+            self.drawScope = gameConfig.get("drawScope", "ticket")
+            rulesLines = [str(rulesLine) for rulesLine in gameConfig["rules"]]
+
+        except (KeyError, TypeError, ValueError) as e:
+
+            raise ValueError(f"Game {lotteryType} is not defined correctly: "
+                             f"{e!r}")
+
+        if not 0 < self.code < 256:
+
+            raise ValueError(f"Game {lotteryType} needs a code from 1 to 255")
+
+        if self.drawScope not in DRAW_SCOPES:
+
+            raise ValueError(f"Game {lotteryType} has unknown draw scope "
+                             f"{self.drawScope}")
+
+        if self.numberPerSet <= 0 or self.setPerTicket <= 0:
+
+            raise ValueError(f"Game {lotteryType} needs at least one number "
+                             "per set and one set per ticket")
+
+        #A ticket scope draw picks every number of a ticket from one pool
+        self.drawsPerTicket = self.setPerTicket \
+                              if self.drawScope == "set" else 1
+        self.picksPerDraw = self.numberPerSet * self.setPerTicket // \
+                            self.drawsPerTicket
+
+        if not self.picksPerDraw <= self.poolSize <= MAX_POOL_SIZE:
+
+            raise ValueError(f"Game {lotteryType} needs a pool of "
+                             f"{self.picksPerDraw} to {MAX_POOL_SIZE} numbers")
+
+        #Pool copied for every draw instead of being rebuilt
+        self.numbersPool = list(range(1, self.poolSize + 1))
+
+        #Start of each set within the numbers drawn for a ticket
+        self.setStarts = range(0, self.numberPerSet * self.setPerTicket,
+                               self.numberPerSet)
+
+        #Rules are sent with every text response, so they are encoded once
+        self.rulesText = f"\n{self.title} selected, here are the rules:\n" + \
+                         "\n".join(" " * 10 + rulesLine
+                                   for rulesLine in rulesLines) + "\n\n"
+        self.rulesBytes = self.rulesText.encode("utf-8")
+
+        #Byte template every ticket of a text response is formatted into
+        self.ticketTemplate = Protocol.ticketTemplate(self.setPerTicket,
+                                                      self.numberPerSet)
+
+    #Draws tickets one number at a time, suited to small orders
+    def drawTickets(self, numTickets, randomBackend):
+
+        #Locals keep attribute lookups out of the per-number loop
+        randbelow = randomBackend.randbelow
+        numbersPool, poolSize = self.numbersPool, self.poolSize
+        picksPerDraw, numberPerSet = self.picksPerDraw, self.numberPerSet
+        drawRange, pickRange = range(self.drawsPerTicket), range(picksPerDraw)
+
+        numSelected = []
+
+        for ticketNum in range(numTickets):
+
+            ticketNumbers = []
+
+            for drawNum in drawRange:
+
+                drawPool = numbersPool[:]
+
+                #Partial Fisher-Yates, each pick swaps a remaining number in
+                for pickNum in pickRange:
+
+                    swapNum = pickNum + randbelow(poolSize - pickNum)
+
+                    drawPool[pickNum], drawPool[swapNum] = \
+                        drawPool[swapNum], drawPool[pickNum]
+
+                ticketNumbers.extend(drawPool[:picksPerDraw])
+
+            #Splits the numbers of a ticket into its sets
+            numSelected.append([ticketNumbers[setStart:setStart + numberPerSet]
+                                for setStart in self.setStarts])
+
+        return numSelected
+
+    #Draws many tickets at once from a matrix of uniform random sort keys
+    def drawTicketsBatch(self, numTickets, randomBackend):
+
+        numSelected = []
+
+        for batchStart in range(0, numTickets, BATCH_SIZE):
+
+            batchTickets = min(BATCH_SIZE, numTickets - batchStart)
+            numDraws = batchTickets * self.drawsPerTicket
+
+            #One row of random keys per draw, one column per number in the pool
+            sortKeys = randomBackend.randomKeys((numDraws, self.poolSize))
+
+            #Smallest keys select a uniform sample of distinct numbers per row
+            selected = numpy.argpartition(sortKeys, self.picksPerDraw - 1,
+                                          axis=1)[:, :self.picksPerDraw]
+
+            #Orders the selection by its keys so draw order stays uniform too
+            selectedKeys = numpy.take_along_axis(sortKeys, selected, axis=1)
+            selected = numpy.take_along_axis(selected,
+                                             numpy.argsort(selectedKeys,
+                                                           axis=1),
+                                             axis=1)
+
+            #Shapes numbers into tickets of sets, pool numbers start at 1
+            selected = (selected + 1).reshape(batchTickets, self.setPerTicket,
+                                              self.numberPerSet)
+
+            numSelected.extend(selected.tolist())
+
+        return numSelected
+
+
+#Loads and compiles every game of a registry file
+def loadGames(gamesFile):
+
+    with open(gamesFile) as fileInput:
+
+        gamesConfig = yaml.safe_load(fileInput)
+
+    if not isinstance(gamesConfig, dict) or not gamesConfig:
+
+        raise ValueError(f"{gamesFile} does not define any games")
+
+    gameRegistry = {str(lotteryType): Game(str(lotteryType), gameConfig)
+                    for lotteryType, gameConfig in gamesConfig.items()}
+
+    gameCodes = [game.code for game in gameRegistry.values()]
+
+    if len(set(gameCodes)) != len(gameCodes):
+
+        raise ValueError(f"{gamesFile} gives two games the same code")
+
+    return gameRegistry
@@ -0,0 +1,79 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (importlib, sys)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Lazy imports for modules the lottery ticket server and
+ #                client only need in some configurations
+ #
+ #        Input:  Module name
+ #
+ #       Output:  Module whose code runs the first time one of its attributes
+ #                is used
+ #
+ #    Algorithm:  The module is found without running it and registered with
+ #                a lazy loader, so a process that never touches it never pays
+ #                for the import. A dotted name binds the module on its package
+ #                and returns the top-level package, like import a.b does, so
+ #                callers keep writing a.b.name.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  Before Python 3.12 two threads using a lazy module for the
+ #                first time at once may both run it, callers load such
+ #                modules before starting threads. A module that is installed
+ #                but fails to import only raises on first use.
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import importlib.util, sys
+
+
+#Returns a module that is imported on first use, or None for an optional
+#module that is not installed
+def lazyImport(moduleName, optional=False):
+
+    if moduleName not in sys.modules:
+
+        #Finding a module runs its packages but not the module itself
+        moduleSpec = importlib.util.find_spec(moduleName)
+
+        if moduleSpec is None:
+
+            if optional:
+
+                return None
+
+            raise ModuleNotFoundError(f"No module named '{moduleName}'",
+                                      name=moduleName)
+
+        moduleSpec.loader = importlib.util.LazyLoader(moduleSpec.loader)
+        lazyModule = importlib.util.module_from_spec(moduleSpec)
+
+        sys.modules[moduleName] = lazyModule
+        moduleSpec.loader.exec_module(lazyModule)
+
+        #Binds the module on its package the way import does
+        packageName, _, attributeName = moduleName.rpartition(".")
+
+        if packageName:
+
+            setattr(sys.modules[packageName], attributeName, lazyModule)
+
+    return sys.modules[moduleName.partition(".")[0]]
+
+
+#Runs a lazily imported module now, for modules that must be imported before
+#the process forks or starts threads
+def load(lazyModule):
+
+    #Reading any attribute of a lazy module runs it
+    vars(lazyModule)
+
+    return lazyModule
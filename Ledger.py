@@ -0,0 +1,364 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (struct, mmap, os, time, argparse, json, select,
+ #                         Protocol, Games)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Append-only ledger of every ticket issued by the lottery
+ #                ticket server, with a lookup and replay tool
+ #
+ #        Input:  Tickets issued per order, or a ledger file and unique ID
+ #
+ #       Output:  Fixed size binary records, or the tickets of an order
+ #
+ #    Algorithm:  Every ticket is one 64 byte record holding the unique ID,
+ #                game code, ticket layout, ticket number within its order,
+ #                issue time and the numbers packed one byte each. Serving
+ #                processes push whole records through a pipe to a single
+ #                writer process, which appends them and calls fdatasync
+ #                once per sync window, so many tickets share one flush.
+ #                Lookups map the file and search it for the unique ID,
+ #                keeping only matches that start on a record boundary.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  Tickets issued during the last sync window before a crash
+ #                may be missing. Unique IDs longer than 16 bytes are stored
+ #                truncated.
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import struct, mmap, os, time, argparse, json, select, Protocol, Games
+
+#Magic and record size opening every ledger file, padded to one record
+FILE_HEADER = struct.Struct("!4sH58x")
+FILE_MAGIC = b"LTL1"
+
+#Unique ID, game code, sets per ticket, numbers per set, ticket number within
+#the order, issue time in nanoseconds and the numbers of the ticket
+RECORD = struct.Struct("!16sBBBxIq32s")
+
+#Most numbers one record holds
+RECORD_NUMBERS = 32
+
+#Whole records written to the pipe at once, one write never exceeds PIPE_BUF
+#so records from different processes never interleave
+RECORDS_PER_WRITE = select.PIPE_BUF // RECORD.size
+
+
+#Raised when a file is not a ledger
+class LedgerError(ValueError):
+
+    pass
+
+
+#Checks that every ticket of a game fits in one record
+def checkGame(game):
+
+    if game.numberPerSet * game.setPerTicket > RECORD_NUMBERS:
+
+        raise LedgerError(f"Game {game.lotteryType} has more than "
+                          f"{RECORD_NUMBERS} numbers per ticket")
+
+
+#Packs the tickets of one order chunk into consecutive records
+def packRecords(uniqueID, gameCode, tickets, firstTicketNum=1,
+                issueTime=None):
+
+    encodedID = str(uniqueID).encode("utf-8")[:Protocol.ID_LENGTH]
+    issueTime = time.time_ns() if issueTime is None else issueTime
+
+    recordBuffer = bytearray()
+
+    for ticketNum, ticket in enumerate(tickets, firstTicketNum):
+
+        recordBuffer += RECORD.pack(encodedID, gameCode, len(ticket),
+                                    len(ticket[0]), ticketNum, issueTime,
+                                    Protocol.packNumbers([ticket]))
+
+    return recordBuffer
+
+
+#Rebuilds a dictionary from one record
+def unpackRecord(recordBytes):
+
+    (encodedID, gameCode, setPerTicket, numberPerSet, ticketNum, issueTime,
+     packedNumbers) = RECORD.unpack(recordBytes)
+
+    frameHeader = {"setPerTicket": setPerTicket, "numberPerSet": numberPerSet}
+
+    return {"uniqueID": Protocol.decodeID(encodedID),
+            "gameCode": gameCode,
+            "ticketNum": ticketNum,
+            "issueTime": issueTime,
+            "ticket": Protocol.unpackNumbers(frameHeader, packedNumbers[
+                                             :setPerTicket * numberPerSet])[0]}
+
+
+#Opens a ledger for appending, writing its header or checking an existing one
+def openLedger(ledgerFile):
+
+    fileDescriptor = os.open(ledgerFile, os.O_WRONLY | os.O_CREAT |
+                             os.O_APPEND, 0o640)
+
+    fileSize = os.fstat(fileDescriptor).st_size
+
+    if fileSize == 0:
+
+        os.write(fileDescriptor, FILE_HEADER.pack(FILE_MAGIC, RECORD.size))
+        os.fsync(fileDescriptor)
+
+        return fileDescriptor
+
+    with open(ledgerFile, "rb") as fileInput:
+
+        checkHeader(fileInput.read(FILE_HEADER.size))
+
+    #A record torn by a crash is cut off so new records stay aligned
+    tornBytes = (fileSize - FILE_HEADER.size) % RECORD.size
+
+    if tornBytes:
+
+        os.truncate(fileDescriptor, fileSize - tornBytes)
+
+    return fileDescriptor
+
+
+#Raises LedgerError unless the bytes are a ledger header
+def checkHeader(headerBytes):
+
+    if len(headerBytes) < FILE_HEADER.size:
+
+        raise LedgerError("File is too short to be a ledger")
+
+    fileMagic, recordSize = FILE_HEADER.unpack(headerBytes)
+
+    if fileMagic != FILE_MAGIC or recordSize != RECORD.size:
+
+        raise LedgerError("File is not a ticket ledger")
+
+
+#Appends records arriving on a pipe, flushing them once per sync window
+def writeLedger(ledgerFile, pipeRead, syncWindow):
+
+    fileDescriptor = openLedger(ledgerFile)
+
+    dataReceived = bytearray()
+    unsyncedSince = None
+
+    while True:
+
+        #Waits for records, or for the end of the current sync window
+        waitTime = 0.25 if unsyncedSince is None else \
+                   max(0, unsyncedSince + syncWindow - time.monotonic())
+
+        readable, _, _ = select.select([pipeRead], [], [], waitTime)
+
+        chunk = os.read(pipeRead, 65536) if readable else None
+
+        if chunk:
+
+            dataReceived += chunk
+
+        #Only whole records are written, the rest waits for its next bytes
+        wholeBytes = len(dataReceived) - len(dataReceived) % RECORD.size
+
+        if wholeBytes:
+
+            os.write(fileDescriptor, dataReceived[:wholeBytes])
+            del dataReceived[:wholeBytes]
+
+            if unsyncedSince is None:
+
+                unsyncedSince = time.monotonic()
+
+        #One flush covers every record written during the window
+        if unsyncedSince is not None and (chunk == b"" or time.monotonic() -
+                                          unsyncedSince >= syncWindow):
+
+            os.fdatasync(fileDescriptor)
+            unsyncedSince = None
+
+        #Every serving process closed its end of the pipe
+        if chunk == b"":
+
+            os.close(fileDescriptor)
+            return
+
+
+#Sends records to the writer process in pipe-atomic writes
+def sendRecords(pipeWrite, recordBuffer):
+
+    writeSize = RECORDS_PER_WRITE * RECORD.size
+
+    for writeStart in range(0, len(recordBuffer), writeSize):
+
+        os.write(pipeWrite, recordBuffer[writeStart:writeStart + writeSize])
+
+
+#Maps a ledger file read-only, an empty mapping is returned for no records
+def mapLedger(ledgerFile):
+
+    with open(ledgerFile, "rb") as fileInput:
+
+        checkHeader(fileInput.read(FILE_HEADER.size))
+
+        if os.fstat(fileInput.fileno()).st_size == FILE_HEADER.size:
+
+            return b""
+
+        return mmap.mmap(fileInput.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+#Returns every record of a unique ID
+def lookup(ledgerFile, uniqueID):
+
+    ledgerMap = mapLedger(ledgerFile)
+    searchID = str(uniqueID).encode("utf-8")[:Protocol.ID_LENGTH]
+    searchID = searchID.ljust(Protocol.ID_LENGTH, b"\0")
+
+    records = []
+    recordStart = ledgerMap.find(searchID, FILE_HEADER.size)
+
+    #The search runs in C, matches inside other fields are skipped
+    while recordStart != -1:
+
+        if (recordStart - FILE_HEADER.size) % RECORD.size == 0:
+
+            records.append(unpackRecord(ledgerMap[recordStart:recordStart +
+                                                  RECORD.size]))
+
+        recordStart = ledgerMap.find(searchID, recordStart + 1)
+
+    return records
+
+
+#Yields every record in the order it was written
+def replay(ledgerFile, sinceTime=0):
+
+    ledgerMap = mapLedger(ledgerFile)
+    fileSize = len(ledgerMap)
+
+    for recordStart in range(FILE_HEADER.size, fileSize - RECORD.size + 1,
+                             RECORD.size):
+
+        ledgerRecord = unpackRecord(ledgerMap[recordStart:recordStart +
+                                              RECORD.size])
+
+        if ledgerRecord["issueTime"] >= sinceTime:
+
+            yield ledgerRecord
+
+
+#Adds the game name and a readable issue time to a record
+def describeRecord(ledgerRecord, gameNames):
+
+    return dict(ledgerRecord,
+                lotteryType=gameNames.get(ledgerRecord["gameCode"],
+                                          str(ledgerRecord["gameCode"])),
+                issued=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(
+                                     ledgerRecord["issueTime"] / 1e9)))
+
+
+#Declares the switches of the lookup and replay tool
+def programSwitches():
+
+    parser = argparse.ArgumentParser(description="Lottery ticket ledger.")
+
+    parser.add_argument("actionCommand", choices=["lookup", "replay"],
+                        help="Find one order or print every ticket")
+
+    parser.add_argument("ledgerFile", help="Ledger file written by the server")
+
+    parser.add_argument("uniqueID", nargs="?", default=None,
+                        help="Unique ID of the order to look up")
+
+    parser.add_argument("--since", help="Only replay tickets issued at or "
+                        "after this Unix time", type=float, dest="sinceTime",
+                        default=0, required=False)
+
+    parser.add_argument("--games", help="Registry the game names come from",
+                        type=str, dest="gamesFile",
+                        default=os.path.join(os.path.dirname(
+                                os.path.abspath(__file__)), "games.yaml"),
+                        required=False)
+
+    return vars(parser.parse_args())
+
+
+if __name__ == "__main__":
+
+    userArgs = programSwitches()
+
+    #Game names are optional, records keep their wire codes without them
+    try:
+
+        gameNames = {game.code: lotteryType for lotteryType, game in
+                     Games.loadGames(userArgs["gamesFile"]).items()}
+
+    except (OSError, ValueError):
+
+        gameNames = {}
+
+    try:
+
+        if userArgs["actionCommand"] == "lookup":
+
+            if userArgs["uniqueID"] is None:
+
+                raise SystemExit("lookup needs a unique ID")
+
+            ledgerRecords = lookup(userArgs["ledgerFile"],
+                                   userArgs["uniqueID"])
+
+            if not ledgerRecords:
+
+                raise SystemExit(f"No tickets issued for "
+                                 f"{userArgs['uniqueID']}")
+
+            #Records of one order are written in ticket order by one process,
+            #an ID used again starts over at ticket 1
+            ordersIssued = []
+
+            for ledgerRecord in ledgerRecords:
+
+                if ledgerRecord["ticketNum"] == 1 or not ordersIssued:
+
+                    ordersIssued.append([])
+
+                ordersIssued[-1].append(ledgerRecord)
+
+            #Prints every order the same way the text protocol sent it
+            for orderRecords in ordersIssued:
+
+                firstRecord = describeRecord(orderRecords[0], gameNames)
+
+                print(f"{firstRecord['lotteryType']} issued "
+                      f"{firstRecord['issued']}")
+                print(Protocol.formatTickets(userArgs["uniqueID"],
+                                             [ledgerRecord["ticket"] for
+                                              ledgerRecord in orderRecords]),
+                      end="")
+
+        else:
+
+            #One JSON object per ticket, in the order tickets were written
+            for ledgerRecord in replay(userArgs["ledgerFile"],
+                                       int(userArgs["sinceTime"] * 1e9)):
+
+                print(json.dumps(describeRecord(ledgerRecord, gameNames)))
+
+    #Output piped into head or less may be closed early
+    except BrokenPipeError:
+
+        pass
+
+    except (OSError, LedgerError) as e:
+
+        raise SystemExit(f"Could not read ledger: {e}")
@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (cProfile, pstats, mmap, os, signal, threading,
+ #                         time, json)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Profiling and request tracing for the lottery ticket server,
+ #                switched on and off while the daemon runs
+ #
+ #        Input:  Signals or admin requests naming a process, a duration and a
+ #                trace sampling rate
+ #
+ #       Output:  cProfile dumps and text reports per process, and one JSON
+ #                line of phase timings per sampled request
+ #
+ #    Algorithm:  Settings every process reads live in a small anonymous shared
+ #                mapping created before the daemon forks, so a change made
+ #                by one process reaches all of them without a restart. A
+ #                profile runs in the process that was signalled and stops
+ #                after its duration or on a second signal, then its stats are
+ #                dumped. A sampled request carries a trace recording when each
+ #                sequential phase ended and how long the interleaved phases
+ #                of a streamed response took in total.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  Only the main thread of a process is profiled, reservoir
+ #                refills are left out.
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import cProfile, pstats, mmap, os, signal, threading, time, json
+
+#Phases that end once per request, and phases repeated for every chunk of a
+#streamed response
+SEQUENTIAL_PHASES = ("fork", "read", "parse")
+REPEATED_PHASES = ("generate", "encode", "send")
+
+
+#Rate tracing is switched on at when it was never given one
+DEFAULT_TRACE_RATE = 0.01
+
+#Processes of the daemon that admin requests may signal, one pid per slot
+PID_SLOTS = 256
+
+
+#Trace sampling rate and profile duration shared by every process
+class ProfilingControl:
+
+    def __init__(self, traceRate=0.0, profileSeconds=30.0):
+
+        #Anonymous shared mapping, writes are seen by every forked process,
+        #the third setting keeps the rate tracing is switched back on at and
+        #the pids of the daemon's processes follow the settings
+        self.sharedMemory = mmap.mmap(-1, 24 + 8 * PID_SLOTS)
+        self.settings = memoryview(self.sharedMemory)[:24].cast("d")
+        self.processIDs = memoryview(self.sharedMemory)[24:].cast("q")
+
+        self.settings[2] = DEFAULT_TRACE_RATE
+        self.traceRate = traceRate
+        self.profileSeconds = profileSeconds
+
+    @property
+    def traceRate(self):
+
+        return self.settings[0]
+
+    @traceRate.setter
+    def traceRate(self, traceRate):
+
+        self.settings[0] = min(1.0, max(0.0, float(traceRate)))
+
+        if self.settings[0]:
+
+            self.settings[2] = self.settings[0]
+
+    #Switches tracing off, or back on at its last rate, returns the new rate
+    def toggleTracing(self):
+
+        self.traceRate = 0.0 if self.traceRate else self.settings[2]
+
+        return self.traceRate
+
+    #Records the calling process in its slot so admin requests may signal it
+    def register(self, slotNum):
+
+        self.processIDs[slotNum % PID_SLOTS] = os.getpid()
+
+    #Clears the slot of a reaped process unless another one took it over
+    def unregister(self, slotNum, processID):
+
+        if self.processIDs[slotNum % PID_SLOTS] == processID:
+
+            self.processIDs[slotNum % PID_SLOTS] = 0
+
+    #Whether a pid is a registered process of the daemon
+    def isRegistered(self, processID):
+
+        return processID > 0 and processID in self.processIDs.tolist()
+
+    @property
+    def profileSeconds(self):
+
+        return self.settings[1]
+
+    @profileSeconds.setter
+    def profileSeconds(self, profileSeconds):
+
+        self.settings[1] = max(0.1, float(profileSeconds))
+
+
+#cProfile run of one process, dumped when it stops
+class ProfileSession:
+
+    def __init__(self, profileDir, maxChildren=100):
+
+        self.profileDir = profileDir
+        self.maxChildren = maxChildren
+
+        self.profile = None
+        self.sessionNum = 0
+        self.numChildren = 0
+
+    #Whether this process is being profiled
+    def running(self):
+
+        return self.profile is not None
+
+    #Profiles the calling thread, a signal stops the run after its duration
+    def start(self, profileSeconds, stopSignal=signal.SIGUSR1):
+
+        self.profile = cProfile.Profile()
+        self.sessionNum += 1
+        self.numChildren = 0
+
+        #The profile can only be stopped from the thread it runs in, so the
+        #timer signals the process instead of stopping it directly
+        expiryTimer = threading.Timer(profileSeconds, self.expire,
+                                      (self.sessionNum, os.getpid(),
+                                       stopSignal))
+        expiryTimer.daemon = True
+        expiryTimer.start()
+
+        self.profile.enable()
+
+    #Signals the process once its run is over, unless it was already stopped
+    def expire(self, sessionNum, processID, stopSignal):
+
+        if self.profile is not None and sessionNum == self.sessionNum:
+
+            os.kill(processID, stopSignal)
+
+    #Stops the run and writes its stats and a text report, returns the path
+    #of the stats file
+    def stop(self):
+
+        profile, self.profile = self.profile, None
+        profile.disable()
+
+        profilePath = os.path.join(self.profileDir, f"profile-{os.getpid()}-"
+                                   f"{time.strftime('%Y%m%d-%H%M%S')}.prof")
+
+        profile.dump_stats(profilePath)
+
+        #Busiest functions first, for reading without a viewer
+        with open(profilePath[:-len(".prof")] + ".txt", "w") as reportOutput:
+
+            pstats.Stats(profile, stream=reportOutput) \
+                  .sort_stats("cumulative").print_stats(40)
+
+        return profilePath
+
+    #Drops the run a forked process inherited without writing it
+    def discard(self):
+
+        if self.profile is not None:
+
+            self.profile.disable()
+            self.profile = None
+
+    #Keeps a run inherited by a fork engine child going for its connection,
+    #past the limit of children per run it is dropped
+    def forked(self):
+
+        if self.numChildren >= self.maxChildren:
+
+            self.discard()
+
+
+#Phase timings of one sampled request
+class RequestTrace:
+
+    def __init__(self):
+
+        self.acceptTime = time.time()
+        self.startTime = time.perf_counter()
+
+        #Seconds since accept at which each sequential phase ended, and
+        #seconds spent in phases repeated for every chunk of a response
+        self.phaseEnds = {}
+        self.phaseTotals = dict.fromkeys(REPEATED_PHASES, 0.0)
+
+        self.requestFields = {}
+
+    #Records that a sequential phase ended now
+    def mark(self, phaseName):
+
+        self.phaseEnds[phaseName] = time.perf_counter() - self.startTime
+
+    #Adds the time since a perf_counter reading to a repeated phase
+    def addSince(self, phaseName, phaseStart):
+
+        self.phaseTotals[phaseName] += time.perf_counter() - phaseStart
+
+    #Keeps fields that identify the request in the trace
+    def describe(self, **requestFields):
+
+        self.requestFields.update(requestFields)
+
+    #Encodes the trace as one JSON line, times after accept in microseconds
+    def encode(self):
+
+        traceRecord = dict(self.requestFields, pid=os.getpid(),
+                           accepted=round(self.acceptTime, 6))
+
+        traceRecord["endedAt"] = {phaseName:
+                                  round(self.phaseEnds[phaseName] * 1e6)
+                                  for phaseName in SEQUENTIAL_PHASES
+                                  if phaseName in self.phaseEnds}
+        traceRecord["spent"] = {phaseName:
+                                round(self.phaseTotals[phaseName] * 1e6)
+                                for phaseName in REPEATED_PHASES}
+        traceRecord["total"] = round((time.perf_counter() - self.startTime) *
+                                     1e6)
+
+        return (json.dumps(traceRecord, default=str) + "\n").encode("utf-8")
@@ -0,0 +1,460 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (struct, asyncio, itertools, time, LazyImport)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Compact binary wire protocol shared by the lottery ticket
+ #                server and client
+ #
+ #        Input:  Ticket requests and responses
+ #
+ #       Output:  Length-prefixed frames with a fixed header
+ #
+ #    Algorithm:  Every frame starts with a fixed header holding the frame
+ #                type, game, ticket layout, ticket count, unique ID and the
+ #                length of the payload that follows. Ticket numbers are
+ #                packed one unsigned byte each. Text clients never start
+ #                with the frame magic, so the server tells both apart from
+ #                the first bytes it receives. Sessions stay open for many
+ #                pipelined request frames, answered in order. A bulk frame
+ #                carries many orders and is answered with one response or
+ #                error frame per order, tagged by its unique ID. Shed
+ #                connections get a busy line instead of the welcome message.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  n/a
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import struct, itertools, time, LazyImport
+
+#Only processes that use asyncio streams load it
+asyncio = LazyImport.lazyImport("asyncio")
+
+#Magic bytes opening every binary frame, text requests start with "{"
+MAGIC = b"LTB1"
+
+#Frame types
+FRAME_REQUEST = 1
+FRAME_RESPONSE = 2
+FRAME_ERROR = 3
+FRAME_BULK = 4
+
+#High bit of the frame type marks the last response the server sends before
+#closing a keep-alive session, pipelined requests after it must be resent
+FLAG_LAST = 0x80
+
+#Wire codes for each lottery type, the server replaces them with its registry
+GAME_CODES = {"649": 1, "max": 2, "lot": 3}
+GAME_NAMES = {gameCode: gameName for gameName, gameCode in GAME_CODES.items()}
+
+#Magic, frame type, game, sets per ticket, numbers per set, ticket count,
+#unique ID and payload length in network byte order
+HEADER = struct.Struct("!4sBBBBI16sI")
+
+#Longest unique ID that fits in the header
+ID_LENGTH = 16
+
+#Unique ID, game and ticket count of each order in a bulk request payload
+BULK_ENTRY = struct.Struct("!16sBI")
+
+#Separator opening every ticket of a text response
+TICKET_SEPARATOR = b"=" * 30 + b"\nTicket: "
+
+#Line sent in place of the welcome message when the server sheds a connection,
+#before the client has sent anything so it works for both protocols
+BUSY_PREFIX = b"Server busy"
+
+
+#Checks whether the first bytes received open a binary frame
+def isBinary(dataReceived):
+
+    prefix = dataReceived[:len(MAGIC)]
+
+    return len(prefix) > 0 and MAGIC.startswith(prefix)
+
+
+#Replaces the wire codes of every lottery type
+def setGameCodes(gameCodes):
+
+    GAME_CODES.clear()
+    GAME_CODES.update(gameCodes)
+
+    GAME_NAMES.clear()
+    GAME_NAMES.update({gameCode: gameName
+                       for gameName, gameCode in gameCodes.items()})
+
+
+#Encodes a unique ID into the fixed width header field
+def encodeID(uniqueID):
+
+    encodedID = str(uniqueID).encode("utf-8")
+
+    if len(encodedID) > ID_LENGTH:
+
+        raise ValueError(f"Unique ID {uniqueID} is longer than {ID_LENGTH} bytes")
+
+    return encodedID
+
+
+#Decodes a unique ID from the fixed width header field
+def decodeID(encodedID):
+
+    return encodedID.rstrip(b"\0").decode("utf-8")
+
+
+#Packs a frame header, the payload is sent separately
+def packHeader(frameType, lotteryType, numTickets, uniqueID, payloadLength=0,
+               setPerTicket=0, numberPerSet=0, lastFrame=False):
+
+    if lastFrame:
+
+        frameType |= FLAG_LAST
+
+    return HEADER.pack(MAGIC, frameType, GAME_CODES.get(lotteryType, 0),
+                       setPerTicket, numberPerSet, numTickets,
+                       encodeID(uniqueID), payloadLength)
+
+
+#Unpacks a frame header into a dictionary
+def unpackHeader(headerBytes):
+
+    (magic, frameType, gameCode, setPerTicket, numberPerSet, numTickets,
+     encodedID, payloadLength) = HEADER.unpack(headerBytes)
+
+    if magic != MAGIC:
+
+        raise ValueError(f"Bad frame magic {magic!r}")
+
+    return {"frameType": frameType & ~FLAG_LAST,
+            "lastFrame": bool(frameType & FLAG_LAST),
+            "lotteryType": GAME_NAMES.get(gameCode),
+            "setPerTicket": setPerTicket,
+            "numberPerSet": numberPerSet,
+            "numTickets": numTickets,
+            "uniqueID": decodeID(encodedID),
+            "payloadLength": payloadLength}
+
+
+#Builds the request frame sent by clients
+def packRequest(lotteryType, numTickets, uniqueID):
+
+    return packHeader(FRAME_REQUEST, lotteryType, numTickets, uniqueID)
+
+
+#Builds a bulk request frame carrying many orders, each a dictionary with a
+#unique ID, lottery type and ticket count
+def packBulkRequest(bulkOrders, bulkID=""):
+
+    payload = b"".join(BULK_ENTRY.pack(encodeID(bulkOrder["uniqueID"]),
+                                       GAME_CODES.get(bulkOrder["lotteryType"],
+                                                      0),
+                                       bulkOrder["numTickets"])
+                       for bulkOrder in bulkOrders)
+
+    return packHeader(FRAME_BULK, None, len(bulkOrders), bulkID,
+                      len(payload)) + payload
+
+
+#Rebuilds the orders of a bulk request payload
+def unpackBulkOrders(payload):
+
+    if len(payload) % BULK_ENTRY.size:
+
+        raise ValueError("Bulk payload does not hold whole orders")
+
+    return [{"uniqueID": decodeID(encodedID),
+             "lotteryType": GAME_NAMES.get(gameCode),
+             "numTickets": numTickets}
+            for encodedID, gameCode, numTickets in
+            BULK_ENTRY.iter_unpack(payload)]
+
+
+#Builds a complete response frame for a list of tickets
+def packResponse(lotteryType, uniqueID, tickets, lastFrame=False):
+
+    setPerTicket = len(tickets[0]) if tickets else 0
+    numberPerSet = len(tickets[0][0]) if setPerTicket else 0
+
+    payload = packNumbers(tickets)
+
+    return packHeader(FRAME_RESPONSE, lotteryType, len(tickets), uniqueID,
+                      len(payload), setPerTicket, numberPerSet,
+                      lastFrame) + payload
+
+
+#Builds an error frame carrying a message instead of tickets
+def packError(uniqueID, errorMessage, lotteryType=None, lastFrame=False):
+
+    payload = errorMessage.encode("utf-8")
+
+    return packHeader(FRAME_ERROR, lotteryType, 0, uniqueID,
+                      len(payload), lastFrame=lastFrame) + payload
+
+
+#Builds the busy line telling a shed client when to try again
+def packBusy(retryAfter):
+
+    return BUSY_PREFIX + f", retry after {retryAfter:.2f} seconds\n".encode()
+
+
+#Returns the seconds to wait if the server answered busy, otherwise None
+def parseBusy(dataReceived):
+
+    if not dataReceived.startswith(BUSY_PREFIX):
+
+        return None
+
+    try:
+
+        return float(dataReceived.split(b"retry after ")[1].split()[0])
+
+    except (IndexError, ValueError):
+
+        return 1.0
+
+
+#Packs every ticket number as one unsigned byte
+def packNumbers(tickets):
+
+    return bytes(packNumbersInto(bytearray(), tickets))
+
+
+#Appends every ticket number as one unsigned byte to a buffer
+def packNumbersInto(buffer, tickets):
+
+    for ticket in tickets:
+
+        for ticketNumbers in ticket:
+
+            buffer += bytes(ticketNumbers)
+
+    return buffer
+
+
+#Builds the byte template of one ticket in the text response format, its
+#placeholders are the ticket number followed by every number of the ticket
+def ticketTemplate(setPerTicket, numberPerSet):
+
+    setTemplate = b"[" + b", ".join([b"%d"] * numberPerSet) + b"]\n"
+
+    return TICKET_SEPARATOR + b"%d\n" + setTemplate * setPerTicket + b"\n"
+
+
+#Appends tickets in the text response format to a buffer, numbering them
+#from the first ticket number given
+def encodeTicketsInto(buffer, tickets, ticketTemplate, firstTicketNum=1):
+
+    for ticketNum, ticket in enumerate(tickets, firstTicketNum):
+
+        #One formatting call per ticket, numbers never become str objects
+        buffer += ticketTemplate % (ticketNum,
+                                    *itertools.chain.from_iterable(ticket))
+
+    return buffer
+
+
+#Rebuilds the ticket and set lists from a response payload
+def unpackNumbers(frameHeader, payload):
+
+    numberPerSet = frameHeader["numberPerSet"]
+    numbersPerTicket = numberPerSet * frameHeader["setPerTicket"]
+
+    tickets = []
+
+    for ticketStart in range(0, len(payload), numbersPerTicket):
+
+        ticket = payload[ticketStart:ticketStart + numbersPerTicket]
+
+        tickets.append([list(ticket[setStart:setStart + numberPerSet])
+                        for setStart in range(0, numbersPerTicket,
+                                              numberPerSet)])
+
+    return tickets
+
+
+#Receives exactly the number of bytes asked for from a socket
+def recvExact(socketObject, numBytes, dataReceived=b""):
+
+    dataReceived = bytearray(dataReceived)
+
+    while len(dataReceived) < numBytes:
+
+        chunk = socketObject.recv(numBytes - len(dataReceived))
+
+        if not chunk:
+
+            raise ConnectionError("Connection closed in the middle of a frame")
+
+        dataReceived += chunk
+
+    return bytes(dataReceived)
+
+
+#Reads one frame from a socket and returns its header and payload
+def readFrame(socketObject, dataReceived=b""):
+
+    frameHeader = unpackHeader(recvExact(socketObject, HEADER.size,
+                                         dataReceived[:HEADER.size]))
+
+    payload = recvExact(socketObject, frameHeader["payloadLength"],
+                        dataReceived[HEADER.size:])
+
+    return frameHeader, payload
+
+
+#Raises ValueError when a peer announces a payload larger than allowed
+def checkPayload(frameHeader, maxPayload):
+
+    if maxPayload is not None and frameHeader["payloadLength"] > maxPayload:
+
+        raise ValueError(f"Frame payload of {frameHeader['payloadLength']} "
+                         f"bytes is larger than {maxPayload}")
+
+
+#Reads consecutive frames from a socket, keeping bytes of pipelined frames
+class FrameReader:
+
+    def __init__(self, socketObject, dataReceived=b"", maxPayload=None):
+
+        self.socketObject = socketObject
+        self.buffer = bytearray(dataReceived)
+        self.maxPayload = maxPayload
+
+        #Monotonic time the frame being read must be complete by, if any
+        self.deadline = None
+
+    #Receives until the buffer holds at least the number of bytes asked for
+    def fill(self, numBytes):
+
+        while len(self.buffer) < numBytes:
+
+            #A peer sending a byte at a time cannot stretch a frame forever
+            if self.deadline is not None:
+
+                timeLeft = self.deadline - time.monotonic()
+
+                if timeLeft <= 0:
+
+                    raise TimeoutError("Frame was not received in time")
+
+                self.socketObject.settimeout(timeLeft)
+
+            #Reads ahead so pipelined frames arrive together, but never asks
+            #for more than a chunk, a large payload is gathered over several
+            chunk = self.socketObject.recv(65536)
+
+            if not chunk:
+
+                return False
+
+            self.buffer += chunk
+
+        return True
+
+    #Returns the next header and payload, or None when the peer closed
+    #cleanly. The first byte may take idleTimeout seconds to arrive and the
+    #rest of the frame frameTimeout seconds, None waits forever
+    def readFrame(self, idleTimeout=None, frameTimeout=None):
+
+        if not self.buffer and idleTimeout is not None:
+
+            self.socketObject.settimeout(idleTimeout)
+
+            if not self.fill(1):
+
+                return None
+
+        if frameTimeout is not None:
+
+            self.deadline = time.monotonic() + frameTimeout
+
+        try:
+
+            if not self.fill(HEADER.size):
+
+                if self.buffer:
+
+                    raise ConnectionError("Connection closed in the middle "
+                                          "of a frame")
+
+                return None
+
+            frameHeader = unpackHeader(bytes(self.buffer[:HEADER.size]))
+            checkPayload(frameHeader, self.maxPayload)
+            frameLength = HEADER.size + frameHeader["payloadLength"]
+
+            if not self.fill(frameLength):
+
+                raise ConnectionError("Connection closed in the middle of a "
+                                      "frame")
+
+        finally:
+
+            self.deadline = None
+
+        payload = bytes(self.buffer[HEADER.size:frameLength])
+        del self.buffer[:frameLength]
+
+        return frameHeader, payload
+
+
+#Reads the next frame from an asyncio stream, the bytearray holds bytes read
+#ahead of it and keeps those of later pipelined frames, None means clean close
+async def readFrameAsync(reader, buffer, maxPayload=None):
+
+    try:
+
+        if len(buffer) < HEADER.size:
+
+            buffer += await reader.readexactly(HEADER.size - len(buffer))
+
+    except asyncio.IncompleteReadError as e:
+
+        if buffer or e.partial:
+
+            raise ConnectionError("Connection closed in the middle of a frame")
+
+        return None
+
+    frameHeader = unpackHeader(bytes(buffer[:HEADER.size]))
+    checkPayload(frameHeader, maxPayload)
+    frameLength = HEADER.size + frameHeader["payloadLength"]
+
+    if len(buffer) < frameLength:
+
+        buffer += await reader.readexactly(frameLength - len(buffer))
+
+    payload = bytes(buffer[HEADER.size:frameLength])
+    del buffer[:frameLength]
+
+    return frameHeader, payload
+
+
+#Formats tickets the same way as the text protocol response
+def formatTickets(uniqueID, tickets):
+
+    responseMessage = f"Unique ID: {uniqueID}\n\n"
+
+    #Loops through each ticket per play
+    for ticketNum, ticket in enumerate(tickets, 1):
+
+        responseMessage += "=" * 30
+        responseMessage += f"\nTicket: {ticketNum}\n"
+
+        #Loops through each set in a ticket
+        for ticketNumbers in ticket:
+
+            responseMessage += str(ticketNumbers)
+            responseMessage += "\n"
+
+        responseMessage += "\n"
+
+    return responseMessage
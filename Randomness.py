@@ -0,0 +1,198 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (random, os, threading, LazyImport,
+ #                         numpy optional)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Randomness backends used by the lottery ticket server to
+ #                draw ticket numbers
+ #
+ #        Input:  Backend name and optional seed
+ #
+ #       Output:  Unbiased bounded integers and uniform sort keys
+ #
+ #    Algorithm:  The random backend keeps the standard library generator.
+ #                The pcg64 backend draws from a NumPy PCG64 stream built
+ #                from a SeedSequence, spawning an independent child stream
+ #                in every forked process so seeded runs are reproducible.
+ #                The urandom backend reads large blocks from the kernel
+ #                CSPRNG. Buffered backends map 32 bit words to bounded
+ #                integers by rejecting words past the largest multiple of
+ #                the bound, so no value is favoured and no draw needs a
+ #                system call of its own.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  n/a
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import random, os, threading, LazyImport
+
+#NumPy is optional, it is needed by the pcg64 backend and by batch draws and
+#only loaded once one of them runs
+numpy = LazyImport.lazyImport("numpy", optional=True)
+
+#Backend names accepted by createBackend
+BACKENDS = ("random", "pcg64", "urandom")
+
+#Buffered backends refill this many 32 bit words at a time
+BLOCK_WORDS = 16384
+
+#Number of distinct values of one buffered word
+WORD_RANGE = 2 ** 32
+
+
+#Standard library generator, reseeded by Python in every forked child
+class RandomModuleBackend:
+
+    name = "random"
+
+    def __init__(self):
+
+        #Batch draws need their own NumPy stream, fresh in every process
+        #and created on first use so NumPy stays unloaded without them
+        self.batchGenerator = None
+
+    #Returns an integer from 0 up to but not including the bound
+    def randbelow(self, upperBound):
+
+        return random.randrange(upperBound)
+
+    #Returns an array of uniform floats in [0, 1) used as sort keys
+    def randomKeys(self, keyShape):
+
+        if self.batchGenerator is None:
+
+            self.batchGenerator = numpy.random.default_rng()
+
+        return self.batchGenerator.random(keyShape)
+
+    #Returns the backend a forked child should use
+    def spawn(self, streamNum):
+
+        return RandomModuleBackend()
+
+
+#Serves bounded integers from a block of random words refilled at once
+class BufferedBackend:
+
+    def __init__(self):
+
+        self.words = []
+        self.position = 0
+
+        #The reservoir refill thread draws alongside connection handlers
+        self.lock = threading.Lock()
+
+    #Returns a fresh block of random 32 bit words
+    def fillWords(self):
+
+        raise NotImplementedError
+
+    #Returns an integer from 0 up to but not including the bound
+    def randbelow(self, upperBound):
+
+        #Words past the largest multiple of the bound would favour small values
+        wordLimit = WORD_RANGE - WORD_RANGE % upperBound
+
+        with self.lock:
+
+            while True:
+
+                if self.position == len(self.words):
+
+                    self.words = self.fillWords()
+                    self.position = 0
+
+                randomWord = self.words[self.position]
+                self.position += 1
+
+                if randomWord < wordLimit:
+
+                    return randomWord % upperBound
+
+
+#Seeded NumPy PCG64 stream for load tests and reproducible runs
+class PCG64Backend(BufferedBackend):
+
+    name = "pcg64"
+
+    def __init__(self, seed=None, spawnKey=()):
+
+        super().__init__()
+
+        if numpy is None:
+
+            raise RuntimeError("The pcg64 backend needs NumPy")
+
+        self.seedSequence = numpy.random.SeedSequence(seed,
+                                                      spawn_key=spawnKey)
+        self.generator = numpy.random.Generator(
+                                        numpy.random.PCG64(self.seedSequence))
+
+    def fillWords(self):
+
+        return self.generator.integers(0, WORD_RANGE, BLOCK_WORDS,
+                                       dtype=numpy.uint32).tolist()
+
+    #Returns an array of uniform floats in [0, 1) used as sort keys
+    def randomKeys(self, keyShape):
+
+        return self.generator.random(keyShape)
+
+    #Child streams share the entropy and differ by spawn key, so they never
+    #overlap and a seeded run repeats when processes fork in the same order
+    def spawn(self, streamNum):
+
+        return PCG64Backend(self.seedSequence.entropy,
+                            self.seedSequence.spawn_key + (streamNum,))
+
+
+#Kernel CSPRNG read in large blocks through os.urandom (getrandom on Linux)
+class URandomBackend(BufferedBackend):
+
+    name = "urandom"
+
+    def fillWords(self):
+
+        return memoryview(os.urandom(BLOCK_WORDS * 4)).cast("I").tolist()
+
+    #Returns an array of uniform floats in [0, 1) built from 53 random bits
+    def randomKeys(self, keyShape):
+
+        numKeys = int(numpy.prod(keyShape))
+
+        randomWords = numpy.frombuffer(os.urandom(numKeys * 8),
+                                       dtype=numpy.uint64)
+
+        return ((randomWords >> 11) * (1.0 / 2 ** 53)).reshape(keyShape)
+
+    #Buffered words must never be shared with a forked child
+    def spawn(self, streamNum):
+
+        return URandomBackend()
+
+
+#Builds the backend chosen by name, the seed only applies to pcg64
+def createBackend(backendName="random", seed=None):
+
+    if backendName == "pcg64":
+
+        return PCG64Backend(seed)
+
+    if backendName == "urandom":
+
+        return URandomBackend()
+
+    if backendName == "random":
+
+        return RandomModuleBackend()
+
+    raise ValueError(f"Unknown randomness backend {backendName}")
@@ -0,0 +1,180 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (sqlite3, os, time)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Cache of answered orders keyed by unique ID, game and
+ #                ticket count, so a client retrying an order gets the
+ #                tickets it was already issued
+ #
+ #        Input:  Unique ID, game and ticket count of an order
+ #
+ #       Output:  The packed ticket numbers first issued for the order
+ #
+ #    Algorithm:  Orders live in one SQLite file shared by every process of
+ #                the server. Each process opens its own connection after it
+ #                forks. Entries expire once they are older than the time to
+ #                live, and past the entry limit the least recently used ones
+ #                are evicted. Numbers are kept packed one byte each and
+ #                encoded again for whichever protocol asks.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  Two copies of one order arriving at the same time may both
+ #                be generated, the last one answered is kept.
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import sqlite3, os, time
+
+#Orders that are answered again instead of generated, one row per unique ID
+#and order, so an order with the same ID but another game or ticket count is
+#a miss instead of a replay
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS orders (
+    uniqueID TEXT NOT NULL,
+    lotteryType TEXT NOT NULL,
+    numTickets INTEGER NOT NULL,
+    setPerTicket INTEGER NOT NULL,
+    numberPerSet INTEGER NOT NULL,
+    packedNumbers BLOB NOT NULL,
+    createdAt REAL NOT NULL,
+    lastUsed REAL NOT NULL,
+    PRIMARY KEY (uniqueID, lotteryType, numTickets));
+CREATE INDEX IF NOT EXISTS ordersLastUsed ON orders (lastUsed);
+CREATE INDEX IF NOT EXISTS ordersCreatedAt ON orders (createdAt);
+"""
+
+#Layout of the orders table, a file holding an older one is emptied since
+#every entry can be regenerated
+SCHEMA_VERSION = 2
+
+#Errors of the store, a request is served without the cache when one happens
+CacheError = sqlite3.Error
+
+#Milliseconds a process waits on another one holding the write lock
+BUSY_TIMEOUT = 1000
+
+
+#Bounded LRU cache of answered orders with a time to live
+class ResponseCache:
+
+    def __init__(self, cacheFile, maxEntries=10000, timeToLive=300.0,
+                 maxTickets=1000):
+
+        self.cacheFile = cacheFile
+        self.maxEntries = maxEntries
+        self.timeToLive = timeToLive
+        self.maxTickets = maxTickets
+
+        self.connection = None
+        self.processID = None
+
+        #Creates the table up front so a bad path stops the daemon, the
+        #connection is closed so no forked child inherits it
+        connection = self.connect()
+
+        if connection.execute("PRAGMA user_version").fetchone()[0] < \
+                SCHEMA_VERSION:
+
+            connection.executescript("DROP TABLE IF EXISTS orders; "
+                                     f"PRAGMA user_version = "
+                                     f"{SCHEMA_VERSION};")
+
+        connection.executescript(SCHEMA)
+        self.close()
+
+    #Closes the connection of this process
+    def close(self):
+
+        if self.connection is not None:
+
+            self.connection.close()
+
+        self.connection = None
+        self.processID = None
+
+    #Returns the connection of this process, opening one after a fork
+    def connect(self):
+
+        if self.processID != os.getpid():
+
+            self.connection = sqlite3.connect(self.cacheFile,
+                                              timeout=BUSY_TIMEOUT / 1000,
+                                              isolation_level=None)
+
+            #Entries can be regenerated, so writes never wait on the disk
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=OFF")
+
+            self.processID = os.getpid()
+
+        return self.connection
+
+    #Returns the layout and packed numbers of a cached order or None, and how
+    #many entries were evicted while looking
+    def get(self, uniqueID, lotteryType, numTickets):
+
+        connection = self.connect()
+        currentTime = time.time()
+
+        orderKey = (uniqueID, lotteryType, numTickets)
+
+        cachedOrder = connection.execute(
+            "SELECT setPerTicket, numberPerSet, packedNumbers, createdAt "
+            "FROM orders WHERE uniqueID = ? AND lotteryType = ? AND "
+            "numTickets = ?", orderKey).fetchone()
+
+        if cachedOrder is None:
+
+            return None, 0
+
+        #An expired entry counts as evicted
+        if currentTime - cachedOrder[3] > self.timeToLive:
+
+            connection.execute("DELETE FROM orders WHERE uniqueID = ? AND "
+                               "lotteryType = ? AND numTickets = ?", orderKey)
+
+            return None, 1
+
+        connection.execute("UPDATE orders SET lastUsed = ? WHERE uniqueID = ? "
+                           "AND lotteryType = ? AND numTickets = ?",
+                           (currentTime,) + orderKey)
+
+        return cachedOrder[:3], 0
+
+    #Stores an answered order, returns how many entries were evicted
+    def put(self, uniqueID, lotteryType, numTickets, setPerTicket,
+            numberPerSet, packedNumbers):
+
+        connection = self.connect()
+        currentTime = time.time()
+
+        connection.execute(
+            "INSERT OR REPLACE INTO orders VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (uniqueID, lotteryType, numTickets, setPerTicket, numberPerSet,
+             bytes(packedNumbers), currentTime, currentTime))
+
+        #Expired entries go first, then the least recently used past the limit
+        numEvicted = connection.execute(
+            "DELETE FROM orders WHERE createdAt < ?",
+            (currentTime - self.timeToLive,)).rowcount
+
+        numEvicted += connection.execute(
+            "DELETE FROM orders WHERE rowid IN (SELECT rowid FROM orders "
+            "ORDER BY lastUsed DESC LIMIT -1 OFFSET ?)",
+            (self.maxEntries,)).rowcount
+
+        return numEvicted
+
+    #Number of orders held
+    def size(self):
+
+        return self.connect().execute("SELECT COUNT(*) FROM orders") \
+                             .fetchone()[0]
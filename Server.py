@@ -2,8 +2,16 @@
 
 #==============================================================================
  #       Author:  Andy Garcia
- #     Language:  Python3 (argparse, random, socket, yaml, os, signal,
- #                         sys, atexit, logzero, logger)
+ #     Language:  Python3 (argparse, socket, yaml, os, signal,
+ #                         sys, atexit, asyncio, time, threading,
+ #                         collections, mmap, bisect, http.server,
+ #                         struct, select, logging, fcntl, errno,
+ #                         contextvars, random, urllib, pwd, grp, stat,
+ #                         contextlib, multiprocessing,
+ #                         logzero, logger,
+ #                         Protocol, Randomness, Games, Uniqueness, Ledger,
+ #                         ResponseCache, Profiling, LazyImport,
+ #                         numpy optional)
  #   To Compile:  n/a
  #
  #-----------------------------------------------------------------------------
@@ -11,7 +19,8 @@
  #  Description:  Daemonized non-blocking networked lottery ticket generator 
  #                over TCP/IP handling high concurrency
  #
- #        Input:  Enter start|stop, optional socket address and port to listen
+ #        Input:  Enter start|stop|reload, optional socket address and port
+ #                to listen
  #
  #       Output:  Displays status of daemon  
  #
@@ -27,309 +36,3334 @@
  #
 #==============================================================================
 
-import argparse, random, socket, yaml, os, signal, sys, atexit, logzero 
+import argparse, socket, yaml, os, signal, sys, atexit, time, threading
+import collections, mmap, bisect, struct, select, logging, logging.handlers
+import fcntl, errno, contextvars, random, pwd, grp, stat, contextlib
+import multiprocessing
+import logzero, Protocol, Randomness, Games, Uniqueness, Ledger, LazyImport
 from logzero import logger
 
+#Modules only some engines and switches use are loaded the first time they
+#are used, so a cold start only pays for what it serves with
+asyncio = LazyImport.lazyImport("asyncio")
+http = LazyImport.lazyImport("http.server")
+urllib = LazyImport.lazyImport("urllib.parse")
+ResponseCache = LazyImport.lazyImport("ResponseCache")
+Profiling = LazyImport.lazyImport("Profiling")
+
+#NumPy is optional and only needed by the batch ticket generator
+numpy = LazyImport.lazyImport("numpy", optional=True)
+
+#Server switches read by connection handlers, filled in when the daemon starts
+serverOptions = {"generator": "auto", "keepAliveTimeout": 5.0,
+                 "maxRequests": 100, "headerTimeout": 5.0, "bodyTimeout": 10.0,
+                 "writeTimeout": 30.0, "drainTimeout": 30.0}
+
+#Longest request accepted, enough for a bulk request of MAX_BULK_ORDERS
+#orders in either protocol
+MAX_REQUEST_BYTES = 131072
+
+#First file descriptor passed by socket activation (sd_listen_fds)
+LISTEN_FDS_START = 3
+
+#Process started from the command line, socket activation names this pid
+launchPid = os.getpid()
+
+#Unix socket paths bound by this daemon, removed when it exits
+unixPaths = []
+
+#Script and directory the daemon was started from, a reload executes the
+#next generation the same way
+SERVER_SCRIPT = os.path.abspath(__file__)
+launchDirectory = os.getcwd()
+
+#Write end of the pipe the previous generation waits on during a reload,
+#None unless this generation was started by one
+readyPipe = os.environ.pop("LOTTERY_READY_FD", None)
+
+#Seconds a new generation has to start accepting before a reload is abandoned
+RELOAD_TIMEOUT = 30
+
+#Listening sockets of this generation and the process that bound them
+activeListeners = []
+listenerPid = None
+
+#SO_REUSEPORT listeners only this prefork worker holds, and connections taken
+#off them when a reload is about to close them
+workerSockets = []
+pendingConnections = collections.deque()
+
+#Set once a reload is under way, and once the next generation took over
+reloading = False
+draining = False
+
+#PID file of a daemon started with start, rewritten by a reload
+daemonPidFile = None
+
+#Most orders one bulk request may carry
+MAX_BULK_ORDERS = 1000
+
+#LibYAML parses the long flow mappings of bulk requests several times faster
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+#Orders with at least this many tickets use the batch generator in auto mode
+BATCH_THRESHOLD = 64
+
+#Game registry read when the daemon starts, next to this script by default
+GAMES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "games.yaml")
+
+#Compiled games by lottery type, filled in by startGames
+gameRegistry = {}
+
+#Sets issued by every process, only used when --unique is given
+seenSets = None
+
+#Write end of the pipe to the ledger writer, only used when --ledger is given
+ledgerPipe = None
+
+#Answered orders shared by every process, only used when --cache is given
+responseCache = None
+
+#Fragments gathered into one sendmsg call, well below IOV_MAX
+SEND_FRAGMENTS = 64
+
+#Tickets generated and encoded per chunk of a streamed response
+STREAM_CHUNK = 1024
+
+#Pre-generated tickets of this process, only used when --reservoir is given
+ticketReservoir = None
+
+#Admission checks of this process, always present once an engine starts
+admissionControl = None
+
+#Pids of fork engine children still serving a connection and the process
+#slot each one writes to
+childProcesses = {}
+
+#Worker numbers and start times of running prefork workers by pid
+workerProcesses = {}
+
+#Seconds a client is told to wait when the in-flight cap is reached
+BUSY_RETRY_AFTER = 1.0
+
+#Idle rate limit buckets are pruned once this many client addresses are known
+MAX_RATE_BUCKETS = 10000
+
+#Metrics shared by every serving process, only used when --metrics-port is given
+serverMetrics = None
+
+#Name, type and help text of each metric kept per process slot
+METRIC_FIELDS = [
+    ("accepts_total", "counter", "Connections accepted"),
+    ("active_connections", "gauge", "Connections being served"),
+    ("forks_total", "counter", "Processes forked to serve one connection"),
+    ("workers", "gauge", "Pre-forked workers running"),
+    ("worker_restarts_total", "counter", "Pre-forked workers restarted"),
+    ("requests_total", "counter", "Ticket orders answered"),
+    ("tickets_total", "counter", "Tickets sent"),
+    ("bytes_sent_total", "counter", "Response bytes sent"),
+    ("parse_errors_total", "counter", "Requests that could not be parsed"),
+    ("invalid_requests_total", "counter", "Requests rejected by validation"),
+    ("reservoir_hits_total", "counter", "Tickets served from the reservoir"),
+    ("reservoir_misses_total", "counter", "Tickets generated inline"),
+    ("shed_busy_total", "counter",
+     "Connections shed because the in-flight cap was reached"),
+    ("shed_rate_limited_total", "counter",
+     "Connections shed by the per-address rate limit"),
+    ("unique_redraws_total", "counter",
+     "Tickets drawn again because a set was already issued"),
+    ("cache_hits_total", "counter",
+     "Orders answered again from the response cache"),
+    ("cache_misses_total", "counter",
+     "Cacheable orders that had to be generated"),
+    ("cache_evictions_total", "counter",
+     "Cached orders evicted because they expired or were least used"),
+    ("request_timeouts_total", "counter",
+     "Connections closed because a request or response missed its deadline"),
+    ("log_records_dropped_total", "counter",
+     "Log records dropped because the log pipe was full"),
+    ("connection_errors_total", "counter",
+     "Connections closed by an unexpected error while serving them")]
+
+#Upper bounds in seconds of the generateNumbers latency histogram buckets
+GENERATE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                    0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+
+#Process slots in the shared metrics memory, the last one is shared under a
+#lock by processes started once every other slot is taken
+METRIC_SLOTS = 256
+SHARED_SLOT = METRIC_SLOTS - 1
+
+#Slots no running fork engine child writes to, handed out before each fork
+#and taken back when the child is reaped
+freeChildSlots = list(range(SHARED_SLOT - 1, 0, -1))
+
+#Helper processes forked by the daemon, reaped without counting connections
+helperProcesses = set()
+
+#Shared profiling settings and the profile of this process, only used when
+#--profile-dir is given
+profilingControl = None
+profileSession = None
+
+#Append-only file of sampled request traces and the generator deciding which
+#requests are sampled, kept apart from the ticket generator so sampling never
+#changes the tickets a seeded run issues
+traceFile = None
+traceSampler = random.Random()
+
+#Trace of the request being served, per coroutine on the asyncio engine
+currentTrace = contextvars.ContextVar("currentTrace", default=None)
+
+#Log file rotation, at most 1MB per file and 3 rotated files
+LOG_MAX_BYTES = 1e6
+LOG_BACKUPS = 3
+
+#Length and kind of each record sent to the log writer, a record fits in one
+#atomic pipe write so records from many processes never interleave
+LOG_RECORD = struct.Struct("!Hc")
+
 #Displays help menu and switches that are supported with the program
 def programSwitches():
 
-    parser = argparse.ArgumentParser(description="Lottery Ticket Generator.")
+    parser = argparse.ArgumentParser(description="Lottery Ticket Generator.")
+
+    #Adds "-l" switch to choose the address to listen for incoming connections
+    parser.add_argument("-l", help="Listen on socket address", type=str, 
+                        dest="socketAddress", default="127.0.0.1", 
+                        required=False)
+
+    #Adds "-p" switch to choose socket port for listening
+    parser.add_argument("-p", help="Listen on socket port", type=int, 
+                        dest="socketPort", default=1234, required=False)
+
+    #Adds switches to listen on several addresses, replacing -l and -p
+    parser.add_argument("--listen", help="Listen on HOST:PORT, [HOST]:PORT "
+                        "or unix:PATH, may be repeated", type=str,
+                        dest="listenAddresses", action="append", default=None,
+                        required=False)
+
+    parser.add_argument("--unix-mode", help="Permissions of unix sockets",
+                        type=lambda fileMode: int(fileMode, 8),
+                        dest="unixMode", default=0o660, required=False)
+
+    #Adds "-e" switch to choose the engine serving accepted connections
+    parser.add_argument("-e", "--engine", help="Serving engine", type=str,
+                        dest="engine", choices=["fork", "asyncio", "prefork"],
+                        default="fork", required=False)
+
+    #Adds "-w" switch to choose the number of pre-forked workers
+    parser.add_argument("-w", "--workers", help="Pre-forked workers", type=int,
+                        dest="numWorkers", default=os.cpu_count() or 1,
+                        required=False)
+
+    #Adds switch to choose the daemon PID file, allowing several instances
+    parser.add_argument("--pidfile", help="Daemon PID file", type=str,
+                        dest="pidFile",
+                        default="/var/run/daemon/DPI912_algarcia1.pid",
+                        required=False)
+
+    #Adds "-g" switch to choose how ticket numbers are generated
+    parser.add_argument("-g", "--generator", help="Ticket generator", type=str,
+                        dest="generator", choices=["auto", "python", "numpy"],
+                        default="auto", required=False)
+
+    #Adds switch to choose how long an idle keep-alive session stays open
+    parser.add_argument("--keepalive-timeout", help="Idle session seconds",
+                        type=float, dest="keepAliveTimeout", default=5.0,
+                        required=False)
+
+    #Adds switches for the deadlines of each phase of a connection
+    parser.add_argument("--header-timeout", help="Seconds a new connection "
+                        "may wait before sending", type=float,
+                        dest="headerTimeout", default=5.0, required=False)
+
+    parser.add_argument("--body-timeout", help="Seconds a request may take "
+                        "to arrive once started", type=float,
+                        dest="bodyTimeout", default=10.0, required=False)
+
+    parser.add_argument("--write-timeout", help="Seconds a client has to "
+                        "read a whole response", type=float,
+                        dest="writeTimeout", default=30.0, required=False)
+
+    #Adds switch to choose how long a reloaded generation finishes its
+    #connections
+    parser.add_argument("--drain-timeout", help="Seconds the generation "
+                        "replaced by a reload has to finish its connections",
+                        type=float, dest="drainTimeout", default=30.0,
+                        required=False)
+
+    #Adds switch to choose how many requests one session may send
+    parser.add_argument("--max-requests", help="Requests per session",
+                        type=int, dest="maxRequests", default=100,
+                        required=False)
+
+    #Adds switches to serve tickets from a pre-generated reservoir
+    parser.add_argument("--reservoir", help="Serve pre-generated tickets",
+                        action="store_true", dest="reservoir", default=False,
+                        required=False)
+
+    parser.add_argument("--reservoir-low", help="Refill below this many "
+                        "tickets per game", type=int, dest="reservoirLow",
+                        default=1000, required=False)
+
+    parser.add_argument("--reservoir-high", help="Refill up to this many "
+                        "tickets per game", type=int, dest="reservoirHigh",
+                        default=10000, required=False)
+
+    #Adds switch to choose the daemon log file
+    parser.add_argument("--logfile", help="Daemon log file", type=str,
+                        dest="logFile", default="/var/log/DPI912_algarcia1.log",
+                        required=False)
+
+    #Adds switch to choose who owns the log file and PID directory
+    parser.add_argument("--owner", help="Owner of the log file and PID "
+                        "directory as USER[:GROUP], empty to leave it",
+                        type=str, dest="fileOwner", default="daemon:daemon",
+                        required=False)
+
+    #Adds switch to choose the game registry
+    parser.add_argument("--games", help="Game registry file", type=str,
+                        dest="gamesFile", default=GAMES_FILE, required=False)
+
+    #Adds switches to choose where ticket numbers come from
+    parser.add_argument("--rng", help="Randomness backend", type=str,
+                        dest="rngBackend", choices=Randomness.BACKENDS,
+                        default="random", required=False)
+
+    parser.add_argument("--seed", help="Seed of the pcg64 backend", type=int,
+                        dest="seed", default=None, required=False)
+
+    #Adds switches to never issue the same set of numbers twice
+    parser.add_argument("--unique", help="Never issue a set twice",
+                        dest="uniqueSets", action="store_true", default=False,
+                        required=False)
+
+    parser.add_argument("--unique-max-mb", help="Memory allowed for the "
+                        "uniqueness bitmaps", type=int, dest="uniqueMaxMB",
+                        default=64, required=False)
+
+    #Adds switches for admission control, 0 disables a limit
+    parser.add_argument("--backlog", help="Listen queue length", type=int,
+                        dest="backlog", default=socket.SOMAXCONN,
+                        required=False)
+
+    parser.add_argument("--max-inflight", help="Connections served at once",
+                        type=int, dest="maxInFlight", default=0,
+                        required=False)
+
+    parser.add_argument("--rate-limit", help="Connections per second per "
+                        "client address", type=float, dest="rateLimit",
+                        default=0, required=False)
+
+    parser.add_argument("--rate-burst", help="Connections a client address "
+                        "may open at once", type=float, dest="rateBurst",
+                        default=10, required=False)
+
+    #Adds switches for the local Prometheus metrics endpoint, 0 disables it
+    parser.add_argument("--metrics-port", help="Metrics HTTP port", type=int,
+                        dest="metricsPort", default=0, required=False)
+
+    parser.add_argument("--metrics-address", help="Metrics HTTP address",
+                        type=str, dest="metricsAddress", default="127.0.0.1",
+                        required=False)
+
+    #Adds switches for shipping logs to a single writer process
+    parser.add_argument("--log-queue", help="Write logs from one process",
+                        dest="logQueue", action="store_true", default=False,
+                        required=False)
+
+    parser.add_argument("--log-burst", help="Connection messages per second "
+                        "written before sampling", type=int, dest="logBurst",
+                        default=100, required=False)
+
+    parser.add_argument("--log-sample", help="Write 1 in N connection "
+                        "messages past the burst", type=int, dest="logSample",
+                        default=10, required=False)
+
+    #Adds switches for the ledger of issued tickets
+    parser.add_argument("--ledger", help="Ledger file of issued tickets",
+                        type=str, dest="ledgerFile", default=None,
+                        required=False)
+
+    parser.add_argument("--ledger-sync-ms", help="Milliseconds of ledger "
+                        "writes flushed to disk together", type=float,
+                        dest="ledgerSyncMS", default=50, required=False)
+
+    #Adds switches for answering retried orders with the tickets first issued
+    parser.add_argument("--cache", help="Response cache file shared by every "
+                        "process", type=str, dest="cacheFile", default=None,
+                        required=False)
+
+    parser.add_argument("--cache-entries", help="Orders kept in the response "
+                        "cache", type=int, dest="cacheEntries", default=10000,
+                        required=False)
+
+    parser.add_argument("--cache-ttl", help="Seconds an order stays cached",
+                        type=float, dest="cacheTTL", default=300,
+                        required=False)
+
+    parser.add_argument("--cache-max-tickets", help="Largest order cached",
+                        type=int, dest="cacheMaxTickets", default=1000,
+                        required=False)
+
+    #Adds switches for profiling and request tracing switched on at runtime
+    parser.add_argument("--profile-dir", help="Directory for profiles and "
+                        "request traces, enables SIGUSR1 and SIGUSR2",
+                        type=str, dest="profileDir", default=None,
+                        required=False)
+
+    parser.add_argument("--profile-seconds", help="Seconds a profile runs",
+                        type=float, dest="profileSeconds", default=30,
+                        required=False)
+
+    parser.add_argument("--trace-rate", help="Fraction of requests traced "
+                        "from the start", type=float, dest="traceRate",
+                        default=0, required=False)
+
+    parser.add_argument("actionCommand", nargs='?', default="status")
+
+    args = parser.parse_args()
+
+    #Returns arguments passed
+    return args
+
+
+##Select numbers from diminishing pool for each ticket
+def generateNumbers(userArgs):
+
+    #Error handling and exits program for invalid number of tickets        
+    if userArgs["numTickets"] <= 0:
+
+        logger.info("The number of tickets must be greater than 0.")
+        os._exit(0)
+
+    #Compiled generator and rules of the lottery type chosen
+    game = gameRegistry[userArgs["lotteryType"]]
+
+    #Draws large orders in vectorized passes, small ones one number at a time
+    if useBatchGenerator(userArgs["numTickets"]):
+
+        numSelected = game.drawTicketsBatch(userArgs["numTickets"],
+                                            ticketRandom)
+
+    else:
+
+        numSelected = game.drawTickets(userArgs["numTickets"], ticketRandom)
+
+    #Replaces tickets holding a set that any process already issued
+    if seenSets is not None:
+
+        numSelected, numRedraws = seenSets.keepUnique(
+                        userArgs["lotteryType"], numSelected,
+                        lambda numTickets: game.drawTickets(numTickets,
+                                                            ticketRandom))
+
+        countMetric("unique_redraws_total", numRedraws)
+
+    return numSelected, game.rulesText
+
+
+#Decides whether an order is drawn by the NumPy batch generator
+def useBatchGenerator(numTickets):
+
+    if numpy is None or serverOptions["generator"] == "python":
+
+        return False
+
+    if serverOptions["generator"] == "numpy":
+
+        return True
+
+    return numTickets >= BATCH_THRESHOLD
+
+
+#Creates the randomness backend chosen by the user
+def startRandom(userArgs):
+
+    global ticketRandom
+
+    ticketRandom = Randomness.createBackend(userArgs.get("rngBackend",
+                                                         "random"),
+                                            userArgs.get("seed"))
+
+    #NumPy is loaded before anything forks when the batch generator may draw
+    #an order, so children and reservoir threads never import it themselves
+    if useBatchGenerator(BATCH_THRESHOLD):
+
+        LazyImport.load(numpy.random)
+
+    logger.info(f"Drawing numbers with the {ticketRandom.name} backend")
+
+
+#Counts forks in the parent so each child gets its own stream number
+def countFork():
+
+    global forkCount
+
+    forkCount += 1
+
+
+#Gives each forked process its own stream so children never repeat draws
+def spawnRandom():
+
+    global ticketRandom
+
+    ticketRandom = ticketRandom.spawn(forkCount)
+
+
+ticketRandom = Randomness.createBackend("random")
+forkCount = 0
+
+os.register_at_fork(before=countFork, after_in_child=spawnRandom)
+
+
+#Loads the game registry once, before any process is forked
+def startGames(userArgs):
+
+    global gameRegistry
+
+    gameRegistry = Games.loadGames(userArgs.get("gamesFile", GAMES_FILE))
+
+    #Binary clients name games by their wire code
+    Protocol.setGameCodes({lotteryType: game.code
+                           for lotteryType, game in gameRegistry.items()})
+
+    logger.info(f"Loaded games {list(gameRegistry)}")
+
+
+#Opens the response cache shared by every process of the daemon
+def startCache(userArgs):
+
+    global responseCache
+
+    if not userArgs.get("cacheFile"):
+
+        return
+
+    responseCache = ResponseCache.ResponseCache(
+        userArgs["cacheFile"], userArgs.get("cacheEntries", 10000),
+        userArgs.get("cacheTTL", 300), userArgs.get("cacheMaxTickets", 1000))
+
+    logger.info(f"Caching answered orders in {userArgs['cacheFile']}")
+
+
+#Creates the shared index of issued sets before any process is forked
+def startUniqueness(userArgs):
+
+    global seenSets
+
+    if not userArgs.get("uniqueSets"):
+
+        return
+
+    seenSets = Uniqueness.SeenSets(gameRegistry,
+                                   userArgs.get("uniqueMaxMB", 64) << 20)
+
+    logger.info(f"Issuing every set once, index uses {seenSets.size()} bytes")
+
+
+#Splits a --listen address into a socket family and a bind address
+def parseListenAddress(listenAddress):
+
+    if listenAddress.startswith("unix:"):
+
+        return socket.AF_UNIX, listenAddress[len("unix:"):]
+
+    socketAddress, separator, socketPort = listenAddress.rpartition(":")
+
+    if not separator or not socketPort.isdigit():
+
+        raise ValueError(f"Listen address {listenAddress} needs a port")
+
+    #IPv6 addresses are written in brackets so their colons stay apart
+    socketAddress = socketAddress.strip("[]") or None
+
+    addressInfo = socket.getaddrinfo(socketAddress, int(socketPort),
+                                     type=socket.SOCK_STREAM,
+                                     flags=socket.AI_PASSIVE)
+
+    return addressInfo[0][0], addressInfo[0][4]
+
+
+#Returns the listening sockets handed over by socket activation or by a
+#previous generation of the daemon, or an empty list
+def inheritSockets():
+
+    if os.environ.get("LISTEN_PID") != str(launchPid):
+
+        return []
+
+    numFds = int(os.environ.get("LISTEN_FDS", "0"))
+
+    #Children and later generations must not take the same descriptors
+    for variableName in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+
+        os.environ.pop(variableName, None)
+
+    listeners = []
+
+    for fileDescriptor in range(LISTEN_FDS_START, LISTEN_FDS_START + numFds):
+
+        socketObject = socket.socket(fileno=fileDescriptor)
+        socketObject.set_inheritable(False)
+        listeners.append(socketObject)
+
+    return listeners
+
+
+#Binds one listening socket, IPv6 sockets also accept IPv4 unless the port
+#is bound for IPv4 separately. With reusePort other sockets of the daemon may
+#bind the same TCP address
+def bindAddress(socketFamily, socketNumber, userArgs, ipv6Only=False,
+                reusePort=False):
+
+    socketObject = socket.socket(socketFamily, socket.SOCK_STREAM)
+
+    try:
+
+        if socketFamily == socket.AF_UNIX:
+
+            #A path left behind by a daemon that died is reused, a live
+            #one is not
+            if os.path.exists(socketNumber):
+
+                try:
+
+                    with socket.socket(socket.AF_UNIX) as probeSocket:
+
+                        probeSocket.connect(socketNumber)
+
+                    raise OSError(f"{socketNumber} is in use")
+
+                except ConnectionRefusedError:
+
+                    os.unlink(socketNumber)
+
+            socketObject.bind(socketNumber)
+            os.chmod(socketNumber, userArgs.get("unixMode", 0o660))
+            unixPaths.append(socketNumber)
+
+        else:
+
+            socketObject.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+
+            if reusePort:
+
+                socketObject.setsockopt(socket.SOL_SOCKET,
+                                        socket.SO_REUSEPORT, 1)
+
+            if socketFamily == socket.AF_INET6:
+
+                socketObject.setsockopt(socket.IPPROTO_IPV6,
+                                        socket.IPV6_V6ONLY, int(ipv6Only))
+
+            socketObject.bind(socketNumber)
+
+    except OSError:
+
+        socketObject.close()
+        raise
+
+    return socketObject
+
+
+#Binds every address the daemon listens on, or takes over inherited sockets
+def bindListeners(userArgs):
+
+    global listenerPid
+
+    #Recorded before binding, so the paths of a daemon that fails part way
+    #through are still removed by it
+    listenerPid = os.getpid()
+
+    listeners = inheritSockets()
+
+    if listeners:
+
+        logger.info(f"Inherited {len(listeners)} listening sockets")
+
+        #Unix paths handed over by a reload are removed by this generation,
+        #paths of socket activation belong to the service manager
+        if readyPipe is not None:
+
+            unixPaths.extend(socketObject.getsockname() for socketObject in
+                             listeners if socketObject.family ==
+                             socket.AF_UNIX)
+
+            atexit.register(removeUnixPaths)
+
+    else:
+
+        listenAddresses = userArgs.get("listenAddresses") or \
+                          [f"[{userArgs['socketAddress']}]:"
+                           f"{userArgs['socketPort']}"]
+
+        #Creates socket number for each address and error handling
+        try:
+
+            socketNumbers = [parseListenAddress(listenAddress)
+                             for listenAddress in listenAddresses]
+
+        except (ValueError, OSError) as e:
+
+            logger.info(f"Failed to resolve listen address, error code: {e}.")
+            exit()
+
+        #Ports bound for IPv4 are left out of dual-stack IPv6 sockets
+        ipv4Ports = {socketNumber[1] for socketFamily, socketNumber in
+                     socketNumbers if socketFamily == socket.AF_INET}
+
+        for socketFamily, socketNumber in socketNumbers:
+
+            try:
+
+                listeners.append(bindAddress(
+                        socketFamily, socketNumber, userArgs,
+                        socketFamily == socket.AF_INET6 and
+                        socketNumber[1] in ipv4Ports,
+                        userArgs["engine"] == "prefork"))
+
+            except OSError as e:
+
+                logger.info(f"Failed to bind {socketNumber}, error code: {e}.")
+                exit()
+
+        atexit.register(removeUnixPaths)
+
+    for socketObject in listeners:
+
+        #Listens for incoming connections with a queue up to backlog
+        #connections, a TCP address of the prefork engine is only held here
+        #and every worker listens on it with a socket of its own
+        if userArgs["engine"] != "prefork" or not reservesPort(socketObject):
+
+            socketObject.listen(userArgs.get("backlog", socket.SOMAXCONN))
+
+        #Several listeners are waited on together, an accept another
+        #process won must not block. The mode is shared with any other
+        #generation holding the socket, so the event loop never sets it
+        #blocking even for a moment
+        socketObject.setblocking(len(listeners) == 1 and
+                                 userArgs["engine"] != "asyncio")
+
+        print(f"\nListening for incoming connections on "
+              f"{socketObject.getsockname()}...")
+
+    #Kept for a reload, which hands these sockets to the next generation
+    activeListeners[:] = listeners
+
+    return listeners
+
+
+#Whether a socket holds a TCP address for SO_REUSEPORT listeners without
+#listening itself
+def reservesPort(socketObject):
+
+    return socketObject.family != socket.AF_UNIX and \
+           not socketObject.getsockopt(socket.SOL_SOCKET,
+                                       socket.SO_ACCEPTCONN) and \
+           bool(socketObject.getsockopt(socket.SOL_SOCKET,
+                                        socket.SO_REUSEPORT))
+
+
+#Replaces each address the supervisor holds with a SO_REUSEPORT listener of
+#this worker, so the kernel hands each connection to one worker and only it
+#wakes up. Unix and inherited listening sockets stay shared
+def bindWorkerListeners(userArgs, listeners):
+
+    workerListeners = []
+
+    for socketObject in listeners:
+
+        if not reservesPort(socketObject):
+
+            workerListeners.append(socketObject)
+            continue
+
+        ipv6Only = socketObject.family == socket.AF_INET6 and \
+                   bool(socketObject.getsockopt(socket.IPPROTO_IPV6,
+                                                socket.IPV6_V6ONLY))
+
+        workerSocket = bindAddress(socketObject.family,
+                                   socketObject.getsockname(), userArgs,
+                                   ipv6Only, reusePort=True)
+        workerSocket.listen(userArgs.get("backlog", socket.SOMAXCONN))
+
+        #Blocking accepts only work on a worker's single listener
+        workerSocket.setblocking(len(listeners) == 1)
+
+        socketObject.close()
+        workerListeners.append(workerSocket)
+        workerSockets.append(workerSocket)
+
+    #A reload makes the worker stop accepting on its own listeners
+    activeListeners[:] = workerListeners
+
+    return workerListeners
+
+
+#Removes the unix sockets this daemon bound, processes forked from it exit
+#without touching paths the daemon still serves on
+def removeUnixPaths():
+
+    if os.getpid() != listenerPid:
+
+        return
+
+    for unixPath in unixPaths:
+
+        try:
+
+            os.unlink(unixPath)
+
+        except FileNotFoundError:
+
+            pass
+
+    unixPaths.clear()
+
+
+#Waits for a connection on any listener, None when another process took it
+def acceptConnection(listeners):
+
+    if len(listeners) == 1:
+
+        return listeners[0].accept()
+
+    readable, _, _ = select.select(listeners, [], [])
+
+    try:
+
+        return readable[0].accept()
+
+    except BlockingIOError:
+
+        return None
+
+
+#Points the descriptors of the listeners at an unbound socket, so accept
+#fails in this process while the listening sockets stay open in the next
+#generation
+def stopAccepting(listeners):
+
+    with socket.socket() as closedSocket:
+
+        for socketObject in listeners:
+
+            os.dup2(closedSocket.fileno(), socketObject.fileno(),
+                    inheritable=False)
+
+
+#Executes the next generation of the daemon with the listeners passed the
+#way socket activation passes them, returns its pid and the pipe it reports
+#ready on
+def spawnGeneration(listeners):
+
+    readyRead, readyWrite = os.pipe()
+
+    try:
+
+        processID = os.fork()
+
+    except OSError:
+
+        os.close(readyRead)
+        os.close(readyWrite)
+        raise
+
+    if processID == 0:
+
+        try:
+
+            #Descriptors are first copied above the ones they are placed on,
+            #so none is overwritten before it is moved
+            numFds = len(listeners)
+            passedFds = [socketObject.fileno() for socketObject in
+                         listeners] + [readyWrite]
+            movedFds = [fcntl.fcntl(fileDescriptor, fcntl.F_DUPFD_CLOEXEC,
+                                    LISTEN_FDS_START + len(passedFds))
+                        for fileDescriptor in passedFds]
+
+            for fdNum, fileDescriptor in enumerate(movedFds):
+
+                os.dup2(fileDescriptor, LISTEN_FDS_START + fdNum)
+
+            os.environ.update(LISTEN_FDS=str(numFds),
+                              LISTEN_PID=str(os.getpid()),
+                              LOTTERY_READY_FD=str(LISTEN_FDS_START + numFds))
+
+            #Signals held back by the engine must not stay blocked after exec
+            signal.pthread_sigmask(signal.SIG_SETMASK, set())
+
+            os.chdir(launchDirectory)
+            os.execv(sys.executable, [sys.executable, SERVER_SCRIPT] +
+                     sys.argv[1:])
+
+        finally:
+
+            os._exit(1)
+
+    os.close(readyWrite)
+    helperProcesses.add(processID)
+
+    return processID, readyRead
+
+
+#Waits for the next generation to accept connections, then records it in the
+#PID file, a generation that fails to start is stopped
+def awaitGeneration(processID, readyRead):
+
+    try:
+
+        readable, _, _ = select.select([readyRead], [], [], RELOAD_TIMEOUT)
+        isReady = bool(readable) and os.read(readyRead, 1) == b"1"
+
+    finally:
+
+        os.close(readyRead)
+
+    if not isReady:
+
+        try:
+
+            os.kill(processID, signal.SIGKILL)
+            os.waitpid(processID, 0)
+
+        except (ProcessLookupError, ChildProcessError):
+
+            pass
+
+        logger.info(f"Reload failed, generation with pid {processID} did not "
+                    "start accepting connections")
+
+        return False
+
+    if daemonPidFile is not None:
+
+        with open(daemonPidFile, "w") as fileOutput:
+
+            print(processID, file=fileOutput)
+
+    #Paths now belong to the next generation and must outlive this one
+    unixPaths.clear()
+
+    logger.info(f"Generation with pid {processID} took over, draining "
+                f"generation with pid {os.getpid()}")
+
+    return True
+
+
+#Tells the previous generation that this one accepts connections
+def notifyReady():
+
+    global readyPipe
+
+    if readyPipe is None:
+
+        return
+
+    try:
+
+        os.write(int(readyPipe), b"1")
+        os.close(int(readyPipe))
+
+    except OSError as e:
+
+        logger.info(f"Could not report ready, error code: {e}")
+
+    readyPipe = None
+
+
+#Creates a listener to accept incoming connections
+def createSocket(userArgs):
+
+    #Listens for incoming connections with a queue up to --backlog connections
+    listeners = bindListeners(userArgs)
+
+    #Signal to handle children and prevent zombie processes
+    signal.signal(signal.SIGCHLD, signalHandler)
+
+    notifyReady()
+
+    #Listens for incoming connections and executes upon accepted connections
+    while True:
+
+        #Parses socket object for client and host address, the listeners
+        #stop accepting once a reload handed them over
+        try:
+
+            connection = acceptConnection(listeners)
+
+        except OSError:
+
+            if draining:
+
+                break
+
+            raise
+
+        if connection is None:
+
+            continue
+
+        clientSocket, userAddress = connection
+        requestTrace = sampleTrace()
+        logConnection(f"Connection from {userAddress} has been established!")
+        countMetric("accepts_total")
+
+        #Sheds the connection before forking when the server is saturated
+        admissionControl.inFlight = len(childProcesses)
+
+        if not admissionControl.admit(clientSocket, userAddress):
+
+            continue
+
+        #Holds SIGCHLD until the new child is recorded so it cannot be reaped
+        #before it is counted
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGCHLD})
+
+        #Each child gets a slot no other running child writes to, so its
+        #counters need no lock
+        slotNum = freeChildSlots.pop() if freeChildSlots else SHARED_SLOT
+
+        #Create child of parent process
+        try:
+
+            processID = os.fork()
+
+        except OSError as e:
+
+            logger.info(f"Error: Could not create child, error code: {e}")
+            releaseChildSlot(slotNum)
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+            clientSocket.close()
+            continue
+        
+        #Execute instructions for child process, which never returns into
+        #the accept loop or runs the daemon's exit handlers
+        if processID == 0:
+
+            try:
+
+                signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+
+                logConnection(f"Starting child with pid {os.getpid()}")
+
+                #Children write their metrics to the slot the parent chose
+                if serverMetrics is not None:
+
+                    serverMetrics.useSlot(slotNum)
+
+                #A sampled connection records how long the fork took, a profile
+                #running in the parent carries on in the child
+                if requestTrace is not None:
+
+                    requestTrace.mark("fork")
+                    currentTrace.set(requestTrace)
+
+                if profileSession is not None:
+
+                    profileSession.forked()
+                    profilingControl.register(slotNum)
+
+                #Retrieves client args and sends ticket results to client, an
+                #unexpected error is logged and counted before the child exits
+                try:
+
+                    handleChild(clientSocket, userAddress)
+
+                except Exception as e:
+
+                    logger.info(f"Failed to serve {userAddress}, error code: "
+                                f"{e!r}")
+                    countMetric("connection_errors_total")
+                    clientSocket.close()
+
+                for socketObject in listeners:
+
+                    socketObject.close()
+
+                #Each child writes its share of the profile before it exits
+                if profileSession is not None and profileSession.running():
+
+                    profileSession.stop()
+
+                logConnection(f"Closing child with pid {os.getpid()}")
+
+            finally:
+
+                #Closes child process without cleanup
+                os._exit(0)
+
+        #Execute instructions for parent process
+        else:
+
+            childProcesses[processID] = slotNum
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGCHLD})
+
+            #Parent counts children alive, signalHandler counts them down
+            countMetric("forks_total")
+            countMetric("active_connections")
+
+            if profileSession is not None and profileSession.running():
+
+                profileSession.numChildren += 1
+            
+            #Releases socket and closes connection after child dies
+            handleParent(clientSocket)
+
+    #Children still serving are reaped by signalHandler as they finish, or
+    #ended by the drain timeout
+    while childProcesses:
+
+        time.sleep(0.05)
+
+    logger.info(f"Generation with pid {os.getpid()} drained")
+
+
+#Starts long-lived workers that each listen on the TCP addresses and run
+#their own accepts
+def createWorkerPool(userArgs):
+
+    #The supervisor holds every address, workers add their own SO_REUSEPORT
+    #listeners and share unix and inherited sockets
+    listeners = bindListeners(userArgs)
+
+    #Each worker serves one connection at a time, so an in-flight cap below
+    #the number of workers is enforced by starting fewer of them
+    if poolSize(userArgs) < userArgs["numWorkers"]:
+
+        logger.info(f"--max-inflight {userArgs['maxInFlight']} limits the "
+                    f"pool to {poolSize(userArgs)} workers")
+
+    for workerNum in range(poolSize(userArgs)):
+
+        workerProcesses[spawnWorker(userArgs, workerNum, listeners)] = \
+            (workerNum, time.time())
+
+    logger.info(f"Started {len(workerProcesses)} workers with pids "
+                f"{list(workerProcesses)}")
+    setMetric("workers", len(workerProcesses))
+
+    notifyReady()
+
+    #Supervises workers and restarts any worker that exits, until a reload
+    #leaves none to wait for
+    try:
+
+        while workerProcesses or not draining:
+
+            try:
+
+                processID, exitStatus = os.wait()
+
+            except ChildProcessError:
+
+                return
+
+            if processID not in workerProcesses:
+
+                continue
+
+            workerNum, startTime = workerProcesses.pop(processID)
+
+            if profilingControl is not None:
+
+                profilingControl.unregister(workerNum + 1, processID)
+
+            #Workers of a generation replaced by a reload are not restarted
+            if draining:
+
+                logger.info(f"Worker {workerNum} with pid {processID} drained")
+                continue
+
+            logger.info(f"Worker {workerNum} with pid {processID} exited with "
+                        f"status {exitStatus}, restarting")
+
+            #Slows down restarts of workers that die straight after starting
+            if time.time() - startTime < 1:
+
+                time.sleep(1)
+
+            workerProcesses[spawnWorker(userArgs, workerNum, listeners)] = \
+                (workerNum, time.time())
+            countMetric("worker_restarts_total")
+
+        logger.info(f"Generation with pid {os.getpid()} drained")
+
+    #Stops every worker when the supervisor is terminated
+    finally:
+
+        for processID in workerProcesses:
+
+            try:
+
+                os.kill(processID, signal.SIGTERM)
+
+            except ProcessLookupError:
+
+                pass
+
+        #Reaps the workers so their usage counts towards the supervisor
+        for processID in workerProcesses:
+
+            try:
+
+                os.waitpid(processID, 0)
+
+            except ChildProcessError:
+
+                pass
+
+
+#Number of prefork workers, never more than the in-flight cap
+def poolSize(userArgs):
+
+    numWorkers = max(1, userArgs["numWorkers"])
+
+    if userArgs.get("maxInFlight", 0) > 0:
+
+        numWorkers = min(numWorkers, userArgs["maxInFlight"])
+
+    return numWorkers
+
+
+#Forks one worker process and returns its pid to the supervisor
+def spawnWorker(userArgs, workerNum, listeners):
+
+    try:
+
+        processID = os.fork()
+
+    except OSError as e:
+
+        raise RuntimeError(f"Could not create worker, error code: {e}")
+
+    #Execute instructions for worker process
+    if processID == 0:
+
+        #Workers die on SIGTERM instead of running supervisor cleanup
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        #A reload makes workers finish their connection and exit
+        signal.signal(signal.SIGHUP, stopWorker)
+
+        #A profile of the supervisor is not carried into its workers
+        if profileSession is not None:
+
+            profileSession.discard()
+            profilingControl.register(workerNum + 1)
+
+        #Each worker writes its metrics to its own slot
+        if serverMetrics is not None:
+
+            serverMetrics.useSlot(workerNum + 1)
+
+        try:
+
+            handleWorker(userArgs, workerNum, listeners)
+
+        finally:
+
+            #Closes worker process without cleanup
+            os._exit(1)
+
+    return processID
+
+
+#Accepts and handles connections inside a worker without forking
+def handleWorker(userArgs, workerNum, listeners):
+
+    #Listens on the TCP addresses with sockets of this worker
+    listeners = bindWorkerListeners(userArgs, listeners)
+
+    #Each worker fills its own reservoir after forking
+    startReservoir(userArgs)
+
+    logger.info(f"Starting worker {workerNum} with pid {os.getpid()}")
+
+    while True:
+
+        #The kernel hands each TCP connection to one worker's listener, a
+        #shared socket to whichever worker accepts it first, until a reload
+        #hands them over. Connections a reload took off the worker's own
+        #listeners are served before it exits
+        try:
+
+            connection = acceptConnection(listeners)
+
+        except OSError:
+
+            if not draining:
+
+                raise
+
+            if not pendingConnections:
+
+                return
+
+            connection = pendingConnections.popleft()
+
+        if connection is None:
+
+            continue
+
+        clientSocket, userAddress = connection
+        currentTrace.set(sampleTrace())
+        logConnection(f"Connection from {userAddress} has been established!")
+        countMetric("accepts_total")
+
+        if not admissionControl.admit(clientSocket, userAddress):
+
+            continue
+
+        admissionControl.inFlight += 1
+        countMetric("active_connections")
+
+        #Retrieves client args and sends ticket results to client, an
+        #unexpected error only closes this connection and the worker keeps
+        #serving the others
+        try:
+
+            handleChild(clientSocket, userAddress)
+
+        except Exception as e:
+
+            logger.info(f"Failed to serve {userAddress}, error code: {e!r}")
+            countMetric("connection_errors_total")
+            clientSocket.close()
+
+        finally:
+
+            admissionControl.inFlight -= 1
+            countMetric("active_connections", -1)
+
+
+#Creates a listener serving every connection from a single asyncio event loop
+def createAsyncSocket(userArgs):
+
+    asyncio.run(serveAsync(userArgs))
+
+
+#Accepts connections on the event loop instead of forking per connection
+async def serveAsync(userArgs):
+
+    #Queue defaults to SOMAXCONN for thousands of clients connecting at once
+    listeners = bindListeners(userArgs)
+
+    servers = []
+
+    for socketObject in listeners:
+
+        socketObject.setblocking(False)
+
+        servers.append(await asyncio.start_server(handleAsyncClient,
+                                                  sock=socketObject))
+
+    startReservoir(userArgs)
+
+    logger.info("Serving connections with the asyncio engine")
+
+    #SIGTERM stops the event loop cleanly instead of raising inside callbacks
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM,
+                                                  asyncio.current_task().cancel)
+
+    #SIGHUP hands the listeners to the next generation
+    asyncio.get_running_loop().add_signal_handler(
+            signal.SIGHUP, lambda: asyncio.ensure_future(reloadAsync(servers)))
+
+    notifyReady()
+
+    try:
+
+        await asyncio.gather(*(server.serve_forever() for server in servers))
+
+    except asyncio.CancelledError:
+
+        logger.info(f"Stopping asyncio engine with pid {os.getpid()}")
+
+    finally:
+
+        for server in servers:
+
+            server.close()
+
+    #Servers closed by a reload still finish the connections they accepted
+    if draining:
+
+        await drainAsync()
+
+
+#Starts the next generation from the event loop, then closes the servers so
+#this generation only finishes the connections it already has
+async def reloadAsync(servers):
+
+    global reloading, draining
+
+    if reloading:
+
+        return
+
+    reloading = True
+
+    try:
+
+        processID, readyRead = spawnGeneration(activeListeners)
+
+    except OSError as e:
+
+        logger.info(f"Reload failed, error code: {e}")
+        reloading = False
+        return
+
+    #Waiting for the next generation to start must not stall connections
+    if not await asyncio.to_thread(awaitGeneration, processID, readyRead):
+
+        reloading = False
+        return
+
+    draining = True
+
+    for server in servers:
+
+        server.close()
+
+
+#Waits for the connections of a replaced generation, ending those still open
+#when the drain timeout runs out
+async def drainAsync():
+
+    drainDeadline = time.monotonic() + serverOptions["drainTimeout"]
+
+    try:
+
+        while admissionControl.inFlight and time.monotonic() < drainDeadline:
+
+            await asyncio.sleep(0.05)
+
+    #SIGTERM during the drain ends it straight away
+    except asyncio.CancelledError:
+
+        pass
+
+    logger.info(f"Generation with pid {os.getpid()} drained, ending "
+                f"{admissionControl.inFlight} connections still open")
+
+
+#Checks whether the bytes received hold a whole text request, which ends in
+#a new line or closes every brace it opened
+def isCompleteRequest(dataReceived):
+
+    requestText = dataReceived.rstrip()
+
+    return dataReceived.endswith(b"\n") or \
+           (requestText.endswith(b"}") and
+            requestText.count(b"{") == requestText.count(b"}"))
+
+
+#Receives the rest of a text request split across segments, which must all
+#arrive within the body timeout
+def readTextRequest(clientSocket, dataReceived):
+
+    requestDeadline = time.monotonic() + serverOptions["bodyTimeout"]
+    dataReceived = bytearray(dataReceived)
+
+    while not isCompleteRequest(dataReceived):
+
+        if len(dataReceived) > MAX_REQUEST_BYTES:
+
+            raise ValueError(f"Request is larger than {MAX_REQUEST_BYTES} "
+                             "bytes")
+
+        timeLeft = requestDeadline - time.monotonic()
+
+        if timeLeft <= 0:
+
+            raise socket.timeout("Request was not received in time")
+
+        clientSocket.settimeout(timeLeft)
+
+        chunk = clientSocket.recv(MAX_REQUEST_BYTES)
+
+        if not chunk:
+
+            raise ConnectionError("Connection closed before the request was "
+                                  "complete")
+
+        dataReceived += chunk
+
+    return bytes(dataReceived)
+
+
+#Asyncio version of readTextRequest
+async def readTextRequestAsync(reader, dataReceived):
+
+    requestDeadline = time.monotonic() + serverOptions["bodyTimeout"]
+    dataReceived = bytearray(dataReceived)
+
+    while not isCompleteRequest(dataReceived):
+
+        if len(dataReceived) > MAX_REQUEST_BYTES:
+
+            raise ValueError(f"Request is larger than {MAX_REQUEST_BYTES} "
+                             "bytes")
+
+        timeLeft = requestDeadline - time.monotonic()
+
+        if timeLeft <= 0:
+
+            raise asyncio.TimeoutError("Request was not received in time")
+
+        chunk = await asyncio.wait_for(reader.read(MAX_REQUEST_BYTES),
+                                       timeLeft)
+
+        if not chunk:
+
+            raise ConnectionError("Connection closed before the request was "
+                                  "complete")
+
+        dataReceived += chunk
+
+    return bytes(dataReceived)
+
+
+#Converts the request received from a client into a dictionary
+def parseRequest(dataReceived):
+
+    #Decodes and strips trailing new lines
+    dataDecoded = dataReceived.decode("utf-8")
+    dataDecoded = dataDecoded.rstrip("\n")
+
+    #Client sends a dictionary literal which safe_load parses as a flow mapping
+    return yaml.load(dataDecoded, Loader=YAML_LOADER)
+
+
+#Generates an order in chunks so large orders never sit in memory at once
+def iterateNumbers(dataDecoded, bulkPool=None):
+
+    #Time spent drawing each chunk counts towards a sampled request
+    requestTrace = currentTrace.get()
+    generateStart = time.perf_counter()
+
+    #A retried order gets the tickets it was first issued
+    cachedResults = lookupCache(dataDecoded)
+
+    if cachedResults is not None:
+
+        if requestTrace is not None:
+
+            requestTrace.addSince("generate", generateStart)
+
+        for chunkStart in range(0, len(cachedResults), STREAM_CHUNK):
+
+            dataResults = cachedResults[chunkStart:chunkStart + STREAM_CHUNK]
+
+            countMetric("tickets_total", len(dataResults))
+
+            yield dataResults
+
+        return
+
+    #Numbers of a cacheable order are kept packed until it has been answered
+    cacheBuffer = bytearray() if isCacheable(dataDecoded) else None
+
+    ticketsLeft = dataDecoded["numTickets"]
+
+    while ticketsLeft > 0:
+
+        generateStart = time.perf_counter()
+        chunkTickets = min(STREAM_CHUNK, ticketsLeft)
+
+        #Orders of a bulk request share draws made for the whole request
+        if bulkPool is not None:
+
+            dataResults = bulkPool.take(dataDecoded["lotteryType"],
+                                        chunkTickets)
+
+        else:
+
+            dataResults = drawChunk(dataDecoded["lotteryType"], chunkTickets)
+
+        countMetric("tickets_total", chunkTickets)
+
+        #Tickets reach the ledger before they are sent
+        if ledgerPipe is not None:
+
+            Ledger.sendRecords(ledgerPipe, Ledger.packRecords(
+                dataDecoded.get("uniqueID", ""),
+                gameRegistry[dataDecoded["lotteryType"]].code, dataResults,
+                dataDecoded["numTickets"] - ticketsLeft + 1))
+
+        if cacheBuffer is not None:
+
+            Protocol.packNumbersInto(cacheBuffer, dataResults)
+
+        if requestTrace is not None:
+
+            requestTrace.addSince("generate", generateStart)
+
+        yield dataResults
+
+        ticketsLeft -= chunkTickets
+
+    if cacheBuffer is not None:
+
+        storeCache(dataDecoded, dataResults, cacheBuffer)
+
+
+#Serves tickets from the reservoir and generates whatever it cannot provide
+def drawChunk(lotteryType, numTickets):
+
+    #Serves pre-generated tickets first when the reservoir is enabled
+    if ticketReservoir is not None:
+
+        dataResults = ticketReservoir.take(lotteryType, numTickets)
+
+    else:
+
+        dataResults = []
+
+    #Generates inline whatever the reservoir could not provide
+    if len(dataResults) < numTickets:
+
+        generateStart = time.perf_counter()
+
+        inlineResults, gameRules = generateNumbers({
+                                "lotteryType": lotteryType,
+                                "numTickets": numTickets - len(dataResults)})
+
+        if serverMetrics is not None:
+
+            serverMetrics.observeGenerate(lotteryType, time.perf_counter() -
+                                          generateStart)
+
+        dataResults.extend(inlineResults)
+
+    return dataResults
+
+
+#Tickets drawn for every order of a bulk request, one game at a time
+class BulkPool:
+
+    def __init__(self, bulkOrders, orderErrors):
+
+        #Tickets still owed to the valid orders of each game
+        self.ticketsOwed = collections.Counter()
+
+        for bulkOrder, orderError in zip(bulkOrders, orderErrors):
+
+            if orderError is None:
+
+                self.ticketsOwed[bulkOrder["lotteryType"]] += \
+                    bulkOrder["numTickets"]
+
+        self.drawnTickets = collections.defaultdict(list)
+
+    #Hands out tickets, drawing for many orders at once when the pool runs out
+    def take(self, lotteryType, numTickets):
+
+        drawnTickets = self.drawnTickets[lotteryType]
+
+        if len(drawnTickets) < numTickets:
+
+            #One draw covers the following orders too, up to a batch
+            numDrawn = max(numTickets - len(drawnTickets),
+                           min(Games.BATCH_SIZE, self.ticketsOwed[lotteryType] -
+                               len(drawnTickets)))
+
+            drawnTickets.extend(drawChunk(lotteryType, numDrawn))
+
+        dataResults = drawnTickets[:numTickets]
+        del drawnTickets[:numTickets]
+
+        self.ticketsOwed[lotteryType] -= numTickets
+
+        return dataResults
+
+
+#Checks every order of a bulk request, returns the orders and an error message
+#for each order that is invalid or None for each valid one
+def validateBulk(dataDecoded):
+
+    bulkOrders = dataDecoded.get("orders")
+
+    if not isinstance(bulkOrders, list) or not bulkOrders:
+
+        raise ValueError("A bulk request needs a list of orders.")
+
+    if len(bulkOrders) > MAX_BULK_ORDERS:
+
+        raise ValueError(f"A bulk request holds at most {MAX_BULK_ORDERS} "
+                         "orders.")
+
+    orderErrors = []
+
+    for bulkOrder in bulkOrders:
+
+        try:
+
+            validateRequest(bulkOrder)
+            orderErrors.append(None)
+
+        except ValueError as e:
+
+            orderErrors.append(str(e))
+
+    return bulkOrders, orderErrors
+
+
+#Checks a parsed text request and returns the chunks of its response
+def prepareResponse(dataDecoded):
+
+    #Bulk requests carry many orders answered one after another
+    if isinstance(dataDecoded, dict) and "orders" in dataDecoded:
+
+        return iterateBulkResponse(*validateBulk(dataDecoded))
+
+    return iterateResponse(validateRequest(dataDecoded))
+
+
+#Checks whether an order is small enough and identified for the cache
+def isCacheable(dataDecoded):
+
+    return responseCache is not None and \
+           bool(dataDecoded.get("uniqueID")) and \
+           dataDecoded["numTickets"] <= responseCache.maxTickets
+
+
+#Returns the tickets a cached order was answered with, or None
+def lookupCache(dataDecoded):
+
+    if not isCacheable(dataDecoded):
+
+        return None
+
+    try:
+
+        cachedOrder, numEvicted = responseCache.get(
+            str(dataDecoded["uniqueID"]), dataDecoded["lotteryType"],
+            dataDecoded["numTickets"])
+
+    #The cache is only a shortcut, the order is generated without it
+    except ResponseCache.CacheError as e:
+
+        logger.info(f"Response cache lookup failed, error code: {e}")
+        return None
+
+    countMetric("cache_evictions_total", numEvicted)
+
+    if cachedOrder is None:
+
+        countMetric("cache_misses_total")
+        return None
+
+    countMetric("cache_hits_total")
+
+    setPerTicket, numberPerSet, packedNumbers = cachedOrder
+
+    return Protocol.unpackNumbers({"setPerTicket": setPerTicket,
+                                   "numberPerSet": numberPerSet},
+                                  packedNumbers)
+
+
+#Keeps an answered order so a retry gets the same tickets
+def storeCache(dataDecoded, lastResults, cacheBuffer):
+
+    try:
+
+        countMetric("cache_evictions_total", responseCache.put(
+            str(dataDecoded["uniqueID"]), dataDecoded["lotteryType"],
+            dataDecoded["numTickets"], len(lastResults[0]),
+            len(lastResults[0][0]), cacheBuffer))
+
+    except ResponseCache.CacheError as e:
+
+        logger.info(f"Response cache store failed, error code: {e}")
+
+
+#Encodes the rules, unique ID and ticket numbers sent back to a client
+def iterateResponse(dataDecoded):
+
+    countMetric("requests_total")
+
+    game = gameRegistry[dataDecoded["lotteryType"]]
+
+    #Rules were encoded when the games loaded and are sent as they are
+    yield game.rulesBytes
+    yield bytes(f"Unique ID: {dataDecoded['uniqueID']}\n\n", "utf-8")
+
+    yield from iterateTickets(dataDecoded, game)
+
+
+#Encodes the tickets of one order in the text response format
+def iterateTickets(dataDecoded, game, bulkPool=None):
+
+    #Counter for tickets per play
+    ticketNum = 1
+
+    #Every chunk is encoded into the same buffer, writers send or copy a chunk
+    #before asking for the next one
+    responseBuffer = bytearray()
+    requestTrace = currentTrace.get()
+
+    for dataResults in iterateNumbers(dataDecoded, bulkPool):
+
+        encodeStart = time.perf_counter()
+        del responseBuffer[:]
+
+        Protocol.encodeTicketsInto(responseBuffer, dataResults,
+                                   game.ticketTemplate, ticketNum)
+        ticketNum += len(dataResults)
+
+        if requestTrace is not None:
+
+            requestTrace.addSince("encode", encodeStart)
+
+        yield responseBuffer
+
+
+#Encodes every order of a bulk text request, each opened by its unique ID and
+#answered with its tickets or an error line, rules are left out
+def iterateBulkResponse(bulkOrders, orderErrors):
+
+    bulkPool = BulkPool(bulkOrders, orderErrors)
+
+    yield bytes(f"Bulk order of {len(bulkOrders)} entries\n\n", "utf-8")
+
+    for bulkOrder, orderError in zip(bulkOrders, orderErrors):
+
+        uniqueID = bulkOrder.get("uniqueID", "") \
+                   if isinstance(bulkOrder, dict) else ""
+
+        if orderError is not None:
+
+            countMetric("invalid_requests_total")
+            yield bytes(f"Unique ID: {uniqueID}\nError: {orderError}\n\n",
+                        "utf-8")
+            continue
+
+        countMetric("requests_total")
+
+        yield bytes(f"Unique ID: {uniqueID}\n\n", "utf-8")
+
+        yield from iterateTickets(bulkOrder,
+                                  gameRegistry[bulkOrder["lotteryType"]],
+                                  bulkPool)
+
+
+#Encodes a binary response frame for a binary request frame, or one frame per
+#order of a bulk request frame
+def iterateBinaryResponse(frameHeader, lastFrame=False, payload=b""):
+
+    uniqueID = frameHeader["uniqueID"]
+
+    if frameHeader["frameType"] == Protocol.FRAME_BULK:
+
+        yield from iterateBinaryBulk(uniqueID, payload, lastFrame)
+        return
+
+    if frameHeader["frameType"] != Protocol.FRAME_REQUEST:
+
+        yield Protocol.packError(uniqueID, "Expected a request frame",
+                                 lastFrame=lastFrame)
+        return
+
+    dataDecoded = {"lotteryType": frameHeader["lotteryType"],
+                   "numTickets": frameHeader["numTickets"],
+                   "uniqueID": uniqueID}
+
+    #Invalid requests are answered with an error frame
+    try:
+
+        validateRequest(dataDecoded)
+
+    except ValueError as e:
+
+        logger.info(f"Invalid request, error code: {e}")
+        countMetric("invalid_requests_total")
+        yield Protocol.packError(uniqueID, str(e), lastFrame=lastFrame)
+        return
+
+    markTrace("parse")
+
+    yield from iterateBinaryTickets(dataDecoded, lastFrame)
+
+
+#Answers every order of a bulk request frame with a response or error frame
+#tagged by the unique ID of the order
+def iterateBinaryBulk(bulkID, payload, lastFrame=False):
+
+    try:
+
+        bulkOrders, orderErrors = validateBulk(
+                            {"orders": Protocol.unpackBulkOrders(payload)})
+
+    except ValueError as e:
+
+        logger.info(f"Invalid bulk request, error code: {e}")
+        countMetric("invalid_requests_total")
+        yield Protocol.packError(bulkID, str(e), lastFrame=lastFrame)
+        return
+
+    markTrace("parse")
+
+    bulkPool = BulkPool(bulkOrders, orderErrors)
+
+    for orderNum, (bulkOrder, orderError) in enumerate(zip(bulkOrders,
+                                                           orderErrors)):
+
+        #Only the frame of the last order may end the session
+        lastOrder = lastFrame and orderNum == len(bulkOrders) - 1
+
+        if orderError is not None:
+
+            countMetric("invalid_requests_total")
+            yield Protocol.packError(bulkOrder["uniqueID"], orderError,
+                                     lastFrame=lastOrder)
+            continue
+
+        yield from iterateBinaryTickets(bulkOrder, lastOrder, bulkPool)
+
+
+#Encodes the response frame of one valid order
+def iterateBinaryTickets(dataDecoded, lastFrame=False, bulkPool=None):
+
+    uniqueID = dataDecoded["uniqueID"]
+
+    countMetric("requests_total")
+
+    #Numbers of every chunk are packed into the same buffer, see iterateResponse
+    payloadBuffer = bytearray()
+    requestTrace = currentTrace.get()
+
+    for chunkNum, dataResults in enumerate(iterateNumbers(dataDecoded,
+                                                          bulkPool)):
+
+        #Header goes first, the layout is known once the first chunk exists
+        if chunkNum == 0:
+
+            setPerTicket = len(dataResults[0])
+            numberPerSet = len(dataResults[0][0])
+            payloadLength = dataDecoded["numTickets"] * setPerTicket * \
+                            numberPerSet
+
+            if payloadLength > 0xFFFFFFFF:
+
+                yield Protocol.packError(uniqueID, "Order is too large for "
+                                         "one frame", lastFrame=lastFrame)
+                return
+
+            yield Protocol.packHeader(Protocol.FRAME_RESPONSE,
+                                      dataDecoded["lotteryType"],
+                                      dataDecoded["numTickets"], uniqueID,
+                                      payloadLength, setPerTicket,
+                                      numberPerSet, lastFrame)
+
+        encodeStart = time.perf_counter()
+        del payloadBuffer[:]
+        Protocol.packNumbersInto(payloadBuffer, dataResults)
+
+        if requestTrace is not None:
+
+            requestTrace.addSince("encode", encodeStart)
+
+        yield payloadBuffer
+
+
+#Pre-generated tickets per game, refilled by a background thread
+class TicketReservoir:
+
+    def __init__(self, lowWatermark, highWatermark, lotteryTypes):
+
+        self.lowWatermark = lowWatermark
+        self.highWatermark = max(lowWatermark, highWatermark)
+
+        #Popping from a deque is atomic, so every ticket is served only once
+        self.tickets = {lotteryType: collections.deque()
+                        for lotteryType in lotteryTypes}
+
+        self.hits = 0
+        self.misses = 0
+        self.refilledTickets = 0
+        self.refillSeconds = 0.0
+
+        self.refillNeeded = threading.Event()
+        self.refillNeeded.set()
+
+    #Starts the background producer thread
+    def start(self):
+
+        producer = threading.Thread(target=self.refill, name="reservoir",
+                                    daemon=True)
+        producer.start()
+
+        return self
+
+    #Pops up to the number of tickets asked for, counting hits and misses
+    def take(self, lotteryType, numTickets):
+
+        ticketQueue = self.tickets[lotteryType]
+        dataResults = []
+
+        try:
+
+            for i in range(numTickets):
+
+                dataResults.append(ticketQueue.popleft())
+
+        except IndexError:
+
+            pass
+
+        self.hits += len(dataResults)
+        self.misses += numTickets - len(dataResults)
+
+        countMetric("reservoir_hits_total", len(dataResults))
+        countMetric("reservoir_misses_total", numTickets - len(dataResults))
+
+        if len(ticketQueue) < self.lowWatermark:
+
+            self.refillNeeded.set()
+
+        return dataResults
+
+    #Tops every game up to the high watermark whenever one runs low
+    def refill(self):
+
+        lastReport = time.time()
+
+        while True:
+
+            self.refillNeeded.wait(timeout=60)
+            self.refillNeeded.clear()
+
+            for lotteryType, ticketQueue in self.tickets.items():
+
+                if len(ticketQueue) >= self.lowWatermark:
+
+                    continue
+
+                refillStart = time.time()
+
+                #Generates in streaming sized batches so requests interleave
+                while len(ticketQueue) < self.highWatermark:
+
+                    numTickets = min(Games.BATCH_SIZE,
+                                     self.highWatermark - len(ticketQueue))
+
+                    #Orders draw whatever is left once a game runs out
+                    try:
+
+                        dataResults, gameRules = generateNumbers(
+                                                {"lotteryType": lotteryType,
+                                                 "numTickets": numTickets})
+
+                    except Uniqueness.ExhaustedError:
+
+                        break
+
+                    ticketQueue.extend(dataResults)
+                    self.refilledTickets += numTickets
+
+                self.refillSeconds += time.time() - refillStart
+
+            if time.time() - lastReport >= 60:
+
+                logger.info(f"Reservoir stats {self.stats()}")
+                lastReport = time.time()
+
+    #Returns counters, fill levels and the refill rate in tickets per second
+    def stats(self):
+
+        refillRate = self.refilledTickets / self.refillSeconds \
+                     if self.refillSeconds else 0.0
+
+        return {"hits": self.hits,
+                "misses": self.misses,
+                "refilledTickets": self.refilledTickets,
+                "refillRate": round(refillRate, 1),
+                "levels": {lotteryType: len(ticketQueue) for lotteryType,
+                           ticketQueue in self.tickets.items()}}
+
+
+#Creates the reservoir of this process when --reservoir is given
+def startReservoir(userArgs):
+
+    global ticketReservoir
+
+    if not userArgs.get("reservoir"):
+
+        return
+
+    #Forked children would each serve a copy of the same reservoir
+    if userArgs["engine"] == "fork":
+
+        logger.info("The ticket reservoir needs the asyncio or prefork engine,"
+                    " generating tickets inline")
+        return
+
+    ticketReservoir = TicketReservoir(userArgs["reservoirLow"],
+                                      userArgs["reservoirHigh"],
+                                      tuple(gameRegistry)).start()
+
+
+#Decides whether a new connection is served or shed with a busy reply
+class AdmissionControl:
+
+    def __init__(self, maxInFlight=0, rateLimit=0, rateBurst=10):
+
+        self.maxInFlight = maxInFlight
+        self.rateLimit = rateLimit
+        self.rateBurst = max(1, rateBurst)
+
+        #Connections this process is serving, kept up to date by the engine
+        self.inFlight = 0
+
+        #Maps a client address to its tokens and when they were counted
+        self.rateBuckets = {}
+
+    #Returns the seconds a client should wait, or None to serve it
+    def check(self, userAddress):
+
+        if self.maxInFlight and self.inFlight >= self.maxInFlight:
+
+            countMetric("shed_busy_total")
+            return BUSY_RETRY_AFTER
+
+        if not self.rateLimit:
+
+            return None
+
+        #Unix socket peers have no address and share one bucket
+        clientAddress = userAddress[0] if isinstance(userAddress, tuple) \
+                        else "local"
+
+        currentTime = time.monotonic()
+
+        numTokens, lastTime = self.rateBuckets.get(clientAddress,
+                                                   (self.rateBurst,
+                                                    currentTime))
+
+        numTokens = min(self.rateBurst,
+                        numTokens + (currentTime - lastTime) * self.rateLimit)
+
+        if numTokens < 1:
+
+            self.rateBuckets[clientAddress] = (numTokens, currentTime)
+            countMetric("shed_rate_limited_total")
+
+            return (1 - numTokens) / self.rateLimit
+
+        self.rateBuckets[clientAddress] = (numTokens - 1, currentTime)
+
+        if len(self.rateBuckets) > MAX_RATE_BUCKETS:
+
+            self.pruneBuckets(currentTime)
+
+        return None
+
+    #Forgets addresses whose bucket has refilled, they start full anyway
+    def pruneBuckets(self, currentTime):
+
+        self.rateBuckets = {clientAddress: (numTokens, lastTime)
+                            for clientAddress, (numTokens, lastTime)
+                            in self.rateBuckets.items()
+                            if numTokens + (currentTime - lastTime) *
+                            self.rateLimit < self.rateBurst}
+
+    #Checks a blocking client socket, answering busy and closing it if shed
+    def admit(self, clientSocket, userAddress):
+
+        retryAfter = self.check(userAddress)
+
+        if retryAfter is None:
+
+            return True
+
+        #Never waits on a slow client, the busy line fits any send buffer
+        try:
+
+            clientSocket.setblocking(False)
+            clientSocket.send(Protocol.packBusy(retryAfter))
+
+        except OSError:
+
+            pass
+
+        clientSocket.close()
+        logConnection(f"Shed connection from {userAddress}, retry after "
+                      f"{retryAfter:.2f} seconds")
+
+        return False
+
+
+#Creates the admission checks of the engine about to start
+def startAdmission(userArgs):
+
+    global admissionControl
+
+    rateLimit = userArgs.get("rateLimit", 0)
+    rateBurst = userArgs.get("rateBurst", 10)
+
+    #Workers take turns accepting from the shared listeners, so every worker
+    #enforces its share of the limit
+    if userArgs["engine"] == "prefork":
+
+        numWorkers = poolSize(userArgs)
+        rateLimit /= numWorkers
+        rateBurst /= numWorkers
+
+    admissionControl = AdmissionControl(userArgs.get("maxInFlight", 0),
+                                        rateLimit, rateBurst)
+
+
+#Counters, gauges and histograms in memory shared by every serving process
+class MetricsRegistry:
+
+    def __init__(self, lotteryTypes):
+
+        self.fieldIndex = {metricName: fieldNum for fieldNum,
+                           (metricName, metricType, metricHelp)
+                           in enumerate(METRIC_FIELDS)}
+
+        #Each game has a count per bucket, an overflow count and a sum in
+        #microseconds after the plain metrics
+        self.histogramIndex = {}
+
+        for lotteryType in lotteryTypes:
+
+            self.histogramIndex[lotteryType] = len(METRIC_FIELDS) + \
+                len(self.histogramIndex) * (len(GENERATE_BUCKETS) + 2)
+
+        self.numFields = len(METRIC_FIELDS) + \
+                         len(lotteryTypes) * (len(GENERATE_BUCKETS) + 2)
+
+        #Anonymous shared mapping, inherited by every process forked later
+        self.sharedMemory = mmap.mmap(-1, METRIC_SLOTS * self.numFields * 8)
+        self.values = memoryview(self.sharedMemory).cast("q")
+
+        self.slotOffset = 0
+
+        #Guards the shared slot, a slot of its own is only written by one
+        #process
+        self.sharedLock = multiprocessing.Lock()
+        self.slotLock = contextlib.nullcontext()
+
+    #Chooses the slot this process writes to, slot 0 is the main process and
+    #slot numbers past the last one share it
+    def useSlot(self, slotNum):
+
+        slotNum = min(slotNum, SHARED_SLOT)
+
+        self.slotOffset = slotNum * self.numFields
+        self.slotLock = self.sharedLock if slotNum == SHARED_SLOT else \
+                        contextlib.nullcontext()
+
+    #Adds to a counter or gauge of this process
+    def add(self, metricName, amount=1):
+
+        with self.slotLock:
+
+            self.values[self.slotOffset + self.fieldIndex[metricName]] += \
+                amount
+
+    #Sets a gauge of this process
+    def set(self, metricName, value):
+
+        self.values[self.slotOffset + self.fieldIndex[metricName]] = value
+
+    #Records one generateNumbers call in the histogram of its game
+    def observeGenerate(self, lotteryType, seconds):
+
+        histogramStart = self.slotOffset + self.histogramIndex[lotteryType]
+
+        with self.slotLock:
+
+            self.values[histogramStart + bisect.bisect_left(
+                        GENERATE_BUCKETS, seconds)] += 1
+            self.values[histogramStart + len(GENERATE_BUCKETS) + 1] += \
+                int(seconds * 1e6)
+
+    #Sums one field over every process slot
+    def total(self, fieldNum):
+
+        return sum(self.values[slotNum * self.numFields + fieldNum]
+                   for slotNum in range(METRIC_SLOTS))
+
+    #Renders every metric in the Prometheus text format
+    def render(self):
+
+        outputLines = []
+
+        for fieldNum, (metricName, metricType, metricHelp) in \
+                enumerate(METRIC_FIELDS):
+
+            outputLines.append(f"# HELP lottery_{metricName} {metricHelp}")
+            outputLines.append(f"# TYPE lottery_{metricName} {metricType}")
+            outputLines.append(f"lottery_{metricName} {self.total(fieldNum)}")
+
+        outputLines.append("# HELP lottery_generate_seconds generateNumbers "
+                           "latency by game")
+        outputLines.append("# TYPE lottery_generate_seconds histogram")
+
+        for lotteryType, histogramStart in self.histogramIndex.items():
+
+            #Prometheus buckets are cumulative
+            bucketCount = 0
+
+            for bucketNum, upperBound in enumerate(GENERATE_BUCKETS +
+                                                   ("+Inf",)):
+
+                bucketCount += self.total(histogramStart + bucketNum)
+                outputLines.append(f'lottery_generate_seconds_bucket{{game='
+                                   f'"{lotteryType}",le="{upperBound}"}} '
+                                   f'{bucketCount}')
+
+            secondsSum = self.total(histogramStart + len(GENERATE_BUCKETS) +
+                                    1) / 1e6
+
+            outputLines.append(f'lottery_generate_seconds_sum{{game='
+                               f'"{lotteryType}"}} {secondsSum}')
+            outputLines.append(f'lottery_generate_seconds_count{{game='
+                               f'"{lotteryType}"}} {bucketCount}')
+
+        return "\n".join(outputLines) + "\n"
+
+
+#Adds to a metric when metrics are enabled
+def countMetric(metricName, amount=1):
+
+    if serverMetrics is not None:
+
+        serverMetrics.add(metricName, amount)
+
+
+#Sets a gauge when metrics are enabled
+def setMetric(metricName, value):
+
+    if serverMetrics is not None:
+
+        serverMetrics.set(metricName, value)
+
+
+#Answers metrics scrapes with the aggregated registry, mixed into an HTTP
+#request handler by the metrics process so only it loads http.server
+class MetricsRoutes:
+
+    def do_GET(self):
+
+        if self.path.split("?")[0] != "/metrics":
+
+            self.send_error(404)
+            return
+
+        responseBody = serverMetrics.render().encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(responseBody)))
+        self.end_headers()
+        self.wfile.write(responseBody)
+
+    #Changes profiling settings of the running daemon
+    def do_POST(self):
+
+        routePath, _, queryText = self.path.partition("?")
+
+        if profilingControl is None or routePath not in ADMIN_ROUTES:
+
+            self.send_error(404)
+            return
+
+        try:
+
+            responseBody = ADMIN_ROUTES[routePath](dict(
+                                urllib.parse.parse_qsl(queryText))) \
+                           .encode("utf-8")
+
+        except (KeyError, ValueError, OSError) as e:
+
+            self.send_error(400, f"Bad admin request: {e}")
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain")
+        self.send_header("Content-Length", str(len(responseBody)))
+        self.end_headers()
+        self.wfile.write(responseBody)
+
+    #Scrapes are not written to the daemon log
+    def log_message(self, logFormat, *logArgs):
+
+        pass
+
+
+#Creates the shared registry and serves it from its own process
+def startMetrics(userArgs):
+
+    global serverMetrics
+
+    if not userArgs.get("metricsPort"):
+
+        return
+
+    serverMetrics = MetricsRegistry(tuple(gameRegistry))
+
+    parentID = os.getpid()
+    processID = os.fork()
+
+    #Endpoint process serves scrapes until the serving process goes away
+    if processID == 0:
+
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+
+        #Request handler answering the metrics and admin routes
+        class MetricsHandler(MetricsRoutes,
+                             http.server.BaseHTTPRequestHandler):
+
+            pass
+
+        try:
+
+            #The endpoint of a generation replaced by a reload keeps the port
+            #until that generation has drained
+            while True:
+
+                try:
+
+                    httpServer = http.server.HTTPServer(
+                            (userArgs["metricsAddress"],
+                             userArgs["metricsPort"]), MetricsHandler)
+                    break
+
+                except OSError as e:
+
+                    if readyPipe is None or e.errno != errno.EADDRINUSE or \
+                            os.getppid() != parentID:
+
+                        raise
+
+                    time.sleep(1)
+
+            httpServer.timeout = 1
+
+            while os.getppid() == parentID:
+
+                httpServer.handle_request()
+
+        except OSError as e:
+
+            logger.info(f"Could not serve metrics, error code: {e}")
+
+        finally:
+
+            os._exit(0)
+
+    helperProcesses.add(processID)
+
+    logger.info(f"Serving metrics on {userArgs['metricsAddress']} port "
+                f"{userArgs['metricsPort']}")
+
+
+#Creates the shared profiling settings, opens the trace file and installs the
+#signals that switch profiling and tracing while the daemon runs
+def startProfiling(userArgs):
+
+    global profilingControl, profileSession, traceFile
+
+    if not userArgs.get("profileDir"):
+
+        return
+
+    os.makedirs(userArgs["profileDir"], exist_ok=True)
+
+    profilingControl = Profiling.ProfilingControl(userArgs["traceRate"],
+                                                  userArgs["profileSeconds"])
+    profileSession = Profiling.ProfileSession(userArgs["profileDir"])
+
+    #The serving process takes the first slot of the pid table, workers and
+    #children add themselves after they fork
+    profilingControl.register(0)
+
+    traceFile = os.open(os.path.join(userArgs["profileDir"], "traces.jsonl"),
+                        os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o640)
+
+    #Every forked process inherits the handlers, a signal profiles only the
+    #process it was sent to
+    signal.signal(signal.SIGUSR1, profileHandler)
+    signal.signal(signal.SIGUSR2, traceHandler)
+
+    logger.info(f"Profiles and request traces go to {userArgs['profileDir']}, "
+                f"tracing {profilingControl.traceRate:.2%} of requests")
+
+
+#Profiles this process for the shared duration, or stops and writes out a
+#profile already running
+def profileHandler(signalNumber, signalFrame):
+
+    if profileSession.running():
+
+        profilePath = profileSession.stop()
+        logger.info(f"Profile of pid {os.getpid()} written to {profilePath}")
+        return
+
+    profileSession.start(profilingControl.profileSeconds)
+    logger.info(f"Profiling pid {os.getpid()} for "
+                f"{profilingControl.profileSeconds:g} seconds")
+
+
+#Switches request tracing off, or back on at its last rate, in every process
+def traceHandler(signalNumber, signalFrame):
+
+    traceRate = profilingControl.toggleTracing()
+    logger.info(f"Tracing {traceRate:.2%} of requests")
+
+
+#Starts a trace for a new request when it is sampled
+def sampleTrace():
+
+    if profilingControl is None or \
+            traceSampler.random() >= profilingControl.traceRate:
+
+        return None
+
+    return Profiling.RequestTrace()
+
+
+#Records that a phase of the sampled request ended, with the fields of a
+#parsed request when they are known
+def markTrace(phaseName, dataDecoded=None):
+
+    requestTrace = currentTrace.get()
+
+    if requestTrace is None:
+
+        return
+
+    requestTrace.mark(phaseName)
+
+    if isinstance(dataDecoded, dict):
+
+        requestTrace.describe(**requestSummary(dataDecoded))
+
+
+#Fields identifying a text request or binary frame in its trace
+def requestSummary(dataDecoded):
+
+    if "frameType" in dataDecoded:
+
+        requestFields = {"protocol": "binary"}
+
+        if dataDecoded["frameType"] == Protocol.FRAME_BULK:
+
+            requestFields["bulk"] = True
+
+    else:
+
+        requestFields = {"protocol": "text"}
+
+        if isinstance(dataDecoded.get("orders"), list):
+
+            requestFields["orders"] = len(dataDecoded["orders"])
+
+    for fieldName in ("uniqueID", "lotteryType", "numTickets"):
+
+        if dataDecoded.get(fieldName) is not None:
+
+            requestFields[fieldName] = dataDecoded[fieldName]
+
+    return requestFields
+
+
+#Appends the trace of a request that was answered to the trace file
+def finishTrace():
+
+    requestTrace = currentTrace.get()
+
+    if requestTrace is None:
+
+        return
+
+    currentTrace.set(None)
+
+    #Lines are written whole with O_APPEND, so processes never interleave
+    try:
+
+        os.write(traceFile, requestTrace.encode())
+
+    except OSError as e:
+
+        logger.info(f"Could not write request trace, error code: {e}")
+
+
+#Starts or stops a profile of a process of this daemon, the daemon itself
+#unless a pid is given
+def adminProfile(routeArgs):
+
+    processID = int(routeArgs.get("pid", os.getppid()))
+
+    #Only processes the daemon registered itself may be signalled
+    if not profilingControl.isRegistered(processID):
+
+        raise ValueError(f"pid {processID} is not a process of this daemon")
+
+    #The duration is shared, later runs started by a signal use it too
+    if "seconds" in routeArgs:
+
+        profilingControl.profileSeconds = float(routeArgs["seconds"])
+
+    os.kill(processID, signal.SIGUSR1)
+
+    return f"Signalled pid {processID} to start or stop profiling for " \
+           f"{profilingControl.profileSeconds:g} seconds\n"
+
+
+#Sets the fraction of requests traced by every process
+def adminTrace(routeArgs):
+
+    profilingControl.traceRate = float(routeArgs["rate"])
+
+    return f"Tracing {profilingControl.traceRate:.2%} of requests\n"
+
+
+#Admin requests accepted by the metrics endpoint when profiling is enabled
+ADMIN_ROUTES = {"/admin/profile": adminProfile, "/admin/trace": adminTrace}
+
+
+#Logs a per-connection message, sampled by the log writer under load
+def logConnection(logMessage):
+
+    logger.info(logMessage, extra={"connectionLog": True}, stacklevel=2)
+
+
+#Sends formatted records to the log writer without ever blocking
+class LogPipeHandler(logging.Handler):
+
+    def __init__(self, pipeWrite):
+
+        super().__init__()
+
+        self.pipeWrite = pipeWrite
+
+    def emit(self, logRecord):
+
+        try:
+
+            logKind = b"C" if getattr(logRecord, "connectionLog", False) \
+                      else b"L"
+
+            logLine = self.format(logRecord).encode("utf-8", "replace")
+            logLine = logLine[:select.PIPE_BUF - LOG_RECORD.size]
+
+            os.write(self.pipeWrite, LOG_RECORD.pack(len(logLine), logKind) +
+                     logLine)
+
+        #Drops the record rather than stall the accept loop
+        except BlockingIOError:
+
+            countMetric("log_records_dropped_total")
+
+        except Exception:
+
+            self.handleError(logRecord)
+
+
+#Batches records from every serving process into the rotating log file
+def writeLogs(userArgs, pipeRead):
+
+    fileHandler = logging.handlers.RotatingFileHandler(
+        userArgs["logFile"], maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS)
+
+    #Records arrive formatted, a batch is written as one message
+    fileHandler.terminator = ""
+
+    logFormatter = logzero.LogFormatter(color=False)
+
+    dataReceived = bytearray()
+    logBatch = []
+
+    windowStart = time.monotonic()
+    windowCount = 0
+    sampledOut = 0
+
+    while True:
+
+        readable, _, _ = select.select([pipeRead], [], [], 0.25)
+
+        chunk = os.read(pipeRead, 65536) if readable else None
+
+        if chunk:
+
+            dataReceived += chunk
+
+        #Starts a new sampling window every second
+        if time.monotonic() - windowStart >= 1:
+
+            if sampledOut:
+
+                logBatch.append(logFormatter.format(logging.makeLogRecord({
+                    "msg": f"Sampled out {sampledOut} connection messages",
+                    "levelno": logging.INFO, "levelname": "INFO",
+                    "module": "Server", "lineno": 0})))
+
+            windowStart = time.monotonic()
+            windowCount = 0
+            sampledOut = 0
+
+        while len(dataReceived) >= LOG_RECORD.size:
+
+            lineLength, logKind = LOG_RECORD.unpack_from(dataReceived)
+
+            if len(dataReceived) < LOG_RECORD.size + lineLength:
+
+                break
+
+            logLine = dataReceived[LOG_RECORD.size:
+                                   LOG_RECORD.size + lineLength]
+            del dataReceived[:LOG_RECORD.size + lineLength]
+
+            #Past the burst only 1 in logSample connection messages is kept
+            if logKind == b"C":
+
+                windowCount += 1
+
+                if windowCount > userArgs["logBurst"] and \
+                        windowCount % max(1, userArgs["logSample"]):
+
+                    sampledOut += 1
+                    continue
+
+            logBatch.append(logLine.decode("utf-8", "replace"))
+
+        #Flushes whenever the pipe has been drained or went quiet
+        if logBatch and (not readable or len(logBatch) >= 1000):
+
+            fileHandler.emit(logging.makeLogRecord(
+                {"msg": "\n".join(logBatch) + "\n"}))
+            logBatch.clear()
+
+        #Every serving process closed its end of the pipe
+        if chunk == b"":
+
+            fileHandler.close()
+            return
+
+
+#Moves logging of this process and its future children to a writer process
+def startLogQueue(userArgs):
+
+    if not userArgs.get("logQueue"):
+
+        return
+
+    pipeRead, pipeWrite = os.pipe()
+
+    processID = os.fork()
+
+    #Writer process keeps draining until every writer is gone
+    if processID == 0:
+
+        os.close(pipeWrite)
+
+        #Stopping the process group must not lose records still in the pipe
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+
+            writeLogs(userArgs, pipeRead)
+
+        finally:
+
+            os._exit(0)
+
+    os.close(pipeRead)
+    os.set_blocking(pipeWrite, False)
+    helperProcesses.add(processID)
+
+    #Serving processes stop writing to the log file themselves
+    pipeHandler = LogPipeHandler(pipeWrite)
+    pipeHandler.setFormatter(logzero.LogFormatter(color=False))
+
+    logzero.logfile(None)
+    logger.addHandler(pipeHandler)
+
+    logger.info(f"Shipping logs to writer process with pid {processID}")
+
+
+#Forks the ledger writer that every serving process sends issued tickets to
+def startLedger(userArgs):
+
+    global ledgerPipe
+
+    if not userArgs.get("ledgerFile"):
+
+        return
+
+    for game in gameRegistry.values():
+
+        Ledger.checkGame(game)
+
+    #Opened here first so a bad path or foreign file stops the daemon
+    os.close(Ledger.openLedger(userArgs["ledgerFile"]))
+
+    pipeRead, pipeWrite = os.pipe()
+
+    processID = os.fork()
+
+    #Writer process appends until every serving process is gone
+    if processID == 0:
+
+        os.close(pipeWrite)
+
+        #Stopping the process group must not lose records still in the pipe
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        try:
+
+            Ledger.writeLedger(userArgs["ledgerFile"], pipeRead,
+                               userArgs.get("ledgerSyncMS", 50) / 1000)
+
+        except OSError as e:
+
+            logger.info(f"Ledger writer stopped, error code: {e}")
+
+        finally:
+
+            os._exit(0)
+
+    os.close(pipeRead)
+    helperProcesses.add(processID)
+
+    #Records are never dropped, a larger pipe lets bursts through unblocked
+    try:
+
+        fcntl.fcntl(pipeWrite, fcntl.F_SETPIPE_SZ, 1 << 20)
+
+    except (AttributeError, OSError):
+
+        pass
+
+    ledgerPipe = pipeWrite
+
+    logger.info(f"Recording issued tickets in {userArgs['ledgerFile']} "
+                f"through writer process with pid {processID}")
+
+
+#Buffers response chunks and sends them once enough bytes are waiting, the
+#whole response must be sent within writeTimeout seconds
+class ResponseWriter:
+
+    def __init__(self, clientSocket, bufferSize=65536,
+                 writeTimeout=None):
+
+        self.clientSocket = clientSocket
+        self.bufferSize = bufferSize
+
+        #Fragments waiting to be sent together and their total length
+        self.fragments = []
+        self.numBytes = 0
+
+        #Monotonic time the response must be sent by, if any
+        self.deadline = None if writeTimeout is None else \
+                        time.monotonic() + writeTimeout
+
+    #Queues bytes, large writes are sent straight from the caller's buffer
+    def write(self, data):
+
+        if self.numBytes + len(data) >= self.bufferSize or \
+                len(self.fragments) >= SEND_FRAGMENTS:
+
+            self.fragments.append(data)
+            self.flush()
+
+        #Reusable buffers change once the caller moves on, so they are copied
+        else:
+
+            self.fragments.append(bytes(data) if isinstance(data, bytearray)
+                                  else data)
+            self.numBytes += len(data)
+
+    #Sends every queued fragment with one scatter-gather call per pass,
+    #sendmsg blocks while the client is slow to read
+    def flush(self):
+
+        sendStart = time.perf_counter()
+        sendFragments = [memoryview(data) for data in self.fragments]
+
+        while sendFragments:
+
+            #A client reading a byte at a time cannot stretch a response
+            #forever
+            if self.deadline is not None:
+
+                timeLeft = self.deadline - time.monotonic()
+
+                if timeLeft <= 0:
+
+                    raise TimeoutError("Response was not sent in time")
+
+                self.clientSocket.settimeout(timeLeft)
+
+            numSent = self.clientSocket.sendmsg(sendFragments)
+            countMetric("bytes_sent_total", numSent)
+
+            #Drops fragments sent in full and trims a partly sent one
+            while sendFragments and numSent >= len(sendFragments[0]):
+
+                numSent -= len(sendFragments.pop(0))
+
+            if numSent:
+
+                sendFragments[0] = sendFragments[0][numSent:]
+
+        self.fragments.clear()
+        self.numBytes = 0
+
+        requestTrace = currentTrace.get()
+
+        if requestTrace is not None:
+
+            requestTrace.addSince("send", sendStart)
+
+    #Writes every chunk of a response and flushes it
+    def writeAll(self, responseChunks):
+
+        for data in responseChunks:
+
+            self.write(data)
+
+        self.flush()
+
 
-    #Adds "-l" switch to choose the address to listen for incoming connections
-    parser.add_argument("-l", help="Listen on socket address", type=str, 
-                        dest="socketAddress", default="127.0.0.1", 
-                        required=False)
+#Buffers response chunks for an asyncio stream and waits when it backs up,
+#the whole response must be sent within the write timeout
+class AsyncResponseWriter:
 
-    #Adds "-p" switch to choose socket port for listening
-    parser.add_argument("-p", help="Listen on socket port", type=int, 
-                        dest="socketPort", default=1234, required=False)
+    def __init__(self, writer, bufferSize=65536):
 
-    parser.add_argument("actionCommand", nargs='?', default="status")
+        self.writer = writer
+        self.bufferSize = bufferSize
+        self.buffer = bytearray()
 
-    args = parser.parse_args()
+        #Monotonic time the response must be sent by
+        self.deadline = time.monotonic() + serverOptions["writeTimeout"]
 
-    #Returns arguments passed
-    return args
+    #Writes every chunk of a response, pausing for the client between chunks
+    async def writeAll(self, responseChunks):
 
+        for data in responseChunks:
 
-##Select numbers from diminishing pool for each ticket
-def generateNumbers(userArgs):
+            #Small chunks are coalesced so one response leaves as one write
+            self.buffer += data
 
-    #Error handling and exits program for invalid number of tickets        
-    if userArgs["numTickets"] <= 0:
+            if len(self.buffer) >= self.bufferSize:
 
-        logger.info("The number of tickets must be greater than 0.")
-        os._exit(0)
+                #Sending waits while the transport buffer is full, the sleep
+                #lets other connections run between chunks of large orders
+                await self.send()
+                await asyncio.sleep(0)
 
-    else:
+        await self.send()
 
-        #Stores rules based on lottery type chosen
-        gameRules = lotteryRules(userArgs)
+    #Hands the buffered bytes to the transport and waits for it to drain
+    async def send(self):
 
-        #Initalizes list to store selected numbers
-        numSelected = []
+        sendStart = time.perf_counter()
 
-        #Lottery type with highest number, numbers per set, and sets per ticket
-        ticketType = {"max": [50, 7, 3],
-                    "649": [49, 6, 1],
-                    "lot": [45, 6, 2]}
+        self.writer.write(bytes(self.buffer))
+        countMetric("bytes_sent_total", len(self.buffer))
+        self.buffer.clear()
+        await self.drain()
 
-        #Stores value of highest number allowed for lottery type
-        try:
+        requestTrace = currentTrace.get()
 
-            highestNum = int(ticketType[userArgs['lotteryType']][0])
+        if requestTrace is not None:
 
-        #Error handling for casting
-        except ValueError as e:
+            requestTrace.addSince("send", sendStart)
 
-            logger.info(f"Can't cast {ticketType[userArgs['lotteryType']][0]}",
-                "as integer.")
-        
-        #Stores value for amount of numbers per set
-        try:  
+    #Waits for the transport buffer to empty, a client that has not read
+    #the response by its deadline is dropped
+    async def drain(self):
 
-            numberPerSet = int(ticketType[userArgs['lotteryType']][1])
+        await asyncio.wait_for(self.writer.drain(),
+                               max(0, self.deadline - time.monotonic()))
 
-        #Error handling for casting
-        except ValueError as e:
 
-            logger.info(f"Can't cast {ticketType[userArgs['lotteryType']][1]}",
-                "as integer.")
+#Answers pipelined binary requests in order until the session ends
+def handleBinarySession(clientSocket, dataReceived):
 
-        #Stores value for number of sets per ticket
-        try:  
+    frameReader = Protocol.FrameReader(clientSocket, dataReceived,
+                                       MAX_REQUEST_BYTES)
+    maxRequests = max(1, serverOptions["maxRequests"])
 
-            setPerTicket = int(ticketType[userArgs['lotteryType']][2])
-        
-        #Error handling for casting
-        except ValueError as e:
+    for requestNum in range(1, maxRequests + 1):
 
-            logger.info(f"Can't cast {ticketType[userArgs['lotteryType']][2]}",
-                "as integer.")
+        #Every frame after the first is sampled as a request of its own, its
+        #read phase includes the time the session sat idle
+        if requestNum > 1:
 
-        #Creates multiple tickets based on argument provided
-        for i in range(userArgs["numTickets"]):
+            currentTrace.set(sampleTrace())
 
-            #Initalizes list to store selected numbers for each ticket
-            ticketNumbers = [] 
+        #Closes sessions that stay idle longer than the keep-alive timeout,
+        #a frame once started must arrive within the body timeout
+        try:
 
-            #Creates pool of numbers to be randomly chosen for each ticket
-            numbersPool = [number for number in range(1, highestNum + 1)]
+            frame = frameReader.readFrame(serverOptions["keepAliveTimeout"],
+                                          serverOptions["bodyTimeout"])
 
-            #Creates numbers for a set in a ticket
-            for j in range(setPerTicket):
+        except socket.timeout:
 
-                #Initalizes list to store selected numbers for each set
-                setNumbers = []
+            if frameReader.buffer:
 
-                #Picks numbers from diminishing pool using elements in array
-                for k in range(numberPerSet):
+                raise
 
-                    randomNum = random.randint(0, len(numbersPool) - 1) \
-                        if numbersPool else None
-                    
-                    #Picks numbers if pool is not empty
-                    if numbersPool is not None:
+            logger.info(f"Closing idle session after {requestNum - 1} requests")
+            return
 
-                        setNumbers.append(numbersPool[randomNum])
-                        numbersPool.pop(randomNum)
+        #Client closed the session
+        if frame is None:
 
-                    else:
-                        logger.info("The pool of numbers is empty.")
-                        os._exit(0)
+            return
 
-                #Appends sets of numbers to ticket
-                ticketNumbers.append(setNumbers)
+        frameHeader, payload = frame
+        markTrace("read", frameHeader)
 
-            #Appends each ticket into a new list
-            numSelected.append(ticketNumbers)
+        #Last response tells the client to resend any further requests
+        responseWriter = ResponseWriter(clientSocket, writeTimeout=
+                                        serverOptions["writeTimeout"])
+        responseWriter.writeAll(iterateBinaryResponse(frameHeader,
+                                                      requestNum == maxRequests,
+                                                      payload))
+        finishTrace()
 
-        #Returns list containing numbers for each ticket
-        return numSelected, gameRules
-    
 
-#Displays rules ticket type
-def lotteryRules(userArgs):
+#Answers pipelined binary requests in order on the asyncio event loop
+async def handleAsyncBinarySession(reader, writer, dataReceived):
 
-    olgMaxRules = """\nOLG Lotto MAX selected, here are the rules:
-          Each play includes three sets of numbers.
-          Each set consists of seven numbers ranging from 1 to 50.\n\n"""
-    
-    olg649Rules = """\nOLG Lotto 6/49 selected, here are the rules:
-          Each play includes one set of six numbers ranging from 1 to 49.\n\n"""
+    buffer = bytearray(dataReceived)
+    maxRequests = max(1, serverOptions["maxRequests"])
 
-    olgLottarioRules = """\nOLG Lottario selected, here are the rules:
-          Each play includes two sets of numbers. 
-          Each set consists of six numbers from from 1 to 45.\n\n"""
+    for requestNum in range(1, maxRequests + 1):
 
-    if userArgs["lotteryType"] == "max":
+        #Every frame after the first is sampled as a request of its own
+        if requestNum > 1:
 
-        return olgMaxRules
+            currentTrace.set(sampleTrace())
 
-    elif userArgs["lotteryType"] == "649":
+        #Closes sessions that stay idle longer than the keep-alive timeout
+        if not buffer:
 
-        return olg649Rules
+            try:
 
-    elif userArgs["lotteryType"] == "lot":
+                buffer += await asyncio.wait_for(reader.read(65536),
+                                                 serverOptions[
+                                                     "keepAliveTimeout"])
 
-        return olgLottarioRules
+            except asyncio.TimeoutError:
 
-    else:
+                logger.info(f"Closing idle session after {requestNum - 1} "
+                            "requests")
+                return
 
-        print(f"Error: could not find rules for {userArgs['lotteryType']}.")
+            #Client closed the session
+            if not buffer:
 
+                return
 
-#Creates a listener to accept incoming connections
-def createSocket(userArgs):
+        #A frame once started must arrive within the body timeout
+        frame = await asyncio.wait_for(
+                            Protocol.readFrameAsync(reader, buffer,
+                                                    MAX_REQUEST_BYTES),
+                            serverOptions["bodyTimeout"])
 
-    #Creates socket number based on address and port
-    socketNumber = (userArgs["socketAddress"], userArgs["socketPort"])
+        if frame is None:
 
-    #Creates socket object and error handling
-    try:
+            return
 
-        socketObject = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        socketObject.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        frameHeader, payload = frame
+        markTrace("read", frameHeader)
 
-    except socket.error as e:
+        #Last response tells the client to resend any further requests
+        await AsyncResponseWriter(writer).writeAll(iterateBinaryResponse(
+                                                frameHeader,
+                                                requestNum == maxRequests,
+                                                payload))
+        finishTrace()
 
-        logger.info(f"Failed to create socket, error code: {e}.")
-        
 
-    #Binds socket number to socket object to create daemon and error handling
-    try:
+#Checks a parsed request before generating tickets inside a shared process
+def validateRequest(dataDecoded):
 
-        socketObject.bind(socketNumber)
+    if not isinstance(dataDecoded, dict):
 
-    except socket.error as e:
+        raise ValueError(f"request is not a dictionary: {dataDecoded!r}")
 
-        #Bind socket using IPv6 if it fails to bind socket using IPv4
-        try:
+    #A list or dict cannot be looked up in the registry, so the type is
+    #checked first like the unique ID's
+    if not isinstance(dataDecoded.get("lotteryType"), str) or \
+            dataDecoded["lotteryType"] not in gameRegistry:
 
-            socketObject = socket.socket(socket.AF_INET6, socket.SOCK_STREAM, 0)
-            socketObject.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
-            socketObject.bind(socketNumber)
+        raise ValueError(f"unknown lottery type {dataDecoded.get('lotteryType')}")
 
-        except socket.error as e:
+    if not isinstance(dataDecoded.get("numTickets"), int) or \
+            dataDecoded["numTickets"] <= 0:
 
-            logger.info(f"Failed to build IPv6 socket, error code: {e}.")
-            exit()
+        raise ValueError("The number of tickets must be greater than 0.")
 
-    #Listens for incoming connections with a queue up to 5 connections
-    socketObject.listen(5)
-    
-    print(f"\nListening for incoming connections on {userArgs['socketAddress']}"
-        , f"port {userArgs['socketPort']}...")
+    #Every response opens with the unique ID, so it is checked before any
+    #bytes are sent
+    if not isinstance(dataDecoded.get("uniqueID"), str):
 
-    #Listens for incoming connections and executes upon accepted connections
-    while True:
+        raise ValueError("The unique ID must be a string.")
 
-        #Parses socket object for client and host address
-        clientSocket, userAddress = socketObject.accept()
-        logger.info(f"Connection from {userAddress} has been established!")
-        
-        #Signal to handle children and prevent zombie processes
-        signal.signal(signal.SIGCHLD, signalHandler)
+    #Orders the unused sets of a game cannot cover are turned away up front
+    if seenSets is not None:
 
-        #Create child of parent process
-        try:
+        game = gameRegistry[dataDecoded["lotteryType"]]
 
-            processID = os.fork()
+        if seenSets.remaining(game.lotteryType) < \
+                dataDecoded["numTickets"] * game.setPerTicket:
 
-        except OSError as e:
+            raise Uniqueness.ExhaustedError(f"Not enough unused "
+                                            f"{game.lotteryType} sets left")
 
-            logger.info(f"Error: Could not create child, error code: {e}")
-        
-        #Execute instructions for child process
-        if processID == 0:
+    return dataDecoded
 
-            logger.info(f"Starting child with pid {os.getpid()}")
 
-            #Retrieves client args and sends ticket results to client
-            handleChild(clientSocket, userAddress)
-            socketObject.close()
+#Disables Nagle's algorithm on TCP client sockets
+def setNoDelay(clientSocket):
 
-            logger.info(f"Closing child with pid {os.getpid()}")
+    if clientSocket.family in (socket.AF_INET, socket.AF_INET6):
 
-            #Closes child process without cleanup
-            os._exit(0)
+        clientSocket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
-        #Execute instructions for parent process
-        else:
-            
-            #Releases socket and closes connection after child dies
-            handleParent(clientSocket)
-            
 
 #Handles the clients request and returns results in datastream
 def handleChild(clientSocket, userAddress):
 
+    #Responses go out as soon as they are written instead of waiting on ACKs
+    setNoDelay(clientSocket)
+
     responseMessage = ("Welcome to Lottery Ticket Generator!\n")
 
-    #Sends welcome message to connected clients
-    clientSocket.send(bytes(responseMessage, "utf-8"))
-    
     #Listens for incoming commands in existing connections
     while True:
 
-        #Receives data, decodes, and strips trailing new lines
-        dataReceived = clientSocket.recv(4096)        
-        dataDecoded = dataReceived.decode("utf-8")
-        dataDecoded = dataDecoded.rstrip("\n")
+        try:
+
+            #Sends welcome message to connected clients, a client that stops
+            #reading gives up its process after the write timeout
+            clientSocket.settimeout(serverOptions["writeTimeout"])
+            clientSocket.send(bytes(responseMessage, "utf-8"))
+
+            #Receives data from client, idle connections are reaped
+            clientSocket.settimeout(serverOptions["headerTimeout"])
+            dataReceived = clientSocket.recv(MAX_REQUEST_BYTES)
+
+            #Clients speaking the binary protocol open with the frame magic
+            if Protocol.isBinary(dataReceived):
+
+                handleBinarySession(clientSocket, dataReceived)
+
+                clientSocket.close()
+                logConnection(f"Connection from {userAddress} has been "
+                              "closed!")
+                break
+
+            #Requests split across segments are read until they are whole
+            dataReceived = readTextRequest(clientSocket, dataReceived)
+            markTrace("read")
+
+        except socket.timeout as e:
+
+            logConnection(f"Closing slow connection from {userAddress}, "
+                          f"error code: {e}")
+            countMetric("request_timeouts_total")
+            clientSocket.close()
+            return
+
+        except (ValueError, ConnectionError, socket.error) as e:
+
+            logger.info(f"Failed to read request, error code: {e}")
+            countMetric("parse_errors_total")
+            clientSocket.close()
+            return
 
         #Converts data received into dictionary and handles errors
         try:
 
-            dataDecoded = yaml.load(dataDecoded)
+            dataDecoded = parseRequest(dataReceived)
 
         #Quit program and close all socket connections
-        except ValueError as e:
+        except (ValueError, yaml.YAMLError) as e:
 
             logger.info(f"Could not cast as dictionary, error code: {e}")
+            countMetric("parse_errors_total")
             clientSocket.close()
+            break
 
-        #Generates numbers for tickets
-        dataResults, gameRules = generateNumbers(dataDecoded)
+        #Rejects invalid requests without ending the serving process
+        try:
+
+            responseChunks = prepareResponse(dataDecoded)
+            markTrace("parse", dataDecoded)
+
+        except ValueError as e:
 
-        #Counter for tickets per play
-        ticketNum = 1
+            logger.info(f"Invalid request, error code: {e}")
+            countMetric("invalid_requests_total")
+            clientSocket.close()
+            break
 
         #Sends ticket numbers to client and handles errors
         try:
-            
-            responseMessage = gameRules
-            #clientSocket.send(bytes(str(gameRules), "utf-8"))
-            responseMessage += f"Unique ID: {dataDecoded['uniqueID']}\n\n"
 
-            #Loops through each ticket per play 
-            for ticket in dataResults:
+            #Streams response to client while tickets are generated
+            responseWriter = ResponseWriter(clientSocket, writeTimeout=
+                                            serverOptions["writeTimeout"])
+            responseWriter.writeAll(responseChunks)
+            finishTrace()
 
-                responseMessage += "=" * 30
-                responseMessage += f"\nTicket: {ticketNum}\n"
+        except socket.timeout as e:
 
-                #Loops through each set in a ticket
-                for ticketNumbers in ticket:
-                    
-                    responseMessage += str(ticketNumbers)
-                    responseMessage += "\n"
-
-                responseMessage += "\n"
-                ticketNum += 1
+            logConnection(f"Closing slow connection from {userAddress}, "
+                          f"error code: {e}")
+            countMetric("request_timeouts_total")
+            clientSocket.close()
+            return
 
-        #Closes program on error
+        #Closes connection on error
         except socket.error as e:
 
             logger.info(f"Failed to send, error code: {e}.")
             clientSocket.close()
-            quit()
-        
-        #Sends response to client
-        clientSocket.send(bytes(responseMessage, "utf-8"))
+            return
+
+        #Concurrent orders used up the last sets of the game mid-response
+        except Uniqueness.ExhaustedError as e:
+
+            logger.info(f"Failed to generate, error code: {e}.")
+            clientSocket.close()
+            return
 
         #Closes connection after sending results to client
         clientSocket.close()
-        logger.info(f"Connection from {userAddress} has been closed!")
+        logConnection(f"Connection from {userAddress} has been closed!")
         break
+
+
+#Handles a client connection as a coroutine on the asyncio event loop
+async def handleAsyncClient(reader, writer):
+
+    userAddress = writer.get_extra_info("peername")
+
+    #Each connection runs in its own task, so its trace stays its own
+    currentTrace.set(sampleTrace())
+    countMetric("accepts_total")
+    logConnection(f"Connection from {userAddress} has been established!")
+
+    retryAfter = admissionControl.check(userAddress)
+
+    #Answers busy straight away instead of queuing on the event loop
+    if retryAfter is not None:
+
+        writer.write(Protocol.packBusy(retryAfter))
+        writer.close()
+        logConnection(f"Shed connection from {userAddress}, retry after "
+                      f"{retryAfter:.2f} seconds")
+        return
+
+    admissionControl.inFlight += 1
+    countMetric("active_connections")
+
+    #Listening socket was created with protocol 0, so asyncio skips this
+    setNoDelay(writer.get_extra_info("socket"))
+
+    responseMessage = ("Welcome to Lottery Ticket Generator!\n")
+
+    #Sends welcome message to connected clients
+    writer.write(bytes(responseMessage, "utf-8"))
+
+    try:
+
+        #Idle connections are reaped after the header timeout
+        dataReceived = await asyncio.wait_for(reader.read(MAX_REQUEST_BYTES),
+                                              serverOptions["headerTimeout"])
+
+        #Clients speaking the binary protocol open with the frame magic
+        if Protocol.isBinary(dataReceived):
+
+            await handleAsyncBinarySession(reader, writer, dataReceived)
+
+        else:
+
+            #Requests split across segments are read until they are whole
+            dataReceived = await readTextRequestAsync(reader, dataReceived)
+            markTrace("read")
+
+            #Converts data received into a dictionary
+            dataDecoded = parseRequest(dataReceived)
+
+            #Rejects invalid requests apart from ones that could not be
+            #parsed, as the other engines count them
+            try:
+
+                responseChunks = prepareResponse(dataDecoded)
+
+            except ValueError as e:
+
+                logger.info(f"Invalid request, error code: {e}")
+                countMetric("invalid_requests_total")
+                return
+
+            markTrace("parse", dataDecoded)
+
+            #Streams response to client while tickets are generated
+            await AsyncResponseWriter(writer).writeAll(responseChunks)
+            finishTrace()
+
+    #Errors only close this connection, the event loop keeps serving
+    except asyncio.TimeoutError as e:
+
+        logConnection(f"Closing slow connection from {userAddress}, "
+                      f"error code: {e!r}")
+        countMetric("request_timeouts_total")
+
+    #Concurrent orders used up the last sets of the game mid-response
+    except Uniqueness.ExhaustedError as e:
+
+        logger.info(f"Failed to generate, error code: {e}.")
+
+    except (ValueError, yaml.YAMLError) as e:
+
+        logger.info(f"Could not cast as dictionary, error code: {e}")
+        countMetric("parse_errors_total")
+
+    except (ConnectionError, socket.error, asyncio.IncompleteReadError) as e:
+
+        logger.info(f"Failed to send, error code: {e}.")
+
+    #Closes connection after sending results to client
+    finally:
+
+        writer.close()
+
+        #Shutdown cancels handlers that are still closing their connection
+        try:
+
+            await writer.wait_closed()
+
+        except (ConnectionError, socket.error, asyncio.CancelledError):
+
+            pass
+
+        admissionControl.inFlight -= 1
+        countMetric("active_connections", -1)
+        logConnection(f"Connection from {userAddress} has been closed!")
         
 
 #Parent process closes client sockets after child process is executed
@@ -339,6 +3373,15 @@ def handleParent(clientSocket):
     clientSocket.close()
 
 
+#Hands the slot of a reaped fork engine child to the next child, the shared
+#slot is never handed out
+def releaseChildSlot(slotNum):
+
+    if slotNum != SHARED_SLOT:
+
+        freeChildSlots.append(slotNum)
+
+
 #Handles child processes and prevents zombie children        
 def signalHandler(signalNumber, signalFrame): 
 
@@ -357,6 +3400,23 @@ def signalHandler(signalNumber, signalFrame):
 
             return
 
+        slotNum = childProcesses.pop(processID, None)
+
+        #A reaped pid may be reused, so it leaves the table of pids admin
+        #requests may signal
+        if slotNum is not None:
+
+            releaseChildSlot(slotNum)
+
+            if profilingControl is not None:
+
+                profilingControl.unregister(slotNum, processID)
+
+        #Metrics endpoint and log writer processes are not connections
+        if processID not in helperProcesses:
+
+            countMetric("active_connections", -1)
+
 
 #Handles signals for terminating processes
 def sigtermHandler(SignalNumber, signalFrame):
@@ -364,17 +3424,188 @@ def sigtermHandler(SignalNumber, signalFrame):
     raise SystemExit(1)
 
 
+#Starts the next generation on the same listeners, then stops accepting so
+#this one only finishes the connections it already has
+def reloadHandler(signalNumber, signalFrame):
+
+    global reloading, draining
+
+    #Only the process that bound the listeners starts a generation
+    if reloading or listenerPid != os.getpid():
+
+        return
+
+    reloading = True
+
+    try:
+
+        processID, readyRead = spawnGeneration(activeListeners)
+
+    except OSError as e:
+
+        logger.info(f"Reload failed, error code: {e}")
+        reloading = False
+        return
+
+    if not awaitGeneration(processID, readyRead):
+
+        reloading = False
+        return
+
+    draining = True
+    stopAccepting(activeListeners)
+
+    #Prefork workers finish the connection they serve and exit
+    for workerID in workerProcesses:
+
+        os.kill(workerID, signal.SIGHUP)
+
+    #Connections still open when the drain timeout runs out are ended
+    signal.signal(signal.SIGALRM, drainTimeoutHandler)
+    signal.setitimer(signal.ITIMER_REAL, serverOptions["drainTimeout"])
+
+
+#Makes a prefork worker stop accepting once the next generation took over,
+#the connection it is serving is finished first
+def stopWorker(signalNumber, signalFrame):
+
+    global draining
+
+    draining = True
+
+    #Connections queued on the worker's own listeners are reset when they
+    #close, so they are accepted first
+    for socketObject in workerSockets:
+
+        socketObject.setblocking(False)
+
+        try:
+
+            while True:
+
+                pendingConnections.append(socketObject.accept())
+
+        except OSError:
+
+            pass
+
+    stopAccepting(activeListeners)
+
+
+#Ends the processes of a replaced generation still serving connections once
+#the drain timeout runs out
+def drainTimeoutHandler(signalNumber, signalFrame):
+
+    servingProcesses = list(childProcesses) + list(workerProcesses)
+
+    logger.info(f"Drain timeout reached, ending {len(servingProcesses)} "
+                "processes still serving")
+
+    for processID in servingProcesses:
+
+        try:
+
+            os.kill(processID, signal.SIGKILL)
+
+        except ProcessLookupError:
+
+            pass
+
+
+#Starts the serving engine chosen by the user
+def serveEngine(userArgs):
+
+    #Log pipe and metrics memory must exist before any process is forked
+    startGames(userArgs)
+    startUniqueness(userArgs)
+    startCache(userArgs)
+    startRandom(userArgs)
+    startLogQueue(userArgs)
+    startLedger(userArgs)
+    startProfiling(userArgs)
+    startMetrics(userArgs)
+    startAdmission(userArgs)
+
+    if userArgs["engine"] == "asyncio":
+
+        createAsyncSocket(userArgs)
+
+    elif userArgs["engine"] == "prefork":
+
+        createWorkerPool(userArgs)
+
+    else:
+
+        createSocket(userArgs)
+
+
+#Gives a daemon file to its owner, given as USER[:GROUP], and adds the
+#setuid, setgid and sticky bits without spawning a shell
+def setPermissions(filePath, fileOwner=""):
+
+    #Ownership is changed first, since chown clears the setuid bits
+    if fileOwner:
+
+        userName, _, groupName = fileOwner.partition(":")
+
+        try:
+
+            userEntry = pwd.getpwnam(userName)
+            groupID = grp.getgrnam(groupName).gr_gid if groupName else \
+                      userEntry.pw_gid
+
+            os.chown(filePath, userEntry.pw_uid, groupID)
+
+        except KeyError:
+
+            logger.info(f"Could not change owner of {filePath}, unknown "
+                        f"owner {fileOwner}")
+
+        except PermissionError as e:
+
+            logger.info(f"Could not change owner of {filePath}, error code: "
+                        f"{e}")
+
+    os.chmod(filePath, 0o6751 | stat.S_ISVTX)
+
+
+#Removes the PID file unless it names a newer generation of the daemon
+def removePidFile():
+
+    try:
+
+        with open(daemonPidFile) as fileInput:
+
+            if int(fileInput.read()) != os.getpid():
+
+                return
+
+        os.remove(daemonPidFile)
+
+    except (OSError, ValueError):
+
+        pass
+
+
 #Handles start and stop signals for daemonizing application
 def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null', 
                  stderr='/dev/null'):
 
+    global daemonPidFile
+
     #Path of PID file
-    daemonFile = "/var/run/daemon/DPI912_algarcia1.pid"
+    daemonFile = userArgs["pidFile"]
+    serverOptions.update(userArgs)
+    daemonDir = os.path.dirname(daemonFile)
 
     #Starts daemon process if daemon PID file doesn't exist
     if userArgs["actionCommand"] == "start":
 
-        if os.path.exists(daemonFile):
+        #A generation started by a reload is already detached, and the one
+        #it replaces records it in the PID file once it accepts connections
+        handingOver = readyPipe is not None
+
+        if os.path.exists(daemonFile) and not handingOver:
 
             print("Daemon is already running.")
             raise SystemExit(0)
@@ -383,7 +3614,7 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
         try:
             
             #Closes parent for detaching child
-            if os.fork() > 0:
+            if not handingOver and os.fork() > 0:
 
                 raise SystemExit(0)
 
@@ -400,7 +3631,7 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
         try:
 
             #Closes parent for detaching child
-            if os.fork() > 0:
+            if not handingOver and os.fork() > 0:
 
                 raise SystemExit(0)
 
@@ -426,21 +3657,17 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
             os.dup2(fileOutput.fileno(), sys.stderr.fileno())
 
         #Checks if directory to hold daemon PID file exists
-        if not os.path.exists('/var/run/daemon'):
+        if not os.path.exists(daemonDir):
 
             #Create directory for daemon PID file and change permissions
             try:
 
                 os.setuid(0)
                 os.setgid(0)
-                os.mkdir('/var/run/daemon')
-                os.system('sudo chown daemon:daemon /var/run/daemon')
-
-                #Adds setuid and setgid bit to daemon directory
-                os.chmod('/var/run/daemon', 0o6751)   
+                os.mkdir(daemonDir)
 
-                #Adds sticky bit to daemon directory
-                os.system('sudo chmod +t /var/run/daemon')
+                #Adds setuid, setgid and sticky bit to daemon directory
+                setPermissions(daemonDir, userArgs["fileOwner"])
 
                 #Relinquishes elevated privileges
                 os.setuid(1)
@@ -452,26 +3679,41 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
                         f"{os.getpid()}")
 
         #Write PID to file
-        with open(daemonFile, "w") as fileOutput:
+        if not handingOver:
+
+            with open(daemonFile, "w") as fileOutput:
+
+                print(os.getpid(), file=fileOutput)
 
-            print(os.getpid(), file=fileOutput)
+            #Setuid, Setgid, and Sticky bit for daemon PID file
+            setPermissions(daemonFile)
 
-        #Setuid, Setgid, and Sticky bit for daemon PID file
-        os.chmod(daemonFile, 0o6751)
-        os.system(f'sudo chmod +t {daemonFile}')
+        daemonPidFile = daemonFile
 
         logger.info(f"Starting daemon with pid {os.getpid()}")
         connections = userArgs['socketAddress'], userArgs['socketPort']
         logger.info(f"Listening for connections on {connections}")
 
         #Removes daemon PID file if daemon is stopped
-        atexit.register(lambda: os.remove(daemonFile))        
+        atexit.register(removePidFile)
 
-        #Signal handler for termination
+        #Signal handlers for termination and reload
         signal.signal(signal.SIGTERM, sigtermHandler)
+        signal.signal(signal.SIGHUP, reloadHandler)
 
         #Starts application listening for incoming connections
-        createSocket(userArgs)
+        serveEngine(userArgs)
+
+    #Serves in the foreground without a PID file, used by benchmarks and CI
+    elif userArgs["actionCommand"] == "run":
+
+        logger.info(f"Running in the foreground with pid {os.getpid()}")
+
+        #Signal handlers for termination and reload
+        signal.signal(signal.SIGTERM, sigtermHandler)
+        signal.signal(signal.SIGHUP, reloadHandler)
+
+        serveEngine(userArgs)
 
     #Closes daemon if daemon PID file exists
     elif userArgs["actionCommand"] == "stop":
@@ -490,6 +3732,23 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
             print("Daemon not running", file=sys.stderr)
             raise SystemExit(1)
 
+    #Starts a new generation of the daemon on the same listening sockets
+    elif userArgs["actionCommand"] == "reload":
+
+        if os.path.exists(daemonFile):
+
+            #Sends a reload to the pid value stored in daemon pid file
+            with open(daemonFile) as fileOutput:
+
+                os.kill(int(fileOutput.read()), signal.SIGHUP)
+
+            logger.info("Reloading daemon")
+
+        else:
+
+            print("Daemon not running", file=sys.stderr)
+            raise SystemExit(1)
+
     #Checks if daemon PID file exists to determine if daemon is running
     elif userArgs["actionCommand"] == "status":
 
@@ -503,26 +3762,25 @@ def daemonizeApp(userArgs, *, stdin='/dev/null', stdout='/dev/null',
 
     else:
 
-        print(f"Usage: {sys.argv[0]} [start|stop|status]", file=sys.stderr)
+        print(f"Usage: {sys.argv[0]} [start|stop|status|run|reload]",
+              file=sys.stderr)
 
 
 #Executes program if current file is the main file
 if __name__ == "__main__":
 
+    #Parses arguments and converts into dictionary
+    userArgs = vars(programSwitches())
+
     #File path for daemon log file
-    daemonLog = "/var/log/DPI912_algarcia1.log"
+    daemonLog = userArgs["logFile"]
 
     #Creates log file with maximum file size of 1MB and log rotation of 3
-    logzero.logfile(daemonLog, maxBytes=1e6, backupCount=3, 
+    logzero.logfile(daemonLog, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS,
                     disableStderrLogger=True)
 
     #Setuid, Setgid, and Sticky bit for daemon log file
-    os.system(f'sudo chown daemon:daemon {daemonLog}')
-    os.chmod(daemonLog, 0o6751) 
-    os.system(f'sudo chmod +t {daemonLog}')
-
-    #Parses arguments and converts into dictionary
-    userArgs = vars(programSwitches())
+    setPermissions(daemonLog, userArgs["fileOwner"])
 
     daemonizeApp(userArgs)
 
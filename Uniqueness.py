@@ -0,0 +1,220 @@
+#!/usr/bin/python3
+
+#==============================================================================
+ #       Author:  Andy Garcia
+ #     Language:  Python3 (mmap, multiprocessing, math)
+ #   To Compile:  n/a
+ #
+ #-----------------------------------------------------------------------------
+ #
+ #  Description:  Index of every set of numbers the lottery ticket server has
+ #                issued, shared by all of its processes
+ #
+ #        Input:  Compiled games and the sets of numbers drawn for them
+ #
+ #       Output:  Whether a set was already issued
+ #
+ #    Algorithm:  Each set is sorted and ranked with the combinatorial number
+ #                system into a single integer below C(pool size, numbers per
+ #                set), which is its bit in a bitmap per game. The bitmaps
+ #                live in an anonymous shared mapping created before the
+ #                server forks, so every worker sees the same bits. Bits are
+ #                tested and set under one of a fixed number of locks chosen
+ #                by the byte holding the bit, so checks take constant time
+ #                and memory is known when the index is created.
+ #
+ #   Required Features Not Included:  n/a
+ #
+ #   Known Bugs:  Sets drawn for the reservoir or for a connection that fails
+ #                stay marked as issued.
+ #
+ #Classification: A
+ #
+#==============================================================================
+
+import mmap, multiprocessing, math
+
+#Locks guarding the bitmaps, each byte of a bitmap always uses the same lock
+LOCK_STRIPES = 64
+
+#Draws of one ticket before a nearly exhausted game gives up
+MAX_REDRAWS = 1000
+
+
+#Raised when a game has no unused sets left for an order
+class ExhaustedError(ValueError):
+
+    pass
+
+
+#Bitmap layout and ranking table of one game
+class GameIndex:
+
+    def __init__(self, game, bitmapOffset):
+
+        self.lotteryType = game.lotteryType
+        self.numberPerSet = game.numberPerSet
+        self.setPerTicket = game.setPerTicket
+        self.numCombinations = math.comb(game.poolSize, game.numberPerSet)
+        self.bitmapOffset = bitmapOffset
+        self.numBytes = (self.numCombinations + 7) // 8
+
+        #binomials[position][number] is C(number - 1, position + 1), the
+        #weight of a pool number at a position of a sorted set, pool numbers
+        #start at 1 so index 0 is never used
+        self.binomials = [[0] + [math.comb(number - 1, position + 1)
+                                 for number in range(1, game.poolSize + 1)]
+                          for position in range(game.numberPerSet)]
+
+    #Ranks a set among all sets of its size, sorted sets of 1 to n map onto
+    #0 to C(n, k) - 1 without gaps
+    def rank(self, ticketNumbers):
+
+        return sum(positionBinomials[number]
+                   for positionBinomials, number
+                   in zip(self.binomials, sorted(ticketNumbers)))
+
+
+#Issued sets of every game, shared across forked processes
+class SeenSets:
+
+    def __init__(self, gameRegistry, maxBytes):
+
+        self.games = {}
+        bitmapOffset = 0
+
+        for lotteryType, game in gameRegistry.items():
+
+            gameIndex = GameIndex(game, bitmapOffset)
+
+            self.games[lotteryType] = gameIndex
+            bitmapOffset += gameIndex.numBytes
+
+        if bitmapOffset > maxBytes:
+
+            raise ValueError(f"Uniqueness bitmaps need {bitmapOffset} bytes, "
+                             f"more than the {maxBytes} allowed")
+
+        #Sets claimed per lock stripe and game, each counted under its lock
+        self.numGames = len(self.games)
+        counterOffset = bitmapOffset + (-bitmapOffset % 8)
+
+        #Anonymous shared mapping, pages are only backed once they are used
+        self.sharedMemory = mmap.mmap(-1, counterOffset + LOCK_STRIPES *
+                                      self.numGames * 8)
+        self.bitmaps = memoryview(self.sharedMemory)[:bitmapOffset]
+        self.counters = memoryview(self.sharedMemory)[counterOffset:] \
+                        .cast("q")
+
+        self.gameNums = {lotteryType: gameNum
+                         for gameNum, lotteryType in enumerate(self.games)}
+
+        self.locks = [multiprocessing.Lock() for stripeNum in
+                      range(LOCK_STRIPES)]
+
+    #Total bytes of the shared mapping
+    def size(self):
+
+        return len(self.sharedMemory)
+
+    #Marks a set as issued, returns False if it already was
+    def claim(self, lotteryType, ticketNumbers):
+
+        gameIndex = self.games[lotteryType]
+
+        setRank = gameIndex.rank(ticketNumbers)
+        byteNum = gameIndex.bitmapOffset + (setRank >> 3)
+        bitMask = 1 << (setRank & 7)
+        stripeNum = byteNum % LOCK_STRIPES
+
+        with self.locks[stripeNum]:
+
+            if self.bitmaps[byteNum] & bitMask:
+
+                return False
+
+            self.bitmaps[byteNum] |= bitMask
+            self.counters[stripeNum * self.numGames +
+                          self.gameNums[lotteryType]] += 1
+
+        return True
+
+    #Marks a set as unused again
+    def release(self, lotteryType, ticketNumbers):
+
+        gameIndex = self.games[lotteryType]
+
+        setRank = gameIndex.rank(ticketNumbers)
+        byteNum = gameIndex.bitmapOffset + (setRank >> 3)
+        bitMask = 1 << (setRank & 7)
+        stripeNum = byteNum % LOCK_STRIPES
+
+        with self.locks[stripeNum]:
+
+            if self.bitmaps[byteNum] & bitMask:
+
+                self.bitmaps[byteNum] &= ~bitMask & 0xFF
+                self.counters[stripeNum * self.numGames +
+                              self.gameNums[lotteryType]] -= 1
+
+    #Claims every set of a ticket, or none of them
+    def claimTicket(self, lotteryType, ticket):
+
+        for setNum, ticketNumbers in enumerate(ticket):
+
+            if not self.claim(lotteryType, ticketNumbers):
+
+                for claimedNumbers in ticket[:setNum]:
+
+                    self.release(lotteryType, claimedNumbers)
+
+                return False
+
+        return True
+
+    #Number of sets of a game issued so far
+    def issued(self, lotteryType):
+
+        gameNum = self.gameNums[lotteryType]
+
+        return sum(self.counters[stripeNum * self.numGames + gameNum]
+                   for stripeNum in range(LOCK_STRIPES))
+
+    #Number of sets of a game that were never issued
+    def remaining(self, lotteryType):
+
+        return self.games[lotteryType].numCombinations - \
+               self.issued(lotteryType)
+
+    #Keeps the tickets whose sets were never issued and redraws the others,
+    #returns the tickets and how many draws were repeated
+    def keepUnique(self, lotteryType, tickets, drawTickets):
+
+        uniqueTickets = []
+        numRedraws = 0
+        redrawsLeft = MAX_REDRAWS * len(tickets)
+
+        while tickets:
+
+            numDuplicates = 0
+
+            for ticket in tickets:
+
+                if self.claimTicket(lotteryType, ticket):
+
+                    uniqueTickets.append(ticket)
+
+                else:
+
+                    numDuplicates += 1
+
+            if numDuplicates > redrawsLeft:
+
+                raise ExhaustedError(f"No unused {lotteryType} sets left")
+
+            redrawsLeft -= numDuplicates
+            numRedraws += numDuplicates
+
+            tickets = drawTickets(numDuplicates) if numDuplicates else []
+
+        return uniqueTickets, numRedraws